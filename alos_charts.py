@@ -4,6 +4,7 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.express as px
 import streamlit as st
+from chart_cache import compact_figure
 
 @st.cache_data(ttl=3600, show_spinner=False)
 def create_alos_volume_chart(df, selected_granularity, selected_unit, target_items, start_date, end_date, moving_avg_window=30):
@@ -319,7 +320,8 @@ def create_alos_volume_chart(df, selected_granularity, selected_unit, target_ite
         tickfont=dict(size=14)     # 二次Y軸目盛りのフォントサイズを大きく
     )
     
-    return fig, final_df
+    # 長期間の表示では各単位の線を間引いて送る（集計データ final_df は全点のまま）
+    return compact_figure(fig), final_df
 
 @st.cache_data(ttl=3600, show_spinner=False)
 def create_alos_benchmark_chart(df, selected_unit, target_items, start_date, end_date, benchmark_value=None):
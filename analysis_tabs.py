@@ -14,6 +14,8 @@ import logging
 logger = logging.getLogger(__name__)
 import traceback
 from config import EXCLUDED_WARDS
+from row_selection import get_row_selection_index
+from chart_cache import get_cached_figure, aggregate_version
 
 # 統一フィルター関連のインポート
 from unified_filters import (
@@ -40,8 +42,8 @@ try:
     )
     from pdf_generator import create_pdf, create_landscape_pdf
     from forecast import generate_filtered_summaries, create_forecast_dataframe
-    from kpi_calculator import calculate_kpis, analyze_kpi_insights
-    from utils import get_display_name_for_dept
+    from kpi_calculator import calculate_kpis, analyze_kpi_insights, get_unit_summary, UNIT_SUMMARY_SUM_COLUMNS
+    from utils import get_display_name_for_dept, map_dept_display_names
 except ImportError as e:
     st.error(f"必要なモジュールのインポートに失敗しました: {e}")
     display_alos_analysis_tab = None
@@ -57,7 +59,10 @@ except ImportError as e:
     create_forecast_dataframe = None
     calculate_kpis = None
     analyze_kpi_insights = None
+    get_unit_summary = None
+    UNIT_SUMMARY_SUM_COLUMNS = {}
     get_display_name_for_dept = None
+    map_dept_display_names = None
 
 # ===============================================================================
 # メイン関数群（統一フィルター対応版）
@@ -164,20 +169,18 @@ def create_ward_table_section(df_filtered):
             st.warning("指定された期間にデータがありません。")
             return
         
-        from utils import initialize_all_mappings, get_ward_display_name
+        from utils import initialize_all_mappings, map_ward_display_names
         initialize_all_mappings(df_filtered, st.session_state.get('target_data'))
         ward_mapping = st.session_state.get('ward_mapping', {})
         
         if '日付' in df_filtered.columns and not df_filtered['日付'].empty:
-            min_date = df_filtered['日付'].min().date()
-            max_date = df_filtered['日付'].max().date()
-            st.info(f"データ期間: {min_date} ～ {max_date}")
+            min_date, max_date = get_row_selection_index(df_filtered).date_bounds()
+            if min_date is not None:
+                st.info(f"データ期間: {min_date.date()} ～ {max_date.date()}")
         
         ward_summary = calculate_ward_summary(df_filtered)
         if not ward_summary.empty:
-            ward_summary['病棟名'] = ward_summary['病棟コード'].apply(
-                lambda x: get_ward_display_name(x, ward_mapping)
-            )
+            ward_summary['病棟名'] = map_ward_display_names(ward_summary['病棟コード'], ward_mapping)
             cols = ward_summary.columns.tolist()
             if '病棟名' in cols and '病棟コード' in cols:
                 code_idx = cols.index('病棟コード')
@@ -203,16 +206,14 @@ def create_department_table_section(df_filtered):
             return
         
         if '日付' in df_filtered.columns and not df_filtered['日付'].empty:
-            min_date = df_filtered['日付'].min().date()
-            max_date = df_filtered['日付'].max().date()
-            st.info(f"データ期間: {min_date} ～ {max_date}")
+            min_date, max_date = get_row_selection_index(df_filtered).date_bounds()
+            if min_date is not None:
+                st.info(f"データ期間: {min_date.date()} ～ {max_date.date()}")
         
         dept_summary = calculate_department_summary(df_filtered)
         if not dept_summary.empty:
             if get_display_name_for_dept:
-                dept_summary['診療科表示名'] = dept_summary['診療科名'].apply(
-                    lambda x: get_display_name_for_dept(x, default_name=x)
-                )
+                dept_summary['診療科表示名'] = map_dept_display_names(dept_summary['診療科名'])
                 cols = dept_summary.columns.tolist()
                 if '診療科表示名' in cols and '診療科名' in cols:
                     name_idx = cols.index('診療科名')
@@ -300,105 +301,75 @@ def create_table_format_dict(summary_df):
     return format_dict
 
 def create_csv_download_button(summary_df, df_filtered, data_type):
-    """CSV ダウンロードボタン作成"""
+    """CSV ダウンロードボタン作成（期間はサマリーの attrs、なければデータから取得）"""
     csv_data = summary_df.to_csv(index=False).encode('utf-8-sig')
     period_str = "全期間"
-    if '日付' in df_filtered.columns and not df_filtered['日付'].empty:
-        min_date = df_filtered['日付'].min().date()
-        max_date = df_filtered['日付'].max().date()
-        period_str = f"{min_date}_{max_date}"
+    min_date, max_date = summary_df.attrs.get('start_date'), summary_df.attrs.get('end_date')
+    if (min_date is None or max_date is None) and '日付' in df_filtered.columns and not df_filtered['日付'].empty:
+        min_date, max_date = get_row_selection_index(df_filtered).date_bounds()
+    if min_date is not None and max_date is not None:
+        period_str = f"{min_date.date()}_{max_date.date()}"
     st.download_button(
         label=f"{data_type}をCSVダウンロード", data=csv_data,
         file_name=f"{data_type}_{period_str}.csv", mime="text/csv",
         key=f"csv_download_btn_{data_type.replace(' ', '_')}"
     )
 
+def _warn_missing_summary_columns(df, unit_column, unit_label):
+    """サマリー計算に必要な列の不足を警告する（不足列の値は 0 として集計される）"""
+    required_cols = [unit_column, '日付'] + list(UNIT_SUMMARY_SUM_COLUMNS.values())
+    missing = [col for col in required_cols if col not in df.columns]
+    if missing:
+        logger.error(f"{unit_label}サマリー計算に必要な列が不足: {missing}")
+        st.warning(f"{unit_label}サマリー計算に必要な列が不足しています: {', '.join(missing)}。一部指標が計算できません。")
+    return unit_column in df.columns
+
 def calculate_ward_summary(df):
-    """病棟別サマリー計算"""
+    """病棟別サマリー計算（除外病棟を除く、データ・フィルターごとにキャッシュ）"""
     try:
-        # 除外病棟をフィルタリング
-        if '病棟コード' in df.columns:
-            df = df[~df['病棟コード'].isin(EXCLUDED_WARDS)]
-
-        required_cols = ['病棟コード', '日付', '入院患者数（在院）', '総入院患者数', '総退院患者数', '緊急入院患者数', '死亡患者数']
-        if not all(col in df.columns for col in required_cols):
-            missing = [col for col in required_cols if col not in df.columns]
-            logger.error(f"病棟別サマリー計算に必要な列が不足: {missing}")
-            st.warning(f"病棟別サマリー計算に必要な列が不足しています: {', '.join(missing)}。一部指標が計算できません。")
-            for m_col in missing:
-                if m_col not in ['病棟コード', '日付']: 
-                    df[m_col] = 0
-
-        ward_groups = df.groupby('病棟コード', observed=True)
-        ward_summary_data = {
-            '病棟コード': ward_groups['病棟コード'].first(),
-            '期間日数': ward_groups['日付'].nunique(),
-            '延べ在院患者数': ward_groups['入院患者数（在院）'].sum() if '入院患者数（在院）' in df.columns else 0,
-            '総入院患者数': ward_groups['総入院患者数'].sum() if '総入院患者数' in df.columns else 0,
-            '総退院患者数': ward_groups['総退院患者数'].sum() if '総退院患者数' in df.columns else 0,
-            '緊急入院患者数': ward_groups['緊急入院患者数'].sum() if '緊急入院患者数' in df.columns else 0,
-            '死亡患者数': ward_groups['死亡患者数'].sum() if '死亡患者数' in df.columns else 0,
-        }
-        ward_summary = pd.DataFrame(ward_summary_data).reset_index(drop=True)
-        
-        ward_summary['平均在院患者数'] = ward_summary.apply(
-            lambda row: row['延べ在院患者数'] / row['期間日数'] if row['期間日数'] > 0 else 0, axis=1)
-        ward_summary['平均在院日数'] = ward_summary.apply(
-            lambda row: row['延べ在院患者数'] / ((row['総入院患者数'] + row['総退院患者数']) / 2) 
-            if (row['総入院患者数'] + row['総退院患者数']) > 0 else 0, axis=1)
-        ward_summary['病床回転率'] = ward_summary.apply(
-            lambda row: row['総退院患者数'] / row['平均在院患者数'] if row['平均在院患者数'] > 0 else 0, axis=1)
-        ward_summary['緊急入院率'] = ward_summary.apply(
-            lambda row: (row['緊急入院患者数'] / row['総入院患者数'] * 100) if row['総入院患者数'] > 0 else 0, axis=1)
-        ward_summary['死亡率'] = ward_summary.apply(
-            lambda row: (row['死亡患者数'] / row['総退院患者数'] * 100) if row['総退院患者数'] > 0 else 0, axis=1)
-        return ward_summary
+        if not _warn_missing_summary_columns(df, '病棟コード', '病棟別'):
+            return pd.DataFrame()
+        return get_unit_summary(df, '病棟コード', exclude_wards=EXCLUDED_WARDS).copy()
     except Exception as e:
         logger.error(f"病棟別サマリー計算エラー: {e}", exc_info=True)
         return pd.DataFrame()
 
 def calculate_department_summary(df):
-    """診療科別サマリー計算"""
+    """診療科別サマリー計算（データ・フィルターごとにキャッシュ）"""
     try:
-        required_cols = ['診療科名', '日付', '入院患者数（在院）', '総入院患者数', '総退院患者数', '緊急入院患者数', '死亡患者数']
-        if not all(col in df.columns for col in required_cols):
-            missing = [col for col in required_cols if col not in df.columns]
-            logger.error(f"診療科別サマリー計算に必要な列が不足: {missing}")
-            st.warning(f"診療科別サマリー計算に必要な列が不足しています: {', '.join(missing)}。一部指標が計算できません。")
-            for m_col in missing:
-                if m_col not in ['診療科名', '日付']: 
-                    df[m_col] = 0
-
-        dept_groups = df.groupby('診療科名', observed=True)
-        dept_summary_data = {
-            '診療科名': dept_groups['診療科名'].first(),
-            '期間日数': dept_groups['日付'].nunique(),
-            '延べ在院患者数': dept_groups['入院患者数（在院）'].sum() if '入院患者数（在院）' in df.columns else 0,
-            '総入院患者数': dept_groups['総入院患者数'].sum() if '総入院患者数' in df.columns else 0,
-            '総退院患者数': dept_groups['総退院患者数'].sum() if '総退院患者数' in df.columns else 0,
-            '緊急入院患者数': dept_groups['緊急入院患者数'].sum() if '緊急入院患者数' in df.columns else 0,
-            '死亡患者数': dept_groups['死亡患者数'].sum() if '死亡患者数' in df.columns else 0,
-        }
-        dept_summary = pd.DataFrame(dept_summary_data).reset_index(drop=True)
-        
-        dept_summary['平均在院患者数'] = dept_summary.apply(
-            lambda row: row['延べ在院患者数'] / row['期間日数'] if row['期間日数'] > 0 else 0, axis=1)
-        dept_summary['平均在院日数'] = dept_summary.apply(
-            lambda row: row['延べ在院患者数'] / ((row['総入院患者数'] + row['総退院患者数']) / 2) 
-            if (row['総入院患者数'] + row['総退院患者数']) > 0 else 0, axis=1)
-        dept_summary['病床回転率'] = dept_summary.apply(
-            lambda row: row['総退院患者数'] / row['平均在院患者数'] if row['平均在院患者数'] > 0 else 0, axis=1)
-        dept_summary['緊急入院率'] = dept_summary.apply(
-            lambda row: (row['緊急入院患者数'] / row['総入院患者数'] * 100) if row['総入院患者数'] > 0 else 0, axis=1)
-        dept_summary['死亡率'] = dept_summary.apply(
-            lambda row: (row['死亡患者数'] / row['総退院患者数'] * 100) if row['総退院患者数'] > 0 else 0, axis=1)
-        return dept_summary
+        if not _warn_missing_summary_columns(df, '診療科名', '診療科別'):
+            return pd.DataFrame()
+        return get_unit_summary(df, '診療科名').copy()
     except Exception as e:
         logger.error(f"診療科別サマリー計算エラー: {e}", exc_info=True)
         return pd.DataFrame()
 
+def _summary_chart_version(summary_df):
+    """比較グラフのキャッシュ用の版（サマリーの attrs、なければ内容から計算）"""
+    return summary_df.attrs.get('summary_version') or aggregate_version(summary_df)
+
+def _build_summary_bar_chart(summary_df, x, y, title, color_scale, orientation=None, top_n=None):
+    """サマリーの棒グラフ（top_n 指定時は値の上位のみ）"""
+    value_col = x if orientation == 'h' else y
+    chart_df = summary_df.nlargest(top_n, value_col) if top_n else summary_df
+    fig = px.bar(
+        chart_df, x=x, y=y, orientation=orientation,
+        title=title, color=value_col, color_continuous_scale=color_scale
+    )
+    fig.update_layout(height=400)
+    return fig
+
+def _build_summary_scatter_chart(summary_df, x, y, hover_name, title, labels):
+    """サマリーのバブルチャート（バブルサイズ：総入院患者数）"""
+    fig = px.scatter(
+        summary_df, x=x, y=y, size='総入院患者数',
+        hover_name=hover_name, title=title, labels=labels
+    )
+    fig.update_layout(height=400)
+    return fig
+
 def create_ward_comparison_charts(ward_summary):
-    """病棟別比較グラフ作成"""
+    """病棟別比較グラフ作成（サマリーの版ごとにグラフをキャッシュ）"""
     try:
         if ward_summary is None or ward_summary.empty:
             st.info("病棟別比較グラフ: 表示するデータがありません。")
@@ -406,39 +377,33 @@ def create_ward_comparison_charts(ward_summary):
         
         st.markdown("---")
         st.subheader("病棟別比較グラフ")
+        version = _summary_chart_version(ward_summary)
         col1, col2 = st.columns(2)
         
         with col1:
-            fig_census = px.bar(
-                ward_summary, x='病棟コード', y='平均在院患者数', 
-                title='病棟別 平均在院患者数', color='平均在院患者数', 
-                color_continuous_scale='Blues'
-            )
-            fig_census.update_layout(height=400)
+            fig_census = get_cached_figure('ward_comparison_census', version, {}, lambda: _build_summary_bar_chart(
+                ward_summary, '病棟コード', '平均在院患者数', '病棟別 平均在院患者数', 'Blues'
+            ))
             st.plotly_chart(fig_census, use_container_width=True)
         
         with col2:
-            fig_alos = px.bar(
-                ward_summary, x='病棟コード', y='平均在院日数', 
-                title='病棟別 平均在院日数', color='平均在院日数', 
-                color_continuous_scale='Reds'
-            )
-            fig_alos.update_layout(height=400)
+            fig_alos = get_cached_figure('ward_comparison_alos', version, {}, lambda: _build_summary_bar_chart(
+                ward_summary, '病棟コード', '平均在院日数', '病棟別 平均在院日数', 'Reds'
+            ))
             st.plotly_chart(fig_alos, use_container_width=True)
         
-        fig_scatter = px.scatter(
-            ward_summary, x='平均在院患者数', y='平均在院日数', size='総入院患者数',
-            hover_name='病棟コード', title='平均在院患者数 vs 平均在院日数（バブルサイズ：総入院患者数）',
-            labels={'平均在院患者数': '平均在院患者数（人）', '平均在院日数': '平均在院日数（日）'}
-        )
-        fig_scatter.update_layout(height=400)
+        fig_scatter = get_cached_figure('ward_comparison_scatter', version, {}, lambda: _build_summary_scatter_chart(
+            ward_summary, '平均在院患者数', '平均在院日数', '病棟コード',
+            '平均在院患者数 vs 平均在院日数（バブルサイズ：総入院患者数）',
+            {'平均在院患者数': '平均在院患者数（人）', '平均在院日数': '平均在院日数（日）'}
+        ))
         st.plotly_chart(fig_scatter, use_container_width=True)
     except Exception as e:
         logger.error(f"病棟別グラフ作成エラー: {e}", exc_info=True)
         st.error(f"病棟別グラフ作成中にエラー: {e}")
 
 def create_department_comparison_charts(dept_summary):
-    """診療科別比較グラフ作成"""
+    """診療科別比較グラフ作成（サマリーの版ごとにグラフをキャッシュ）"""
     try:
         if dept_summary is None or dept_summary.empty:
             st.info("診療科別比較グラフ: 表示するデータがありません。")
@@ -446,41 +411,35 @@ def create_department_comparison_charts(dept_summary):
         
         st.markdown("---")
         st.subheader("診療科別比較グラフ")
+        version = _summary_chart_version(dept_summary)
         col1, col2 = st.columns(2)
         
         with col1:
-            top_census = dept_summary.nlargest(10, '平均在院患者数') if '平均在院患者数' in dept_summary.columns else pd.DataFrame()
-            if not top_census.empty:
-                fig_census = px.bar(
-                    top_census, x='平均在院患者数', y='診療科名', orientation='h', 
-                    title='診療科別 平均在院患者数（上位10位）', color='平均在院患者数', 
-                    color_continuous_scale='Blues'
-                )
-                fig_census.update_layout(height=400)
+            if '平均在院患者数' in dept_summary.columns:
+                fig_census = get_cached_figure('dept_comparison_census', version, {'top_n': 10}, lambda: _build_summary_bar_chart(
+                    dept_summary, '平均在院患者数', '診療科名', '診療科別 平均在院患者数（上位10位）', 'Blues',
+                    orientation='h', top_n=10
+                ))
                 st.plotly_chart(fig_census, use_container_width=True)
             else: 
                 st.caption("平均在院患者数データなし")
         
         with col2:
-            top_alos = dept_summary.nlargest(10, '平均在院日数') if '平均在院日数' in dept_summary.columns else pd.DataFrame()
-            if not top_alos.empty:
-                fig_alos = px.bar(
-                    top_alos, x='平均在院日数', y='診療科名', orientation='h', 
-                    title='診療科別 平均在院日数（上位10位）', color='平均在院日数', 
-                    color_continuous_scale='Reds'
-                )
-                fig_alos.update_layout(height=400)
+            if '平均在院日数' in dept_summary.columns:
+                fig_alos = get_cached_figure('dept_comparison_alos', version, {'top_n': 10}, lambda: _build_summary_bar_chart(
+                    dept_summary, '平均在院日数', '診療科名', '診療科別 平均在院日数（上位10位）', 'Reds',
+                    orientation='h', top_n=10
+                ))
                 st.plotly_chart(fig_alos, use_container_width=True)
             else: 
                 st.caption("平均在院日数データなし")
         
         if all(col in dept_summary.columns for col in ['緊急入院率', '死亡率', '総入院患者数']):
-            fig_rates = px.scatter(
-                dept_summary, x='緊急入院率', y='死亡率', size='総入院患者数',
-                hover_name='診療科名', title='緊急入院率 vs 死亡率（バブルサイズ：総入院患者数）',
-                labels={'緊急入院率': '緊急入院率（%）', '死亡率': '死亡率（%）'}
-            )
-            fig_rates.update_layout(height=400)
+            fig_rates = get_cached_figure('dept_comparison_rates', version, {}, lambda: _build_summary_scatter_chart(
+                dept_summary, '緊急入院率', '死亡率', '診療科名',
+                '緊急入院率 vs 死亡率（バブルサイズ：総入院患者数）',
+                {'緊急入院率': '緊急入院率（%）', '死亡率': '死亡率（%）'}
+            ))
             st.plotly_chart(fig_rates, use_container_width=True)
         else:
             st.caption("緊急入院率、死亡率、または総入院患者数データなし")
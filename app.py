@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import datetime
+import os
 import traceback
 # ===== ページ設定と config.py のインポート =====
 from config import *
@@ -17,10 +18,12 @@ from style import inject_global_css
 from utils import initialize_all_mappings
 
 from data_persistence import (
-    auto_load_data, save_data_to_file, load_data_from_file,
+    auto_load_data, load_data_from_file,
+    queue_save_data, get_save_status,
     get_data_info, delete_saved_data, get_file_sizes,
     save_settings_to_file, load_settings_from_file,
-    get_backup_info, restore_from_backup
+    get_backup_info, restore_from_backup,
+    get_manifest_for_df, export_data_package, import_data_package
 )
 
 # カスタムモジュールのインポート
@@ -153,8 +156,16 @@ def create_sidebar_data_settings():
                 }.get(data_source, '不明')
                 st.write(f"🔄 読み込み元: {source_text}")
                 
-                # データ期間情報（新規追加）
-                if '日付' in df.columns and not df['日付'].empty:
+                # データ期間情報（保存データそのものならマニフェストから表示し、データは走査しない）
+                manifest = get_manifest_for_df(df)
+                if manifest and manifest.get('date_range', {}).get('min_date'):
+                    min_date = pd.Timestamp(manifest['date_range']['min_date'])
+                    max_date = pd.Timestamp(manifest['date_range']['max_date'])
+                    period_days = (max_date - min_date).days + 1
+                    st.write(f"📅 データ期間: {period_days}日間")
+                    st.caption(f"{min_date.strftime('%Y/%m/%d')} ～ {max_date.strftime('%Y/%m/%d')}")
+                    st.caption(f"🏥 病棟 {len(manifest.get('wards', []))} / 診療科 {len(manifest.get('departments', []))}")
+                elif '日付' in df.columns and not df['日付'].empty:
                     min_date = df['日付'].min()
                     max_date = df['日付'].max()
                     period_days = (max_date - min_date).days + 1
@@ -231,9 +242,9 @@ def create_sidebar_data_settings():
                         'filter_state': st.session_state.get('current_unified_filter_config', {}),
                     }
                     
-                    if save_data_to_file(df_to_save, target_data_to_save, enhanced_metadata):
-                        st.success("✅ 保存完了!")
-                        st.rerun()
+                    # 書き込みはバックグラウンドで行い、画面はすぐに操作可能に戻す
+                    if queue_save_data(df_to_save, target_data_to_save, enhanced_metadata):
+                        st.info("⏳ 保存を開始しました（バックグラウンドで書き込み中）")
                     else:
                         st.error("❌ 保存失敗")
                 else:
@@ -264,6 +275,21 @@ def create_sidebar_data_settings():
                 else:
                     st.error("❌ 読込失敗")
 
+        # バックグラウンド保存の状況
+        save_status = get_save_status()
+        if save_status['state'] in ('queued', 'saving'):
+            collapsed_note = f"（{save_status['collapsed_count']}件の保存要求を統合）" if save_status.get('collapsed_count') else ""
+            st.caption(f"⏳ 保存中...{collapsed_note}")
+            if st.button("🔄 保存状況を更新", key="refresh_save_status_sidebar", use_container_width=True):
+                st.rerun()
+        elif save_status['state'] == 'done' and save_status.get('finished_at'):
+            st.caption(
+                f"✅ 保存完了: {save_status['finished_at'].strftime('%H:%M:%S')}"
+                f"（{save_status.get('duration_sec', 0):.1f}秒）"
+            )
+        elif save_status['state'] == 'error':
+            st.error(f"❌ 保存失敗: {save_status.get('message', '')}")
+
         # 追加データ読み込み機能（新規）
         if st.session_state.get('data_processed', False):
             st.markdown("---")
@@ -344,6 +370,39 @@ def create_sidebar_data_settings():
                             st.error(f"❌ 追加読み込みエラー: {str(e)}")
 
         # リセット機能（強化版）
+        # データ移行（他端末へのエクスポート・インポート）
+        st.markdown("---")
+        st.markdown("**📦 データ移行**")
+        st.caption("保存データを月別パーティションのZIPパッケージとして移行")
+        if st.button("📤 パッケージ出力", key="export_data_package_sidebar", use_container_width=True):
+            export_dir = os.path.join("saved_data", "exports")
+            os.makedirs(export_dir, exist_ok=True)
+            export_path = os.path.join(export_dir, f"data_export_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
+            export_progress = st.progress(0.0, text="エクスポート準備中...")
+            success, result = export_data_package(
+                export_path, progress_callback=lambda fraction, message: export_progress.progress(fraction, text=message)
+            )
+            if success:
+                st.success(f"✅ 出力完了: {result}")
+            else:
+                st.error(f"❌ 出力失敗: {result}")
+        
+        package_file = st.file_uploader(
+            "パッケージ取込", type=["zip"], key="import_data_package_sidebar",
+            help="他端末で出力したデータパッケージ（ZIP）を取り込みます"
+        )
+        if package_file is not None:
+            if st.button("📥 パッケージ取込", key="import_data_package_button_sidebar", use_container_width=True):
+                import_progress = st.progress(0.0, text="インポート準備中...")
+                success, message = import_data_package(
+                    package_file, progress_callback=lambda fraction, message: import_progress.progress(fraction, text=message)
+                )
+                if success:
+                    st.success(f"✅ {message}")
+                    st.info("🔄 ページを再読み込みして取り込んだデータを確認してください")
+                else:
+                    st.error(f"❌ {message}")
+        
         st.markdown("---")
         st.markdown("**🔄 データリセット**")
         
@@ -406,6 +465,8 @@ def create_sidebar_data_settings():
                 with col1_bk:
                     st.write(f"📄 {backup['timestamp']}")
                     st.caption(f"サイズ: {backup['size']}")
+                    if backup.get('is_current'):
+                        st.caption("✅ 現在の保存データ")
                     # 経過日数表示（新規追加）
                     if backup.get('age_days', 0) == 0:
                         st.caption("📅 今日作成")
@@ -793,6 +854,8 @@ def main():
         st.session_state['df'] = None
     if 'forecast_model_results' not in st.session_state: 
         st.session_state.forecast_model_results = {}
+    if 'forecast_model_intervals' not in st.session_state:
+        st.session_state.forecast_model_intervals = {}
     if 'mappings_initialized_after_processing' not in st.session_state: 
         st.session_state.mappings_initialized_after_processing = False
 
@@ -17,6 +17,8 @@ import logging
 
 # config から除外病棟設定をインポート
 from config import EXCLUDED_WARDS
+from utils import as_str_series
+from row_selection import get_row_selection_index
 
 # forecast モジュールの関数
 from forecast import generate_filtered_summaries, create_forecast_dataframe
@@ -28,6 +30,7 @@ from pdf_generator import (
     create_alos_chart_for_pdf,
     create_patient_chart_with_target_wrapper, # pdf_generator内のラッパー関数
     create_dual_axis_chart_for_pdf, # pdf_generator内のMatplotlib二軸グラフ関数
+    build_department_table_cumulatives, # 部門別テーブル用の累積和
     get_chart_cache_key as get_pdf_gen_chart_cache_key, # pdf_generatorのキャッシュキー関数
     compute_data_hash as compute_pdf_gen_data_hash,   # pdf_generatorのハッシュ関数
     get_chart_cache as get_pdf_gen_main_process_cache, # メインプロセス用キャッシュ取得
@@ -134,8 +137,8 @@ def find_department_code_in_targets_for_pdf(dept_name, target_data_df, metric_na
     
     # 直接一致をチェック
     test_rows = target_data_df[
-        (target_data_df['部門コード'].astype(str) == str(dept_name).strip()) |
-        (target_data_df.get('部門名', pd.Series()).astype(str) == str(dept_name).strip())
+        (as_str_series(target_data_df['部門コード']) == str(dept_name).strip()) |
+        (as_str_series(target_data_df.get('部門名', pd.Series())) == str(dept_name).strip())
     ]
     if not test_rows.empty:
         return str(test_rows.iloc[0]['部門コード']), True
@@ -166,11 +169,15 @@ def process_pdf_in_worker_revised(
     target_data_path=None, reduced_graphs=True,
     alos_chart_buffers_payload=None,
     patient_chart_buffers_payload=None,
-    dual_axis_chart_buffers_payload=None
+    dual_axis_chart_buffers_payload=None,
+    department_table_cumulatives_payload=None
     ):
     """
     ワーカープロセスでPDFを生成する (グラフバッファを受け取る)
     最適化版：性能監視とエラーハンドリング強化
+
+    department_table_cumulatives_payload はメインプロセスで作成した部門別テーブル用の累積和
+    （省略時はワーカー内のデータから作成する）
     """
     
     # 性能監視開始
@@ -255,7 +262,8 @@ def process_pdf_in_worker_revised(
             graph_days=graph_days_list_for_pdf, # この引数はpdf_generator側で使われなくなる想定
             alos_chart_buffers=alos_chart_buffers_payload,
             patient_chart_buffers=patient_chart_buffers_payload,
-            dual_axis_chart_buffers=dual_axis_chart_buffers_payload
+            dual_axis_chart_buffers=dual_axis_chart_buffers_payload,
+            department_table_cumulatives=department_table_cumulatives_payload
         )
         
         # メモリ解放
@@ -381,7 +389,7 @@ def batch_generate_pdfs_mp_optimized(df_main, mode="all", landscape=False, targe
                     ward_display_map[code_str] = row['部門名']
         
         # *** 除外病棟を除いたユニークな病棟リストを取得 ***
-        unique_wards = df_filtered["病棟コード"].astype(str).unique()
+        unique_wards = as_str_series(df_filtered["病棟コード"]).unique()
         if EXCLUDED_WARDS:
             unique_wards = [ward for ward in unique_wards if ward not in EXCLUDED_WARDS]
         
@@ -451,10 +459,13 @@ def batch_generate_pdfs_mp_optimized(df_main, mode="all", landscape=False, targe
                 # 全体の場合、複数の可能性をチェック
                 if task_type == "all":
                     possible_codes = ["000", "全体", "病院全体", "病院", "総合", "0"]
+                    # 文字列化は候補ループの外で1回のみ
+                    target_codes_str = as_str_series(target_data_df['部門コード'])
+                    target_names_str = as_str_series(target_data_df.get('部門名', pd.Series()))
                     for code in possible_codes:
                         target_rows_df = target_data_df[
-                            (target_data_df['部門コード'].astype(str) == code) |
-                            (target_data_df.get('部門名', pd.Series()).astype(str) == code)
+                            (target_codes_str == code) |
+                            (target_names_str == code)
                         ]
                         if not target_rows_df.empty:
                             break
@@ -465,7 +476,7 @@ def batch_generate_pdfs_mp_optimized(df_main, mode="all", landscape=False, targe
                         if found:
                             filter_code = actual_code
                     
-                    target_rows_df = target_data_df[target_data_df['部門コード'].astype(str) == str(filter_code)]
+                    target_rows_df = target_data_df[as_str_series(target_data_df['部門コード']) == str(filter_code)]
                 
                 if not target_rows_df.empty:
                     for _, row_t in target_rows_df.iterrows():
@@ -482,10 +493,13 @@ def batch_generate_pdfs_mp_optimized(df_main, mode="all", landscape=False, targe
                 # 全体の場合
                 if task_type == "all":
                     possible_codes = ["000", "全体", "病院全体", "病院", "総合", "0"]
+                    # 文字列化は候補ループの外で1回のみ
+                    target_codes_str = as_str_series(target_data_df['部門コード'])
+                    target_names_str = as_str_series(target_data_df.get('部門名', pd.Series()))
                     for code in possible_codes:
                         mask = (
-                            ((target_data_df['部門コード'].astype(str) == code) |
-                            (target_data_df.get('部門名', pd.Series()).astype(str) == code)) &
+                            ((target_codes_str == code) |
+                            (target_names_str == code)) &
                             (target_data_df[indicator_col_name] == metric_name)
                         )
                         filtered_rows = target_data_df[mask]
@@ -507,7 +521,7 @@ def batch_generate_pdfs_mp_optimized(df_main, mode="all", landscape=False, targe
                             actual_code = found_code
                     
                     mask = (
-                        (target_data_df['部門コード'].astype(str) == str(actual_code)) &
+                        (as_str_series(target_data_df['部門コード']) == str(actual_code)) &
                         (target_data_df[indicator_col_name] == metric_name)
                     )
                     filtered_rows = target_data_df[mask]
@@ -521,6 +535,17 @@ def batch_generate_pdfs_mp_optimized(df_main, mode="all", landscape=False, targe
             
             return t_all, t_wd, t_hd
 
+        # 部門別テーブル用の累積和はタスクごとにメインプロセスで1回だけ作成してワーカーへ渡す
+        # （ワーカー内の行数削減の影響を受けず、全期間のデータで集計される）
+        df_filtered_index = get_row_selection_index(df_filtered)
+
+        def get_task_row_mask(task_type, task_value):
+            if task_type == "dept":
+                return df_filtered_index.value_mask("診療科名", [task_value])
+            if task_type == "ward":
+                return df_filtered_index.value_mask("病棟コード", [task_value])
+            return None
+
         num_task_defs = len(task_definitions_list)
         for i, task_def_item in enumerate(task_definitions_list):
             graph_buffers_for_task = {
@@ -641,14 +666,17 @@ def batch_generate_pdfs_mp_optimized(df_main, mode="all", landscape=False, targe
                  {"all": graph_buffers_for_task["patient_all"], 
                   "weekday": graph_buffers_for_task["patient_weekday"], 
                   "holiday": graph_buffers_for_task["patient_holiday"]},
-                 graph_buffers_for_task["dual_axis"])
+                 graph_buffers_for_task["dual_axis"],
+                 build_department_table_cumulatives(
+                     df_filtered, get_task_row_mask(task_def_item["type"], task_def_item["value"])
+                 ))
             )
             if progress_callback and num_task_defs > 0:
                 progress_val = int(10 + ((i+1) / num_task_defs) * 15) # 10-25%
                 progress_callback(progress_val / 100.0, f"グラフ準備中: {i+1}/{num_task_defs}")
         
         # メモリ解放
-        del df_main, df_filtered, target_data_main, task_definitions_list
+        del df_main, df_filtered, df_filtered_index, target_data_main, task_definitions_list
         gc.collect()
 
         total_tasks_to_process = len(tasks_for_worker_with_buffers)
@@ -764,7 +792,7 @@ def batch_generate_pdfs_sequential(
         tasks_seq = []
         # 表示名マッピング（簡易版）
         dept_display_map_seq = {dept: dept for dept in df["診療科名"].unique()}
-        ward_display_map_seq = {ward: ward for ward in df["病棟コード"].astype(str).unique()}
+        ward_display_map_seq = {ward: ward for ward in as_str_series(df["病棟コード"]).unique()}
 
         if mode == "all_only_filter": 
             tasks_seq.append({"type": "all", "value": "全体", "display_name": "全体"})
@@ -779,7 +807,7 @@ def batch_generate_pdfs_sequential(
                         "display_name": dept_display_map_seq.get(dept, dept)
                     })
             if mode == "all" or mode == "ward":
-                for ward in sorted(df["病棟コード"].astype(str).unique()): 
+                for ward in sorted(as_str_series(df["病棟コード"]).unique()): 
                     # *** 除外病棟チェック ***
                     if ward not in EXCLUDED_WARDS:
                         tasks_seq.append({
@@ -788,6 +816,8 @@ def batch_generate_pdfs_sequential(
                             "display_name": ward_display_map_seq.get(ward, ward)
                         })
 
+        df_index_seq = get_row_selection_index(df)
+
         zip_buffer_seq = BytesIO()
         with zipfile.ZipFile(zip_buffer_seq, 'w', zipfile.ZIP_DEFLATED) as zipf_seq:
             date_suffix_seq = latest_date_seq.strftime("%Y%m%d")
@@ -797,10 +827,13 @@ def batch_generate_pdfs_sequential(
             for task_item in tasks_seq:
                 # シングルプロセスでは簡易的にグラフバッファを生成
                 current_task_data_seq = df.copy()
+                task_row_mask_seq = None
                 if task_item["type"] == "dept": 
                     current_task_data_seq = df[df["診療科名"] == task_item["value"]].copy()
+                    task_row_mask_seq = df_index_seq.value_mask("診療科名", [task_item["value"]])
                 elif task_item["type"] == "ward": 
                     current_task_data_seq = df[df["病棟コード"] == task_item["value"]].copy()
+                    task_row_mask_seq = df_index_seq.value_mask("病棟コード", [task_item["value"]])
 
                 alos_bufs_seq = {}
                 if not current_task_data_seq.empty:
@@ -831,7 +864,8 @@ def batch_generate_pdfs_sequential(
                     fast_mode,
                     alos_chart_buffers_payload=alos_bufs_seq,
                     patient_chart_buffers_payload=patient_bufs_seq,
-                    dual_axis_chart_buffers_payload=dual_bufs_seq
+                    dual_axis_chart_buffers_payload=dual_bufs_seq,
+                    department_table_cumulatives_payload=build_department_table_cumulatives(df, task_row_mask_seq)
                 )
                 
                 if result_seq:
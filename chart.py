@@ -11,6 +11,8 @@ import gc
 import time
 import hashlib
 import logging
+from chart_cache import aggregate_version, get_cached_figure, compact_figure
+from row_selection import sum_by_day
 
 logger = logging.getLogger(__name__)
 
@@ -200,6 +202,10 @@ def _create_dual_axis_chart_core(data, title="入院患者数と患者移動の
 
 # ===== インタラクティブグラフ関数 =====
 
+def _daily_chart_sums(data, columns):
+    """グラフ用の日別合計（日付昇順、日付が欠損・変換不能な行は除外）"""
+    return sum_by_day(data, np.arange(len(data)), columns)
+
 def create_interactive_patient_chart(data, title="入院患者数推移", days=90, show_moving_average=True, target_value=None, chart_type="全日"):
     """【修正】インタラクティブな患者数推移グラフを作成する (Plotly) - ゾーン表示を追加"""
     try:
@@ -210,23 +216,33 @@ def create_interactive_patient_chart(data, title="入院患者数推移", days=9
             logger.warning(f"create_interactive_patient_chart: '{title}' のデータに必要な列がありません。")
             return None
 
-        data_copy = data.copy()
-        if not pd.api.types.is_datetime64_any_dtype(data_copy['日付']):
-            data_copy['日付'] = pd.to_datetime(data_copy['日付'], errors='coerce')
-            data_copy.dropna(subset=['日付'], inplace=True)
-
-        grouped = data_copy.groupby("日付")["入院患者数（在院）"].sum().reset_index().sort_values("日付")
+        grouped = _daily_chart_sums(data, ["入院患者数（在院）"])
         
         if grouped.empty or len(grouped) == 0:
             return None
 
         if len(grouped) > days and days > 0:
-            grouped = grouped.tail(days)
+            grouped = grouped.tail(days).reset_index(drop=True)
 
         if grouped.empty:
             return None
 
-        avg = grouped["入院患者数（在院）"].mean()
+        # 集計結果と引数が同じなら作成済みのグラフを再利用する
+        return get_cached_figure(
+            "interactive_patient_chart",
+            aggregate_version(grouped),
+            {'title': title, 'show_moving_average': show_moving_average, 'target_value': target_value},
+            lambda: _build_interactive_patient_chart(grouped, title, show_moving_average, target_value)
+        )
+        
+    except Exception as e:
+        logger.error(f"インタラクティブグラフ '{title}' 作成中にエラー: {e}", exc_info=True)
+        return None
+
+def _build_interactive_patient_chart(grouped, title, show_moving_average, target_value):
+    """日別集計から患者数推移グラフを作成"""
+    try:
+        grouped = grouped.copy()
         if len(grouped) >= 7: 
             grouped['7日移動平均'] = grouped["入院患者数（在院）"].rolling(window=7, min_periods=1).mean()
 
@@ -316,17 +332,26 @@ def create_interactive_dual_axis_chart(data, title="患者移動と在院数の
         if any(col not in data.columns for col in required_cols):
             return None
 
-        data_copy = data.copy()
-        if not pd.api.types.is_datetime64_any_dtype(data_copy['日付']):
-            data_copy['日付'] = pd.to_datetime(data_copy['日付'], errors='coerce').dropna(subset=['日付'])
-
-        agg_dict = {col: "sum" for col in required_cols if col != "日付"}
-        grouped = data_copy.groupby("日付").agg(agg_dict).reset_index().sort_values("日付")
+        grouped = _daily_chart_sums(data, required_cols[1:])
         
         if len(grouped) > days and days > 0:
-            grouped = grouped.tail(days)
+            grouped = grouped.tail(days).reset_index(drop=True)
         if grouped.empty: return None
 
+        return get_cached_figure(
+            "interactive_dual_axis_chart",
+            aggregate_version(grouped),
+            {'title': title},
+            lambda: _build_interactive_dual_axis_chart(grouped, required_cols, title)
+        )
+    except Exception as e:
+        logger.error(f"インタラクティブ2軸グラフ '{title}' 作成中にエラー: {e}", exc_info=True)
+        return None
+
+def _build_interactive_dual_axis_chart(grouped, required_cols, title):
+    """日別集計から患者移動グラフを作成"""
+    try:
+        grouped = grouped.copy()
         for col in required_cols[1:]:
             grouped[f'{col}_7日MA'] = grouped[col].rolling(window=7, min_periods=1).mean()
 
@@ -385,37 +410,63 @@ def create_interactive_alos_chart(chart_data, title="ALOS推移", days_to_show=9
         if any(col not in chart_data.columns for col in required_columns):
             return None
 
-        data_copy = chart_data.copy()
-        if not pd.api.types.is_datetime64_any_dtype(data_copy['日付']):
-            data_copy['日付'] = pd.to_datetime(data_copy['日付'], errors='coerce')
-            data_copy.dropna(subset=['日付'], inplace=True)
-        if data_copy.empty: return None
+        daily_sums = _daily_chart_sums(chart_data, required_columns[1:])
+        if daily_sums.empty: return None
 
-        latest_date = data_copy['日付'].max()
-        start_date_limit = latest_date - pd.Timedelta(days=days_to_show - 1)
-        date_range_for_plot = pd.date_range(start=start_date_limit, end=latest_date, freq='D')
-        
-        daily_metrics = []
-        for display_date in date_range_for_plot:
-            window_start = display_date - pd.Timedelta(days=moving_avg_window - 1)
-            window_data = data_copy[(data_copy['日付'] >= window_start) & (data_copy['日付'] <= display_date)]
-            
-            if not window_data.empty:
-                total_patient_days = window_data['入院患者数（在院）'].sum()
-                total_admissions = window_data['総入院患者数'].sum()
-                total_discharges = window_data['総退院患者数'].sum()
-                num_days_in_window = window_data['日付'].nunique()
-                
-                denominator = (total_admissions + total_discharges) / 2
-                alos = total_patient_days / denominator if denominator > 0 else np.nan
-                daily_census = total_patient_days / num_days_in_window if num_days_in_window > 0 else np.nan
-                
-                daily_metrics.append({'日付': display_date, '平均在院日数': alos, '平均在院患者数': daily_census})
-
-        if not daily_metrics: return None
-        daily_df = pd.DataFrame(daily_metrics).sort_values('日付')
+        daily_df = _rolling_alos_metrics(daily_sums, days_to_show, moving_avg_window)
         if daily_df.empty: return None
 
+        return get_cached_figure(
+            "interactive_alos_chart",
+            aggregate_version(daily_df),
+            {'title': title, 'moving_avg_window': moving_avg_window},
+            lambda: _build_interactive_alos_chart(daily_df, title, moving_avg_window)
+        )
+
+    except Exception as e:
+        logger.error(f"インタラクティブALOSグラフ '{title}' 作成中にエラー: {e}", exc_info=True)
+        return None
+
+def _rolling_alos_metrics(daily_sums, days_to_show, moving_avg_window):
+    """
+    表示期間の各日について、直近 moving_avg_window 日の平均在院日数・平均在院患者数を求める
+    
+    日別集計を暦日に展開した累積和の差分で窓ごとの合計を求める（窓内にデータのない日は除外）。
+    """
+    latest_date = daily_sums['日付'].max()
+    start_date_limit = latest_date - pd.Timedelta(days=days_to_show - 1)
+    calendar_start = start_date_limit - pd.Timedelta(days=moving_avg_window - 1)
+    calendar = pd.date_range(start=calendar_start, end=latest_date, freq='D')
+
+    daily_on_calendar = daily_sums.set_index('日付').reindex(calendar)
+    has_data = daily_on_calendar['入院患者数（在院）'].notna().to_numpy()
+    daily_on_calendar = daily_on_calendar.fillna(0)
+
+    def window_sums(values):
+        cumulative = np.concatenate([[0], np.cumsum(values)])
+        ends = np.arange(moving_avg_window, len(values) + 1)
+        return cumulative[ends] - cumulative[ends - moving_avg_window]
+
+    total_patient_days = window_sums(daily_on_calendar['入院患者数（在院）'].to_numpy())
+    total_admissions = window_sums(daily_on_calendar['総入院患者数'].to_numpy())
+    total_discharges = window_sums(daily_on_calendar['総退院患者数'].to_numpy())
+    num_days_in_window = window_sums(has_data.astype(np.int64))
+
+    denominator = (total_admissions + total_discharges) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alos = np.where(denominator > 0, total_patient_days / np.where(denominator > 0, denominator, 1), np.nan)
+        daily_census = total_patient_days / np.where(num_days_in_window > 0, num_days_in_window, 1)
+
+    window_has_data = num_days_in_window > 0
+    return pd.DataFrame({
+        '日付': calendar[moving_avg_window - 1:][window_has_data],
+        '平均在院日数': alos[window_has_data],
+        '平均在院患者数': daily_census[window_has_data],
+    })
+
+def _build_interactive_alos_chart(daily_df, title, moving_avg_window):
+    """窓ごとの指標から ALOS グラフを作成"""
+    try:
         fig = make_subplots(specs=[[{"secondary_y": True}]])
 
         # 平均在院日数（マーカー付き）
@@ -460,8 +511,14 @@ def create_interactive_alos_chart(chart_data, title="ALOS推移", days_to_show=9
         return None
 
 @st.cache_data(ttl=1800)
-def create_forecast_comparison_chart(actual_series, forecast_results, title="年度患者数予測比較", display_days_past=365, display_days_future=365):
-    """実績データと複数の予測モデルの結果を比較するインタラクティブグラフを作成する (Plotly)"""
+def create_forecast_comparison_chart(actual_series, forecast_results, title="年度患者数予測比較", display_days_past=365, display_days_future=365,
+                                     forecast_intervals=None):
+    """
+    実績データと複数の予測モデルの結果を比較するインタラクティブグラフを作成する (Plotly)
+
+    forecast_intervals（モデル名 → make_forecast_result の辞書）を渡した場合は、
+    予測時に求めた予測区間を帯で表示する（モデルを再学習しない）。
+    """
     try:
         if actual_series.empty:
             logger.warning(f"create_forecast_comparison_chart: '{title}' の実績データが空です。")
@@ -485,7 +542,7 @@ def create_forecast_comparison_chart(actual_series, forecast_results, title="年
             line=dict(color='blue', width=2)
         ))
 
-        colors = ['red', 'green', 'purple', 'orange', 'brown']
+        colors = ['red', 'green', 'purple', 'orange', 'brown', 'teal', 'gray']
 
         for i, (model_name, forecast_series) in enumerate(forecast_results.items()):
             if forecast_series is None or forecast_series.empty:
@@ -502,6 +559,20 @@ def create_forecast_comparison_chart(actual_series, forecast_results, title="年
                                                         (forecast_series.index <= pred_end_date)]
 
             if not forecast_display_data.empty:
+                interval = (forecast_intervals or {}).get(model_name)
+                if interval is not None and interval.get('lower') is not None:
+                    lower = interval['lower'].reindex(forecast_display_data.index)
+                    upper = interval['upper'].reindex(forecast_display_data.index)
+                    fig.add_trace(go.Scatter(
+                        x=list(forecast_display_data.index) + list(forecast_display_data.index[::-1]),
+                        y=list(upper.round(1)) + list(lower.round(1)[::-1]),
+                        fill='toself',
+                        fillcolor=colors[i % len(colors)],
+                        opacity=0.2,
+                        line=dict(width=0),
+                        hoverinfo='skip',
+                        name=f'{model_name} ({interval["level"]:.0%}予測区間)'
+                    ))
                 fig.add_trace(go.Scatter(
                     x=forecast_display_data.index,
                     y=forecast_display_data,
@@ -520,7 +591,8 @@ def create_forecast_comparison_chart(actual_series, forecast_results, title="年
             margin=dict(l=20, r=20, t=50, b=20)
         )
         fig.update_xaxes(tickformat="%Y-%m-%d", tickangle=-45)
-        return fig
+        # 長期間の表示では実績・予測の線を間引いて送る
+        return compact_figure(fig)
 
     except Exception as e:
         logger.error(f"予測比較グラフ '{title}' 作成中にエラー: {e}", exc_info=True)
@@ -0,0 +1,307 @@
+# chart_cache.py - Plotly グラフのキャッシュとトレース軽量化
+"""
+作成済みの Plotly Figure を (グラフ種別, 集計データの版, グラフ引数) をキーに保持し、
+タブの切り替えや再実行のたびにグラフを作り直さないようにする。
+
+集計データの版は、グラフの元になる日次・月次などの集計結果（日数程度の行数）の
+内容ハッシュで表す。キャッシュに入れる前にトレースを軽量化し、ブラウザへ送る
+データ量を減らす（日付の短縮表記・数値の丸め・長期間トレースの間引き）。
+
+間引きは表示期間の点数が目標点数を超える場合だけ行い、短い期間は全点を送る。
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from config import CHART_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+_figure_cache = OrderedDict()
+_figure_cache_lock = threading.Lock()
+
+
+def aggregate_version(*objects):
+    """
+    集計結果の内容から版（ハッシュ文字列）を求める
+
+    データフレーム・Series は列名・インデックスを含む内容で、
+    それ以外の値は repr でハッシュする。集計後の小さなデータを渡すこと。
+    """
+    hasher = hashlib.sha1()
+    for obj in objects:
+        if isinstance(obj, pd.DataFrame):
+            hasher.update(repr(list(obj.columns)).encode('utf-8'))
+            hasher.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        elif isinstance(obj, pd.Series):
+            hasher.update(repr(obj.name).encode('utf-8'))
+            hasher.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        elif isinstance(obj, dict):
+            for key in sorted(obj, key=str):
+                hasher.update(repr(key).encode('utf-8'))
+                hasher.update(aggregate_version(obj[key]).encode('utf-8'))
+        else:
+            hasher.update(repr(obj).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def get_cached_figure(chart_name, version, params, builder):
+    """
+    キャッシュ済みのグラフを返す（なければ builder() で作成して軽量化・保存する）
+
+    Parameters:
+    -----------
+    chart_name : str
+        グラフの種別
+    version : str
+        元になる集計データの版（aggregate_version の結果）
+    params : dict
+        グラフの引数（タイトル・表示日数・目標値など）
+    builder : callable
+        引数なしで Figure（または None）を返す関数
+
+    Returns:
+    --------
+    plotly.graph_objects.Figure or None
+        複数の呼び出し元で共有されるため、呼び出し側で変更しないこと
+    """
+    if not CHART_SETTINGS.get('figure_cache_enabled', True):
+        return compact_figure(builder())
+
+    cache_key = (chart_name, version, repr(sorted(params.items())))
+    with _figure_cache_lock:
+        fig = _figure_cache.get(cache_key)
+        if fig is not None:
+            _figure_cache.move_to_end(cache_key)
+            return fig
+
+    fig = compact_figure(builder())
+    if fig is None:
+        return None
+
+    with _figure_cache_lock:
+        _figure_cache[cache_key] = fig
+        _figure_cache.move_to_end(cache_key)
+        while len(_figure_cache) > CHART_SETTINGS.get('figure_cache_size', 64):
+            _figure_cache.popitem(last=False)
+    return fig
+
+
+def clear_figure_cache():
+    """グラフキャッシュを空にする"""
+    with _figure_cache_lock:
+        _figure_cache.clear()
+
+
+def minmax_downsample_indices(values, max_points):
+    """
+    区間ごとの最小値・最大値の位置を残す間引き（山・谷を保持する）
+
+    Returns:
+    --------
+    np.ndarray
+        残す点の位置（昇順、先頭と末尾を含む）
+    """
+    n_points = len(values)
+    if max_points <= 0 or n_points <= max_points:
+        return np.arange(n_points)
+
+    values = np.asarray(values, dtype=np.float64)
+    n_buckets = max(1, (max_points - 2) // 2)
+    edges = np.linspace(1, n_points - 1, n_buckets + 1).astype(np.int64)
+    keep = [0, n_points - 1]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        bucket = values[lo:hi]
+        if np.isnan(bucket).all():
+            keep.append(lo)
+            continue
+        keep.append(lo + int(np.nanargmin(bucket)))
+        keep.append(lo + int(np.nanargmax(bucket)))
+    return np.unique(np.asarray(keep, dtype=np.int64))
+
+
+def lttb_downsample_indices(x_values, y_values, max_points):
+    """
+    LTTB（Largest-Triangle-Three-Buckets）による間引き
+
+    各区間から、前に選んだ点と次の区間の平均点とで作る三角形の面積が最大の点を選ぶ。
+    線の形（傾きの変化点）を少ない点数で保つ。
+
+    Parameters:
+    -----------
+    x_values : np.ndarray
+        数値化した X 座標（昇順）
+    y_values : np.ndarray
+        Y 座標（欠損値は NaN）
+    max_points : int
+        残す点数
+
+    Returns:
+    --------
+    np.ndarray
+        残す点の位置（昇順、先頭と末尾を含む）
+    """
+    n_points = len(y_values)
+    if max_points < 3 or n_points <= max_points:
+        return np.arange(n_points)
+
+    x_values = np.asarray(x_values, dtype=np.float64)
+    y_values = np.asarray(y_values, dtype=np.float64)
+    bucket_size = (n_points - 2) / (max_points - 2)
+    edges = (np.arange(max_points - 1) * bucket_size).astype(np.int64) + 1
+    edges[-1] = n_points - 1
+
+    keep = np.empty(max_points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n_points - 1
+    selected = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n_points
+        if next_hi <= next_lo:
+            next_lo, next_hi = n_points - 1, n_points
+        with np.errstate(invalid='ignore'):
+            avg_x = x_values[next_lo:next_hi].mean()
+            next_y = y_values[next_lo:next_hi]
+            avg_y = np.nanmean(next_y) if not np.isnan(next_y).all() else y_values[selected]
+            areas = np.abs(
+                (x_values[selected] - avg_x) * (y_values[lo:hi] - y_values[selected])
+                - (x_values[selected] - x_values[lo:hi]) * (avg_y - y_values[selected])
+            )
+        areas = np.nan_to_num(areas, nan=-1.0)
+        selected = lo + int(np.argmax(areas)) if hi > lo else lo
+        keep[i + 1] = selected
+    return np.unique(keep)
+
+
+def _crossing_indices(y_values, thresholds):
+    """y が閾値（目標値など）をまたぐ前後の位置"""
+    crossings = []
+    for threshold in thresholds:
+        above = y_values >= threshold
+        valid = ~np.isnan(y_values)
+        changed = np.flatnonzero((above[1:] != above[:-1]) & valid[1:] & valid[:-1])
+        crossings.append(changed)
+        crossings.append(changed + 1)
+    return np.concatenate(crossings) if crossings else np.empty(0, dtype=np.int64)
+
+
+def downsample_indices(x_values, y_values, max_points=None, thresholds=(), method=None):
+    """
+    長期間の折れ線を目標点数まで間引き、残す位置を返す
+
+    目標点数以下の系列は間引かない。LTTB（または最小・最大値）で選んだ点に加え、
+    系列の最大値・最小値と、閾値（目標線など）をまたぐ前後の点は必ず残す。
+
+    Returns:
+    --------
+    np.ndarray
+        残す点の位置（昇順）
+    """
+    if max_points is None:
+        max_points = CHART_SETTINGS.get('max_trace_points', 400)
+    if method is None:
+        method = CHART_SETTINGS.get('downsample_method', 'lttb')
+
+    y_values = np.asarray(y_values, dtype=np.float64)
+    n_points = len(y_values)
+    if max_points <= 0 or n_points <= max_points:
+        return np.arange(n_points)
+
+    x_values = np.asarray(x_values)
+    if np.issubdtype(x_values.dtype, np.datetime64):
+        x_numeric = x_values.astype('datetime64[ns]').astype(np.int64) / 86_400_000_000_000
+    elif np.issubdtype(x_values.dtype, np.number):
+        x_numeric = x_values.astype(np.float64)
+    else:
+        x_numeric = np.arange(n_points, dtype=np.float64)
+
+    if method == 'minmax':
+        positions = minmax_downsample_indices(y_values, max_points)
+    else:
+        positions = lttb_downsample_indices(x_numeric, y_values, max_points)
+
+    must_keep = [positions, _crossing_indices(y_values, thresholds)]
+    if not np.isnan(y_values).all():
+        must_keep.append(np.array([np.nanargmax(y_values), np.nanargmin(y_values)], dtype=np.int64))
+    return np.unique(np.concatenate(must_keep).astype(np.int64))
+
+
+def _target_line_values(fig):
+    """Figure 内の水平な補助線（目標線など）の値"""
+    thresholds = set()
+    for trace in fig.data:
+        if trace.type != 'scatter' or trace.fill not in (None, 'none') or trace.y is None:
+            continue
+        try:
+            y_values = np.asarray(trace.y, dtype=np.float64)
+        except (TypeError, ValueError):
+            continue
+        if len(y_values) >= 2 and not np.isnan(y_values).any() and (y_values == y_values[0]).all():
+            thresholds.add(float(y_values[0]))
+    return sorted(thresholds)
+
+
+def _compact_x(x_values):
+    """日付のみ（時刻なし）の datetime 配列を 'YYYY-MM-DD' 表記に短縮する"""
+    if not np.issubdtype(x_values.dtype, np.datetime64):
+        return x_values
+    day_values = x_values.astype('datetime64[D]')
+    if (day_values != x_values).any():
+        return x_values
+    return np.datetime_as_string(day_values, unit='D').astype(object)
+
+
+def compact_figure(fig, max_points=None, thresholds=None):
+    """
+    Figure のトレースを軽量化する（元の Figure を変更して返す）
+
+    - 時刻を含まない日付は 'YYYY-MM-DD' 表記で送る
+    - 数値は CHART_SETTINGS['compact_value_decimals'] 桁に丸める
+    - 点数が max_points を超える折れ線は downsample_indices で間引く
+      （thresholds を省略した場合は Figure 内の水平な目標線をまたぐ点を残す）
+    - 点数が多い場合はマーカーを外して線のみにする
+    塗りつぶし（fill）付きのトレースや数点の補助線はそのまま残す。
+    """
+    if fig is None or not CHART_SETTINGS.get('compact_traces', True):
+        return fig
+
+    if max_points is None:
+        max_points = CHART_SETTINGS.get('max_trace_points', 400)
+    decimals = CHART_SETTINGS.get('compact_value_decimals', 2)
+    marker_max_points = CHART_SETTINGS.get('marker_max_points', 120)
+    if thresholds is None:
+        thresholds = _target_line_values(fig)
+
+    for trace in fig.data:
+        if trace.type != 'scatter' or trace.fill not in (None, 'none') or trace.x is None or trace.y is None:
+            continue
+        x_values = np.asarray(trace.x)
+        try:
+            y_values = np.asarray(trace.y, dtype=np.float64)
+        except (TypeError, ValueError):
+            continue
+        if len(x_values) < 3 or len(x_values) != len(y_values):
+            continue
+
+        updates = {}
+        n_points = len(x_values)
+        positions = downsample_indices(x_values, y_values, max_points, thresholds)
+        if len(positions) < n_points:
+            x_values = x_values[positions]
+            y_values = y_values[positions]
+            if trace.customdata is not None and len(trace.customdata) == n_points:
+                updates['customdata'] = np.asarray(trace.customdata)[positions]
+
+        updates['x'] = _compact_x(x_values)
+        updates['y'] = np.round(y_values, decimals)
+        if len(x_values) > marker_max_points and trace.mode and 'markers' in trace.mode:
+            updates['mode'] = trace.mode.replace('+markers', '').replace('markers+', '') if trace.mode != 'markers' else 'markers'
+        trace.update(**updates)
+    return fig
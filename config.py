@@ -20,6 +20,17 @@ EXCLUDED_WARDS = ['03B']  # 表示・分析から除外する病棟のリスト
 CHART_HEIGHT = 400
 FONT_SCALE = 1.0  # style.pyで使用
 
+# ===== グラフ描画設定 =====
+CHART_SETTINGS = {
+    'figure_cache_enabled': True,  # 作成済みグラフ（Plotly Figure）を再利用する
+    'figure_cache_size': 64,  # 保持するグラフ数（プロセス全体）
+    'compact_traces': True,  # ブラウザへ送るトレースを軽量化する（日付の短縮・数値の丸め・長期間の間引き）
+    'compact_value_decimals': 2,  # 軽量化時の数値の小数桁数
+    'max_trace_points': 400,  # 1トレースあたりの目標点数（これ以下の期間は全点をそのまま表示）
+    'downsample_method': 'lttb',  # 間引き方法（'lttb' または 'minmax'）
+    'marker_max_points': 120,  # マーカーを表示する最大点数（超える場合は線のみ）
+}
+
 # ===== 期間設定 =====
 PERIOD_OPTIONS = ["直近30日", "前月完了分", "今年度"]
 DEFAULT_ANALYSIS_DAYS = 90  # 直近90日
@@ -64,14 +75,38 @@ DATA_PERSISTENCE = {
     'auto_load_enabled': True,  # 自動読み込み機能
     'auto_save_on_process': True,  # 処理後自動保存
     'max_saved_versions': 5,  # 最大保存バージョン数（将来の拡張用）
-    'compression_enabled': True,  # 圧縮保存（将来の拡張用）
+    'compression_enabled': True,  # バックアップスナップショットの圧縮保存
+    'max_backup_snapshots': 10,  # 保持するバックアップスナップショット数
+}
+
+# ===== データ型最適化設定 =====
+DATA_TYPE_OPTIMIZATION = {
+    'arrow_strings_enabled': False,  # 病棟コード・診療科名などを string[pyarrow] 型で保持する（オプトイン）
+    'arrow_string_columns': ['病棟コード', '診療科名', '平日判定'],  # 実績データで変換する列
+    'arrow_target_columns': ['部門コード', '部門名', '部門種別'],  # 目標値データで変換する列
 }
 
 # ===== 予測機能設定 =====
 FORECAST_SETTINGS = {
     'max_forecast_days': 365,
     'min_historical_days': 30,
-    'confidence_interval': 0.95
+    'confidence_interval': 0.95,
+    'monthly_completion_lookback_days': 28,  # 月末予測の平日・休日別日平均を求める直近日数
+    'model_store_enabled': True,  # 学習済みモデルのパラメータを系列ごとに保存して再利用する
+    'model_full_refit_days': 7,  # 次数探索・全パラメータ推定を行う間隔（データの日数）
+    'runner_max_workers': 4,  # 診療科・病棟ごとの一括予測のワーカー数の上限
+    'runner_max_tasks_per_child': 8,  # 一括予測のワーカーを入れ替えるまでのタスク数（メモリ解放）
+    'arima_search_limits': {  # ARIMA の次数探索の上限（計算量削減のため次数を制限）
+        'max_order': 3,
+        'max_p': 2, 'max_d': 1, 'max_q': 2,
+        'max_P': 1, 'max_D': 1, 'max_Q': 1,
+    },
+    'backtest_horizons': [7, 30, 90],  # バックテストで評価する予測日数
+    'backtest_n_cutoffs': 4,  # バックテストの予測起点の数
+    'backtest_cutoff_step_days': 28,  # バックテストの予測起点の間隔（日数）
+    'baseline_lookback_weeks': 8,  # ベースラインモデルの曜日プロファイル係数を求める直近週数
+    'bootstrap_repetitions': 500,  # 残差ブートストラップによる予測区間の経路数
+    'bootstrap_residual_days': 56  # 閉形式モデルの予測区間に使う1日先予測の残差の日数（直近）
 }
 
 # ===== 病院設備設定 =====
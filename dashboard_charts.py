@@ -3,9 +3,8 @@ import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
-import streamlit as st
+from chart_cache import aggregate_version, get_cached_figure
 
-@st.cache_data(ttl=3600, show_spinner=False)
 def create_monthly_trend_chart(kpi_data):
     """
     月別の平均在院日数と入退院患者数の推移チャートを作成
@@ -24,7 +23,14 @@ def create_monthly_trend_chart(kpi_data):
         return None
     
     monthly_data = kpi_data['monthly_stats']
-    
+    # 月次集計が同じなら作成済みのグラフを再利用する
+    return get_cached_figure(
+        "monthly_trend_chart", aggregate_version(monthly_data), {},
+        lambda: _build_monthly_trend_chart(monthly_data)
+    )
+
+def _build_monthly_trend_chart(monthly_data):
+    """月次集計から月別推移チャートを作成"""
     # 二軸グラフの作成
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     
@@ -93,7 +99,6 @@ def create_monthly_trend_chart(kpi_data):
     
     return fig
 
-@st.cache_data(ttl=3600, show_spinner=False)
 def create_admissions_discharges_chart(kpi_data):
     """
     週別の入退院バランスチャートを作成
@@ -112,7 +117,13 @@ def create_admissions_discharges_chart(kpi_data):
         return None
     
     weekly_data = kpi_data['weekly_stats']
-    
+    return get_cached_figure(
+        "admissions_discharges_chart", aggregate_version(weekly_data), {},
+        lambda: _build_admissions_discharges_chart(weekly_data)
+    )
+
+def _build_admissions_discharges_chart(weekly_data):
+    """週次集計から入退院バランスチャートを作成"""
     # グラフの作成
     fig = go.Figure()
     
@@ -167,7 +178,6 @@ def create_admissions_discharges_chart(kpi_data):
     
     return fig
 
-@st.cache_data(ttl=3600, show_spinner=False)
 def create_occupancy_chart(kpi_data, total_beds, target_occupancy_rate_percent):
     """
     月別の病床利用率チャートを作成（縦軸範囲を適切に調整）
@@ -189,7 +199,16 @@ def create_occupancy_chart(kpi_data, total_beds, target_occupancy_rate_percent):
     if kpi_data is None or 'monthly_stats' not in kpi_data or kpi_data['monthly_stats'].empty or total_beds == 0:
         return None
     
-    monthly_df = kpi_data['monthly_stats'].copy()
+    monthly_stats = kpi_data['monthly_stats']
+    return get_cached_figure(
+        "occupancy_chart", aggregate_version(monthly_stats),
+        {'total_beds': total_beds, 'target_occupancy_rate_percent': target_occupancy_rate_percent},
+        lambda: _build_occupancy_chart(monthly_stats, total_beds, target_occupancy_rate_percent)
+    )
+
+def _build_occupancy_chart(monthly_stats, total_beds, target_occupancy_rate_percent):
+    """月次集計から病床利用率チャートを作成"""
+    monthly_df = monthly_stats.copy()
     
     # 病床利用率の計算
     monthly_df['病床利用率'] = (monthly_df['日平均在院患者数'] / total_beds) * 100
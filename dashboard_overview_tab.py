@@ -3,6 +3,7 @@ import pandas as pd
 from datetime import timedelta
 import logging
 from config import EXCLUDED_WARDS
+from row_selection import get_row_selection_index
 logger = logging.getLogger(__name__)
 
 # dashboard_charts.py からのインポートは維持
@@ -20,10 +21,16 @@ except ImportError:
 
 # kpi_calculator.py からのインポートは維持
 try:
-    from kpi_calculator import calculate_kpis, analyze_kpi_insights, get_kpi_status
+    from kpi_calculator import (
+        calculate_kpis, analyze_kpi_insights, get_kpi_status,
+        get_daily_aggregate, calculate_yoy_kpis, get_previous_year_period
+    )
 except ImportError:
     st.error("kpi_calculator.py が見つからないか、必要な関数が定義されていません。")
     calculate_kpis = None
+    get_daily_aggregate = None
+    calculate_yoy_kpis = None
+    get_previous_year_period = None
     analyze_kpi_insights = None
     get_kpi_status = None
 
@@ -467,6 +474,17 @@ def get_target_value_for_filter(target_df, filter_config, metric_type="日平均
         messages.append(("error", f"目標値取得エラー: {e}"))
         return None, None, None, messages
 
+def get_filter_units(df_original, current_filter_config):
+    """フィルター設定から対象の病棟コード・診療科名を取得（None は全て）"""
+    wards = depts = None
+    if apply_unified_filters and current_filter_config:
+        filter_mode = current_filter_config.get('filter_mode', '全体')
+        if filter_mode == "特定診療科" and current_filter_config.get('selected_depts') and '診療科名' in df_original.columns:
+            depts = current_filter_config['selected_depts']
+        elif filter_mode == "特定病棟" and current_filter_config.get('selected_wards') and '病棟コード' in df_original.columns:
+            wards = current_filter_config['selected_wards']
+    return wards, depts
+
 def calculate_previous_year_same_period(df_original, current_end_date, current_filter_config):
     """
     昨年度同期間のデータを計算（統一フィルター適用）
@@ -483,60 +501,20 @@ def calculate_previous_year_same_period(df_original, current_end_date, current_f
         if df_original is None or df_original.empty:
             return pd.DataFrame(), None, None, "データなし"
         
-        # 現在の年度を判定
-        if current_end_date.month >= 4:
-            current_fiscal_year = current_end_date.year
-        else:
-            current_fiscal_year = current_end_date.year - 1
-        
-        # 昨年度の開始日（昨年度4月1日）
-        prev_fiscal_start = pd.Timestamp(year=current_fiscal_year - 1, month=4, day=1)
-        
-        # 昨年度の終了日（昨年度の同月日）
-        try:
-            prev_fiscal_end = pd.Timestamp(
-                year=current_end_date.year - 1, 
-                month=current_end_date.month, 
-                day=current_end_date.day
-            )
-        except ValueError:
-            # 2月29日などの特殊ケース対応
-            prev_fiscal_end = pd.Timestamp(
-                year=current_end_date.year - 1, 
-                month=current_end_date.month, 
-                day=28
-            )
+        # 昨年度同期間（昨年度4月1日 ～ 昨年度の同月日）
+        prev_fiscal_start, prev_fiscal_end, period_description = get_previous_year_period(current_end_date)
         
-        # 昨年度同期間のデータをフィルタリング
+        # 昨年度同期間のデータをフィルタリング（期間・部門条件をまとめて1回で抽出し、元データは変更しない）
         if '日付' in df_original.columns:
-            df_original['日付'] = pd.to_datetime(df_original['日付'])
-            prev_year_data = df_original[
-                (df_original['日付'] >= prev_fiscal_start) & 
-                (df_original['日付'] <= prev_fiscal_end)
-            ].copy()
+            wards, depts = get_filter_units(df_original, current_filter_config)
+            index = get_row_selection_index(df_original)
+            prev_year_positions = index.select(prev_fiscal_start, prev_fiscal_end, wards=wards, depts=depts)
+            prev_year_data = df_original.take(prev_year_positions)
+            if not pd.api.types.is_datetime64_any_dtype(prev_year_data['日付']):
+                prev_year_data['日付'] = pd.to_datetime(prev_year_data['日付'])
         else:
             prev_year_data = pd.DataFrame()
         
-        # 統一フィルターの部門設定を昨年度データに適用
-        if apply_unified_filters and current_filter_config and not prev_year_data.empty:
-            filter_mode = current_filter_config.get('filter_mode', '全体')
-            
-            if filter_mode == "特定診療科" and current_filter_config.get('selected_depts'):
-                if '診療科名' in prev_year_data.columns:
-                    prev_year_data = prev_year_data[
-                        prev_year_data['診療科名'].isin(current_filter_config['selected_depts'])
-                    ]
-            
-            elif filter_mode == "特定病棟" and current_filter_config.get('selected_wards'):
-                if '病棟コード' in prev_year_data.columns:
-                    prev_year_data = prev_year_data[
-                        prev_year_data['病棟コード'].isin(current_filter_config['selected_wards'])
-                    ]
-        
-        # 期間説明文
-        period_days = (prev_fiscal_end - prev_fiscal_start).days + 1
-        period_description = f"{prev_fiscal_start.strftime('%Y年%m月%d日')} ～ {prev_fiscal_end.strftime('%Y年%m月%d日')} ({period_days}日間)"
-        
         logger.info(f"昨年度同期間データ抽出完了: {len(prev_year_data)}行, 期間: {period_description}")
         
         return prev_year_data, prev_fiscal_start, prev_fiscal_end, period_description
@@ -1013,21 +991,34 @@ def display_kpi_cards_only(df, start_date, end_date, total_beds_setting, target_
             target_df = st.session_state.get('target_values_df', pd.DataFrame())
         target_data_source = "読み込み待ち"
 
-    if df is not None and not df.empty and '病棟コード' in df.columns and EXCLUDED_WARDS:
-        df = df[~df['病棟コード'].isin(EXCLUDED_WARDS)]
-
-    # KPI計算
-    kpis_selected_period = calculate_kpis(df, start_date, end_date, total_beds=total_beds_setting)
+    # 除外病棟は行を抜き出さず、日次集計の条件として扱う
+    exclude_wards = EXCLUDED_WARDS if '病棟コード' in df.columns and EXCLUDED_WARDS else None
+    record_count = len(df)
+    if exclude_wards:
+        record_count -= int(get_row_selection_index(df).value_mask('病棟コード', exclude_wards).sum())
+    
+    current_filter_config = get_unified_filter_config() if get_unified_filter_config else None
+    
+    # KPI計算（当期・昨年度同期間を日次集計から1回で算出）
+    df_original = st.session_state.get('df')
+    prior_daily = None
+    if df_original is not None and not df_original.empty and '日付' in df_original.columns:
+        try:
+            prior_wards, prior_depts = get_filter_units(df_original, current_filter_config)
+            prior_daily = get_daily_aggregate(df_original, wards=prior_wards, depts=prior_depts)
+        except Exception as e:
+            logger.warning(f"昨年度同期間の日次集計に失敗しました: {e}")
+    
+    yoy_kpis = calculate_yoy_kpis(
+        get_daily_aggregate(df, exclude_wards=exclude_wards),
+        start_date, end_date, total_beds=total_beds_setting,
+        prior_daily=prior_daily
+    )
+    kpis_selected_period = yoy_kpis['current']
     if kpis_selected_period is None or kpis_selected_period.get("error"):
         st.warning(f"選択された期間のKPI計算に失敗しました。")
         return
     
-    # メトリクス準備
-    period_df = df[(df['日付'] >= start_date) & (df['日付'] <= end_date)]
-    total_admissions = 0
-    if '入院患者数' in period_df.columns:
-        total_admissions = period_df['入院患者数'].sum()
-    
     metrics_for_display = {
         'avg_daily_census': kpis_selected_period.get('avg_daily_census'),
         'bed_occupancy_rate': kpis_selected_period.get('bed_occupancy_rate'),
@@ -1037,11 +1028,10 @@ def display_kpi_cards_only(df, start_date, end_date, total_beds_setting, target_
         'avg_daily_admissions': kpis_selected_period.get('avg_daily_admissions'),
         'period_days': kpis_selected_period.get('days_count'),
         'total_beds': total_beds_setting,
-        'total_admissions': total_admissions,
+        'total_admissions': kpis_selected_period.get('total_new_admissions', 0),
     }
     
     # --- MODIFIED: 目標値取得ロジックの修正 ---
-    current_filter_config = get_unified_filter_config() if get_unified_filter_config else None
     target_info = (None, None, None)
     target_messages = []
 
@@ -1059,34 +1049,19 @@ def display_kpi_cards_only(df, start_date, end_date, total_beds_setting, target_
         except Exception as e:
             target_messages.append(("error", f"目標値取得でエラーが発生しました: {e}"))
     
-    # 昨年度同期間データ（エラー抑制）
-    df_original = st.session_state.get('df')
+    # 昨年度同期間（日次集計から算出済み）
     prev_year_metrics = None
     prev_year_period_info = None
-    
-    if df_original is not None and not df_original.empty:
-        try:
-            prev_year_data, prev_start, prev_end, prev_period_desc = calculate_previous_year_same_period(
-                df_original, end_date, current_filter_config
-            )
-            
-            if not prev_year_data.empty and prev_start and prev_end:
-                prev_year_kpis = calculate_kpis(prev_year_data, prev_start, prev_end, total_beds=total_beds_setting)
-                if prev_year_kpis and not prev_year_kpis.get("error"):
-                    prev_total_admissions = 0
-                    if '入院患者数' in prev_year_data.columns:
-                        prev_total_admissions = prev_year_data['入院患者数'].sum()
-                    
-                    prev_year_metrics = {
-                        'avg_daily_census': prev_year_kpis.get('avg_daily_census'),
-                        'bed_occupancy_rate': prev_year_kpis.get('bed_occupancy_rate'),
-                        'avg_los': prev_year_kpis.get('alos'),
-                        'avg_daily_admissions': prev_year_kpis.get('avg_daily_admissions'),
-                        'total_admissions': prev_total_admissions,
-                    }
-                    prev_year_period_info = prev_period_desc
-        except:
-            pass
+    prev_year_kpis = yoy_kpis['previous']
+    if prev_year_kpis:
+        prev_year_metrics = {
+            'avg_daily_census': prev_year_kpis.get('avg_daily_census'),
+            'bed_occupancy_rate': prev_year_kpis.get('bed_occupancy_rate'),
+            'avg_los': prev_year_kpis.get('alos'),
+            'avg_daily_admissions': prev_year_kpis.get('avg_daily_admissions'),
+            'total_admissions': prev_year_kpis.get('total_new_admissions', 0),
+        }
+        prev_year_period_info = yoy_kpis['previous_period_description']
     
     # =================================================================
     # 2. KPIカード表示（簡潔版）
@@ -1145,7 +1120,7 @@ def display_kpi_cards_only(df, start_date, end_date, total_beds_setting, target_
     with col_summary3:
         # データ期間
         date_range_days = (end_date - start_date).days + 1
-        st.metric("📊 分析期間", f"{date_range_days}日間", f"レコード数: {len(df):,}件")
+        st.metric("📊 分析期間", f"{date_range_days}日間", f"レコード数: {record_count:,}件")
     
     # =================================================================
     # 4. 詳細情報（Expanderで制御）
@@ -1226,8 +1201,8 @@ def display_kpi_cards_only(df, start_date, end_date, total_beds_setting, target_
             original_df = st.session_state.get('df')
             if original_df is not None:
                 st.write(f"• 元データ件数: {len(original_df):,}件")
-                st.write(f"• フィルター後件数: {len(df):,}件")
-                filter_ratio = len(df) / len(original_df) * 100 if len(original_df) > 0 else 0
+                st.write(f"• フィルター後件数: {record_count:,}件")
+                filter_ratio = record_count / len(original_df) * 100 if len(original_df) > 0 else 0
                 st.write(f"• フィルター適用率: {filter_ratio:.1f}%")
         
         with col_stat2:
@@ -7,6 +7,18 @@ import streamlit as st
 from datetime import datetime
 import json
 import shutil
+import gzip
+import logging
+import threading
+import time
+import hashlib
+import io
+import numpy as np
+
+from config import DATA_PERSISTENCE
+from utils import apply_arrow_string_mode
+
+logger = logging.getLogger(__name__)
 
 # ===== 設定 =====
 DATA_DIR = "saved_data"
@@ -14,6 +26,7 @@ MAIN_DATA_FILE = os.path.join(DATA_DIR, "main_data.pkl")
 METADATA_FILE = os.path.join(DATA_DIR, "metadata.json")
 SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
 BACKUP_DIR = os.path.join(DATA_DIR, "backup")
+MANIFEST_FILE = os.path.join(DATA_DIR, "manifest.json")
 
 def ensure_data_directory():
     """データディレクトリの存在確認・作成"""
@@ -27,8 +40,291 @@ def ensure_data_directory():
         st.error(f"ディレクトリ作成エラー: {e}")
         return False
 
+# ===== バックアップスナップショット =====
+# バックアップは「月別パーティション」単位の内容アドレス型ストアに保存する。
+# 各パーティションは内容ハッシュをファイル名としたオブジェクトとして1度だけ書き込まれ、
+# スナップショット（snapshot_*.json）はどのオブジェクトで構成されるかだけを記録する。
+# 過去月のデータは保存のたびに変わらないため、スナップショット間で共有される。
+SNAPSHOT_OBJECTS_DIR = os.path.join(BACKUP_DIR, "objects")
+SNAPSHOT_PREFIX = "snapshot_"
+LEGACY_BACKUP_PREFIX = "main_data_backup_"
+NO_DATE_PARTITION = "no_date"
+
+def _format_file_size(size_bytes):
+    """バイト数を表示用文字列に変換"""
+    if size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.1f} KB"
+    return f"{size_bytes / (1024 * 1024):.1f} MB"
+
+def _snapshot_compression_enabled():
+    return DATA_PERSISTENCE.get('compression_enabled', True)
+
+def _hash_frame(frame, include_index):
+    """データフレームの内容ハッシュ（列名・型・値）を計算"""
+    hasher = hashlib.sha1()
+    hasher.update(repr([(str(col), str(dtype)) for col, dtype in frame.dtypes.items()]).encode('utf-8'))
+    hasher.update(repr(include_index).encode('utf-8'))
+    if len(frame) > 0:
+        row_hashes = pd.util.hash_pandas_object(frame, index=include_index).to_numpy()
+        hasher.update(row_hashes.tobytes())
+    return hasher.hexdigest()
+
+def _write_object_bytes(object_name, payload):
+    """オブジェクトを書き込む（同一内容が既に存在する場合は書き込まない）"""
+    object_path = os.path.join(SNAPSHOT_OBJECTS_DIR, object_name)
+    if not os.path.exists(object_path):
+        temp_path = f"{object_path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(temp_path, object_path)
+    return object_name
+
+def _write_pickle_object(obj, content_hash):
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    if _snapshot_compression_enabled():
+        return _write_object_bytes(f"{content_hash}.pkl.gz", gzip.compress(payload, compresslevel=6))
+    return _write_object_bytes(f"{content_hash}.pkl", payload)
+
+def _write_frame_object(frame, include_index):
+    """データフレームをオブジェクトとして保存し、オブジェクト名を返す"""
+    content_hash = _hash_frame(frame, include_index)
+    for existing_name in (f"{content_hash}.parquet", f"{content_hash}.pkl.gz", f"{content_hash}.pkl"):
+        if os.path.exists(os.path.join(SNAPSHOT_OBJECTS_DIR, existing_name)):
+            return existing_name
+    try:
+        buffer = io.BytesIO()
+        frame.to_parquet(
+            buffer, index=include_index,
+            compression='zstd' if _snapshot_compression_enabled() else None
+        )
+        return _write_object_bytes(f"{content_hash}.parquet", buffer.getvalue())
+    except Exception:
+        # 型が混在した列などParquetに変換できない場合はpickleで保存
+        return _write_pickle_object(frame, content_hash)
+
+def _read_object(object_name):
+    object_path = os.path.join(SNAPSHOT_OBJECTS_DIR, object_name)
+    if object_name.endswith(".parquet"):
+        return pd.read_parquet(object_path)
+    if object_name.endswith(".npy.gz"):
+        with gzip.open(object_path, 'rb') as f:
+            return np.load(f)
+    if object_name.endswith(".gz"):
+        with gzip.open(object_path, 'rb') as f:
+            return pickle.load(f)
+    with open(object_path, 'rb') as f:
+        return pickle.load(f)
+
+def _write_row_order_object(row_order):
+    """月別に並べ替える前の行順序を保存（復元時に元の行順へ戻すため）"""
+    if len(row_order) < np.iinfo(np.int32).max:
+        row_order = row_order.astype(np.int32)
+    content_hash = hashlib.sha1(row_order.tobytes()).hexdigest()
+    buffer = io.BytesIO()
+    np.save(buffer, row_order)
+    return _write_object_bytes(f"{content_hash}.npy.gz", gzip.compress(buffer.getvalue(), compresslevel=6))
+
+def _split_month_partitions(df):
+    """日付列の年月でパーティション分割し、(キー, 行位置) のリストと並べ替え要否を返す"""
+    if '日付' in df.columns:
+        months = pd.to_datetime(df['日付'], errors='coerce').to_numpy().astype('datetime64[M]')
+        labels = np.where(np.isnat(months), NO_DATE_PARTITION, np.datetime_as_string(months, unit='M'))
+    else:
+        labels = np.full(len(df), NO_DATE_PARTITION, dtype=object)
+    codes, uniques = pd.factorize(labels, sort=True)
+    row_order = np.argsort(codes, kind='stable')
+    boundaries = np.searchsorted(codes[row_order], np.arange(len(uniques) + 1))
+    partitions = [
+        (str(uniques[i]), row_order[boundaries[i]:boundaries[i + 1]])
+        for i in range(len(uniques))
+    ]
+    needs_reorder = not np.array_equal(row_order, np.arange(len(df)))
+    return partitions, row_order, needs_reorder
+
+def _list_snapshot_files():
+    if not os.path.exists(BACKUP_DIR):
+        return []
+    return sorted(
+        (f for f in os.listdir(BACKUP_DIR) if f.startswith(SNAPSHOT_PREFIX) and f.endswith(".json")),
+        reverse=True
+    )
+
+def _read_snapshot_manifest(snapshot_filename):
+    with open(os.path.join(BACKUP_DIR, snapshot_filename), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_snapshot_manifest(manifest):
+    snapshot_filename = f"{SNAPSHOT_PREFIX}{manifest['snapshot_id']}.json"
+    temp_path = os.path.join(BACKUP_DIR, f"{snapshot_filename}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(temp_path, os.path.join(BACKUP_DIR, snapshot_filename))
+    return snapshot_filename
+
+def _new_snapshot_id():
+    snapshot_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    suffix = 1
+    candidate = snapshot_id
+    while os.path.exists(os.path.join(BACKUP_DIR, f"{SNAPSHOT_PREFIX}{candidate}.json")):
+        candidate = f"{snapshot_id}_{suffix}"
+        suffix += 1
+    return candidate
+
+def _snapshot_timestamp(snapshot_id):
+    return datetime.strptime(snapshot_id[:15], "%Y%m%d_%H%M%S")
+
+def write_snapshot(saved_data, metadata=None):
+    """保存データ（main_data.pkl と同じ構造の辞書）をスナップショットとして保存
+
+    Returns:
+        str or None: スナップショットID
+    """
+    if not ensure_data_directory():
+        return None
+    os.makedirs(SNAPSHOT_OBJECTS_DIR, exist_ok=True)
+
+    df = saved_data.get('df')
+    target_data = saved_data.get('target_data')
+    envelope = {k: v for k, v in saved_data.items() if k not in ('df', 'target_data')}
+
+    manifest = {
+        'snapshot_id': _new_snapshot_id(),
+        'created_at': datetime.now().isoformat(),
+        'format_version': 1,
+        'partitions': [],
+        'row_order': None,
+        'index_is_range': True,
+        'target_data': None,
+        'envelope': None,
+        'metadata': metadata or {},
+    }
+
+    if df is not None:
+        include_index = not (
+            isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1
+        )
+        manifest['index_is_range'] = not include_index
+        partitions, row_order, needs_reorder = _split_month_partitions(df)
+        for partition_key, positions in partitions:
+            partition_df = df.take(positions)
+            if not include_index:
+                partition_df = partition_df.reset_index(drop=True)
+            manifest['partitions'].append({
+                'key': partition_key,
+                'rows': int(len(positions)),
+                'object': _write_frame_object(partition_df, include_index),
+            })
+        if needs_reorder:
+            manifest['row_order'] = _write_row_order_object(row_order)
+        if not partitions:
+            # 行がない場合も列構成は復元できるようにする
+            manifest['partitions'].append({
+                'key': NO_DATE_PARTITION, 'rows': 0,
+                'object': _write_frame_object(df.iloc[0:0], include_index),
+            })
+
+    if target_data is not None:
+        manifest['target_data'] = _write_frame_object(target_data, include_index=True)
+
+    envelope_payload = pickle.dumps(envelope, protocol=pickle.HIGHEST_PROTOCOL)
+    manifest['envelope'] = _write_pickle_object(envelope, hashlib.sha1(envelope_payload).hexdigest())
+
+    _write_snapshot_manifest(manifest)
+    prune_snapshots()
+    return manifest['snapshot_id']
+
+def read_snapshot(snapshot_filename):
+    """スナップショットから保存データ辞書とメタデータを再構築"""
+    manifest = _read_snapshot_manifest(snapshot_filename)
+
+    df = None
+    if manifest.get('partitions'):
+        frames = [_read_object(p['object']) for p in manifest['partitions']]
+        df = pd.concat(frames, ignore_index=manifest.get('index_is_range', True)) if len(frames) > 1 else frames[0]
+        if manifest.get('row_order'):
+            row_order = _read_object(manifest['row_order'])
+            inverse_order = np.empty_like(row_order)
+            inverse_order[row_order] = np.arange(len(row_order), dtype=row_order.dtype)
+            df = df.take(inverse_order)
+        if manifest.get('index_is_range', True):
+            df = df.reset_index(drop=True)
+
+    target_data = _read_object(manifest['target_data']) if manifest.get('target_data') else None
+    saved_data = _read_object(manifest['envelope']) if manifest.get('envelope') else {}
+    saved_data['df'] = df
+    saved_data['target_data'] = target_data
+
+    metadata = dict(manifest.get('metadata') or {})
+    metadata['snapshot_id'] = manifest['snapshot_id']
+    return saved_data, metadata
+
+def prune_snapshots(max_snapshots=None):
+    """古いスナップショットを削除し、どこからも参照されないオブジェクトを片付ける"""
+    if max_snapshots is None:
+        max_snapshots = DATA_PERSISTENCE.get('max_backup_snapshots', 10)
+
+    for old_snapshot in _list_snapshot_files()[max_snapshots:]:
+        try:
+            os.remove(os.path.join(BACKUP_DIR, old_snapshot))
+        except OSError:
+            pass
+
+    # 旧形式（ファイルコピー）のバックアップも同じ上限で整理
+    legacy_files = sorted(
+        (f for f in os.listdir(BACKUP_DIR) if f.startswith(LEGACY_BACKUP_PREFIX)), reverse=True
+    ) if os.path.exists(BACKUP_DIR) else []
+    for old_backup in legacy_files[max_snapshots:]:
+        try:
+            os.remove(os.path.join(BACKUP_DIR, old_backup))
+            metadata_backup = old_backup.replace(LEGACY_BACKUP_PREFIX, "metadata_backup_").replace(".pkl", ".json")
+            metadata_path = os.path.join(BACKUP_DIR, metadata_backup)
+            if os.path.exists(metadata_path):
+                os.remove(metadata_path)
+        except OSError:
+            pass
+
+    if not os.path.exists(SNAPSHOT_OBJECTS_DIR):
+        return
+    referenced_objects = set()
+    for snapshot_file in _list_snapshot_files():
+        try:
+            manifest = _read_snapshot_manifest(snapshot_file)
+        except Exception:
+            continue
+        referenced_objects.update(p['object'] for p in manifest.get('partitions', []))
+        for key in ('row_order', 'target_data', 'envelope'):
+            if manifest.get(key):
+                referenced_objects.add(manifest[key])
+    for object_name in os.listdir(SNAPSHOT_OBJECTS_DIR):
+        if object_name not in referenced_objects:
+            try:
+                os.remove(os.path.join(SNAPSHOT_OBJECTS_DIR, object_name))
+            except OSError:
+                pass
+
+def _get_current_snapshot_file():
+    """現在の保存データに対応するスナップショットファイル名（なければ None）"""
+    metadata = get_data_info()
+    snapshot_id = metadata.get('snapshot_id') if metadata else None
+    if not snapshot_id:
+        return None
+    snapshot_filename = f"{SNAPSHOT_PREFIX}{snapshot_id}.json"
+    if os.path.exists(os.path.join(BACKUP_DIR, snapshot_filename)):
+        return snapshot_filename
+    return None
+
+def _snapshot_current_file():
+    """main_data.pkl の内容をスナップショット化（既に取得済みなら何もしない）"""
+    if not os.path.exists(MAIN_DATA_FILE):
+        return None
+    if _get_current_snapshot_file() is not None:
+        return get_data_info().get('snapshot_id')
+    with open(MAIN_DATA_FILE, 'rb') as f:
+        saved_data = pickle.load(f)
+    return write_snapshot(saved_data, get_data_info())
+
 def create_backup(force_create=False):
-    """現在のデータのバックアップを作成
+    """現在のデータのバックアップ（スナップショット）を作成
     
     Args:
         force_create (bool): Trueの場合、ファイルが存在しなくてもエラーにしない
@@ -41,10 +337,8 @@ def create_backup(force_create=False):
                     df = st.session_state.get('df')
                     target_data = st.session_state.get('target_data')
                     if df is not None:
-                        # 一時的にファイルに保存してからバックアップ
-                        temp_success = save_data_to_file(df, target_data)
-                        if not temp_success:
-                            return False
+                        # 保存時にスナップショットも作成される
+                        return save_data_to_file(df, target_data)
                     else:
                         return False
                 else:
@@ -52,120 +346,494 @@ def create_backup(force_create=False):
             else:
                 return False
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = os.path.join(BACKUP_DIR, f"main_data_backup_{timestamp}.pkl")
-        shutil.copy2(MAIN_DATA_FILE, backup_file)
-        
-        # メタデータファイルもバックアップ
-        if os.path.exists(METADATA_FILE):
-            backup_metadata_file = os.path.join(BACKUP_DIR, f"metadata_backup_{timestamp}.json")
-            shutil.copy2(METADATA_FILE, backup_metadata_file)
-        
-        # 古いバックアップファイルを削除（最新10個まで保持）
-        backup_files = [f for f in os.listdir(BACKUP_DIR) if f.startswith("main_data_backup_")]
-        backup_files.sort(reverse=True)
-        
-        for old_backup in backup_files[10:]:
-            try:
-                os.remove(os.path.join(BACKUP_DIR, old_backup))
-                # 対応するメタデータファイルも削除
-                metadata_backup = old_backup.replace("main_data_backup_", "metadata_backup_").replace(".pkl", ".json")
-                metadata_path = os.path.join(BACKUP_DIR, metadata_backup)
-                if os.path.exists(metadata_path):
-                    os.remove(metadata_path)
-            except:
-                pass
+        ensure_data_directory()
+        current_snapshot = _get_current_snapshot_file()
+        if current_snapshot is not None:
+            # 内容は取得済みのため、同じオブジェクトを参照するスナップショットを追加するだけ
+            manifest = _read_snapshot_manifest(current_snapshot)
+            manifest['snapshot_id'] = _new_snapshot_id()
+            manifest['created_at'] = datetime.now().isoformat()
+            _write_snapshot_manifest(manifest)
+            prune_snapshots()
+            refresh_manifest()
+            return True
         
-        return True
+        created = _snapshot_current_file() is not None
+        refresh_manifest()
+        return created
     except Exception as e:
         st.warning(f"バックアップ作成エラー: {e}")
         return False
 
+def _atomic_write_pickle(obj, file_path):
+    """一時ファイルに書き込んでから置き換える（書き込み途中で落ちても既存ファイルは壊れない）"""
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+def _atomic_write_json(obj, file_path):
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+def _build_data_statistics(df):
+    """メタデータ用の日付範囲・基本統計を計算（各列1回ずつの走査）"""
+    date_range = {}
+    statistics = {}
+    if df is None or df.empty:
+        return date_range, statistics
+    
+    if '日付' in df.columns:
+        try:
+            dates = df['日付']
+            min_date = dates.min()
+            max_date = dates.max()
+            date_range = {
+                'min_date': min_date.isoformat(),
+                'max_date': max_date.isoformat(),
+                'total_days': (max_date - min_date).days + 1,
+                'unique_dates': int(dates.nunique())
+            }
+        except Exception:
+            date_range = {}
+    
+    statistics = {
+        'departments': int(df['診療科名'].nunique()) if '診療科名' in df.columns else 0,
+        'wards': int(df['病棟コード'].nunique()) if '病棟コード' in df.columns else 0,
+        'total_records': len(df),
+        'columns_count': len(df.columns)
+    }
+    return date_range, statistics
+
+def _build_save_job(df, target_data=None, metadata=None):
+    """保存に必要な情報をまとめる（セッション状態の参照はスクリプトスレッドでのみ行う）"""
+    return {
+        # 保存中に呼び出し側で列が追加・削除されても影響しないよう浅いコピーを保持
+        'df': df.copy(deep=False) if df is not None else None,
+        'target_data': target_data.copy(deep=False) if target_data is not None else None,
+        'metadata': dict(metadata) if metadata else {},
+        'data_source': st.session_state.get('data_source', 'unknown'),
+        'session_info': {
+            'filter_config': st.session_state.get('current_unified_filter_config', {}),
+            'performance_metrics': st.session_state.get('performance_metrics', {}),
+            'validation_results': st.session_state.get('validation_results', {})
+        },
+        'queued_at': datetime.now(),
+    }
+
+def _write_data_files(job):
+    """保存ジョブを実行（失敗時は例外を送出）"""
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+    if not os.path.exists(BACKUP_DIR):
+        os.makedirs(BACKUP_DIR)
+    
+    df = job['df']
+    target_data = job['target_data']
+    metadata = job['metadata']
+    
+    # 旧形式で保存されたデータはスナップショット化されていないため、上書き前に取得
+    if os.path.exists(MAIN_DATA_FILE) and _get_current_snapshot_file() is None:
+        _snapshot_current_file()
+    
+    # メインデータの保存
+    data_to_save = {
+        'df': df,
+        'target_data': target_data,
+        'saved_at': datetime.now(),
+        'data_shape': df.shape if df is not None else None,
+        'version': '1.2',  # バージョンアップ
+        'data_source': job['data_source'],
+        'session_info': job['session_info']
+    }
+    
+    _atomic_write_pickle(data_to_save, MAIN_DATA_FILE)
+    
+    # 全セッションで共有する読み取り専用データファイルも同じバージョンで作成
+    try:
+        _write_shared_dataset(data_to_save, get_saved_data_version())
+    except Exception as e:
+        logger.warning(f"共有データファイルの作成エラー: {e}")
+    
+    # メタデータの保存（強化版）
+    date_range, statistics = _build_data_statistics(df)
+    enhanced_metadata = {
+        'last_saved': datetime.now().isoformat(),
+        'data_rows': len(df) if df is not None else 0,
+        'data_columns': list(df.columns) if df is not None else [],
+        'file_size_mb': round(os.path.getsize(MAIN_DATA_FILE) / (1024 * 1024), 2),
+        'data_source': job['data_source'],
+        'app_version': '1.2',
+        'save_count': metadata.get('save_count', 0) + 1,
+        'date_range': date_range,
+        'statistics': statistics
+    }
+    
+    # 元のメタデータと結合
+    enhanced_metadata.update(metadata)
+    
+    # 今回の保存内容をスナップショット化（変更のない月のパーティションは共有される）
+    try:
+        snapshot_id = write_snapshot(data_to_save, enhanced_metadata)
+        if snapshot_id:
+            enhanced_metadata['snapshot_id'] = snapshot_id
+    except Exception as e:
+        logger.warning(f"バックアップ作成エラー: {e}")
+    
+    _atomic_write_json(enhanced_metadata, METADATA_FILE)
+    
+    # マニフェストを作成（以降の表示・フィルター初期化はデータを走査しない）
+    try:
+        _write_manifest(_build_manifest(
+            df, target_data, get_saved_data_version(), enhanced_metadata.get('snapshot_id')
+        ))
+    except Exception as e:
+        logger.warning(f"マニフェスト作成エラー: {e}")
+    return enhanced_metadata
+
 def save_data_to_file(df, target_data=None, metadata=None):
-    """データをファイルに保存（強化版）"""
+    """データをファイルに保存（強化版・同期実行）"""
     try:
         if not ensure_data_directory():
             return False
         
-        # 既存データのバックアップ
-        create_backup()
-        
-        # メインデータの保存
-        data_to_save = {
-            'df': df,
-            'target_data': target_data,
-            'saved_at': datetime.now(),
-            'data_shape': df.shape if df is not None else None,
-            'version': '1.2',  # バージョンアップ
-            'data_source': st.session_state.get('data_source', 'unknown'),
-            'session_info': {
-                'filter_config': st.session_state.get('current_unified_filter_config', {}),
-                'performance_metrics': st.session_state.get('performance_metrics', {}),
-                'validation_results': st.session_state.get('validation_results', {})
-            }
-        }
+        with _save_write_lock:
+            _write_data_files(_build_save_job(df, target_data, metadata))
+        return True
         
-        with open(MAIN_DATA_FILE, 'wb') as f:
-            pickle.dump(data_to_save, f, protocol=pickle.HIGHEST_PROTOCOL)
-        
-        # メタデータの保存（強化版）
-        if metadata is None:
-            metadata = {}
-        
-        enhanced_metadata = {
-            'last_saved': datetime.now().isoformat(),
-            'data_rows': len(df) if df is not None else 0,
-            'data_columns': list(df.columns) if df is not None else [],
-            'file_size_mb': round(os.path.getsize(MAIN_DATA_FILE) / (1024 * 1024), 2),
-            'data_source': st.session_state.get('data_source', 'unknown'),
-            'app_version': '1.2',
-            'save_count': metadata.get('save_count', 0) + 1,
-            'date_range': {},
-            'statistics': {}
-        }
+    except Exception as e:
+        st.error(f"データ保存エラー: {e}")
+        return False
+
+# ===== バックグラウンド保存 =====
+# 保存要求はキュー（最新の1件のみ保持）に積まれ、書き込みスレッドが順に処理する。
+# 書き込み中に複数回保存が要求された場合は、最後の要求だけが書き込まれる。
+_save_write_lock = threading.Lock()
+_save_queue_condition = threading.Condition()
+_pending_save_job = None
+_save_writer_thread = None
+_save_status = {
+    'state': 'idle',  # idle / queued / saving / done / error
+    'queued_at': None,
+    'started_at': None,
+    'finished_at': None,
+    'duration_sec': None,
+    'data_rows': None,
+    'collapsed_count': 0,
+    'message': '',
+}
+
+def _update_save_status(**kwargs):
+    with _save_queue_condition:
+        _save_status.update(kwargs)
+
+def _save_writer_loop():
+    global _pending_save_job
+    while True:
+        with _save_queue_condition:
+            while _pending_save_job is None:
+                _save_queue_condition.wait()
+            job = _pending_save_job
+            _pending_save_job = None
+            _save_status.update({
+                'state': 'saving',
+                'started_at': datetime.now(),
+                'message': '',
+            })
         
-        # データ統計情報を追加
-        if df is not None and not df.empty:
-            if '日付' in df.columns:
-                try:
-                    enhanced_metadata['date_range'] = {
-                        'min_date': df['日付'].min().isoformat(),
-                        'max_date': df['日付'].max().isoformat(),
-                        'total_days': (df['日付'].max() - df['日付'].min()).days + 1,
-                        'unique_dates': df['日付'].nunique()
-                    }
-                except:
-                    pass
+        start_time = time.time()
+        try:
+            with _save_write_lock:
+                saved_metadata = _write_data_files(job)
+            with _save_queue_condition:
+                # 書き込み中に次の要求が来ていれば状態は queued のままにする
+                _save_status.update({
+                    'state': 'queued' if _pending_save_job is not None else 'done',
+                    'finished_at': datetime.now(),
+                    'duration_sec': time.time() - start_time,
+                    'data_rows': saved_metadata.get('data_rows'),
+                    'message': '保存完了',
+                })
+            logger.info(f"バックグラウンド保存完了: {saved_metadata.get('data_rows', 0):,}行, {time.time() - start_time:.2f}秒")
+        except Exception as e:
+            logger.error(f"バックグラウンド保存エラー: {e}", exc_info=True)
+            _update_save_status(
+                state='error',
+                finished_at=datetime.now(),
+                duration_sec=time.time() - start_time,
+                message=str(e),
+            )
+
+def queue_save_data(df, target_data=None, metadata=None):
+    """データ保存をバックグラウンドの書き込みスレッドに依頼して即座に戻る
+    
+    未処理の保存要求がある場合は新しい要求で置き換える。
+    保存状況は get_save_status() で確認できる。
+    """
+    global _pending_save_job, _save_writer_thread
+    try:
+        job = _build_save_job(df, target_data, metadata)
+        with _save_queue_condition:
+            if _pending_save_job is not None:
+                _save_status['collapsed_count'] += 1
+            else:
+                _save_status['collapsed_count'] = 0
+            _pending_save_job = job
+            _save_status.update({'state': 'queued', 'queued_at': job['queued_at'], 'message': ''})
             
-            # 基本統計
-            enhanced_metadata['statistics'] = {
-                'departments': df['診療科名'].nunique() if '診療科名' in df.columns else 0,
-                'wards': df['病棟コード'].nunique() if '病棟コード' in df.columns else 0,
-                'total_records': len(df),
-                'columns_count': len(df.columns)
-            }
-        
-        # 元のメタデータと結合
-        enhanced_metadata.update(metadata)
-        
-        with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(enhanced_metadata, f, ensure_ascii=False, indent=2, default=str)
-        
+            if _save_writer_thread is None or not _save_writer_thread.is_alive():
+                _save_writer_thread = threading.Thread(
+                    target=_save_writer_loop, name="data-save-writer", daemon=True
+                )
+                _save_writer_thread.start()
+            _save_queue_condition.notify()
         return True
-        
     except Exception as e:
         st.error(f"データ保存エラー: {e}")
         return False
 
+def get_save_status():
+    """バックグラウンド保存の状況を取得"""
+    with _save_queue_condition:
+        return dict(_save_status)
+
+def wait_for_pending_save(timeout=None):
+    """キュー中・書き込み中の保存が完了するまで待つ（完了したら True）"""
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+        status = get_save_status()
+        if status['state'] not in ('queued', 'saving'):
+            return True
+        if deadline is not None and time.time() >= deadline:
+            return False
+        time.sleep(0.05)
+
+# ===== プロセス共有データセット =====
+# 保存済みデータはプロセス内で1つだけ読み込み、全セッションで共有する（読み取り専用）。
+# 実体は Arrow IPC ファイル（shared_data_<バージョン>.arrow）をメモリマップしたもので、
+# 数値列・日付列はファイルのページを直接参照するため、利用者が増えてもコピーは増えない。
+# 各セッションには浅いコピー（列の追加・置き換えはセッション内に閉じる）を渡す。
+SHARED_DATA_PREFIX = "shared_data_"
+SHARED_ENVELOPE_KEY = b'dashboard_envelope'
+
+def get_saved_data_version():
+    """main_data.pkl の更新時刻とサイズから保存データのバージョン文字列を作成"""
+    try:
+        stat = os.stat(MAIN_DATA_FILE)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}_{stat.st_size}"
+
+def _shared_data_path(data_version):
+    return os.path.join(DATA_DIR, f"{SHARED_DATA_PREFIX}{data_version}.arrow")
+
+def _write_shared_dataset(saved_data, data_version):
+    """保存データをメモリマップ可能な Arrow IPC ファイルとして書き出す"""
+    import pyarrow as pa
+    
+    df = saved_data.get('df')
+    if df is None:
+        return None
+    envelope = {k: v for k, v in saved_data.items() if k != 'df'}
+    
+    table = pa.Table.from_pandas(df)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[SHARED_ENVELOPE_KEY] = pickle.dumps(envelope, protocol=pickle.HIGHEST_PROTOCOL)
+    table = table.replace_schema_metadata(schema_metadata)
+    
+    shared_path = _shared_data_path(data_version)
+    temp_path = f"{shared_path}.tmp"
+    with pa.OSFile(temp_path, 'wb') as sink:
+        # メモリマップで参照できるよう非圧縮で書き込む
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, shared_path)
+    
+    # 古いバージョンのファイルを削除（他プロセスがマップ中で削除できない場合は次回に持ち越し）
+    for filename in os.listdir(DATA_DIR):
+        if filename.startswith(SHARED_DATA_PREFIX) and filename != os.path.basename(shared_path):
+            try:
+                os.remove(os.path.join(DATA_DIR, filename))
+            except OSError:
+                pass
+    return shared_path
+
+def _read_shared_dataset(shared_path):
+    import pyarrow as pa
+    
+    source = pa.memory_map(shared_path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    envelope = pickle.loads(table.schema.metadata[SHARED_ENVELOPE_KEY])
+    # split_blocks=True で欠損のない数値・日付列はマップ済みバッファをそのまま参照する
+    df = table.to_pandas(split_blocks=True)
+    envelope['df'] = df
+    return envelope
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _load_shared_dataset(data_version):
+    """バージョンごとに1回だけ保存データを読み込む（全セッション共有）"""
+    shared_path = _shared_data_path(data_version)
+    saved_data = None
+    if os.path.exists(shared_path):
+        try:
+            saved_data = _read_shared_dataset(shared_path)
+        except Exception as e:
+            logger.warning(f"共有データファイルの読み込みに失敗しました: {e}")
+    
+    if saved_data is None:
+        # 共有ファイルがない（旧形式・復元直後など）場合は pickle から読み込んで作成
+        with open(MAIN_DATA_FILE, 'rb') as f:
+            saved_data = pickle.load(f)
+        try:
+            _write_shared_dataset(saved_data, data_version)
+            saved_data = _read_shared_dataset(shared_path)
+        except Exception as e:
+            # Arrow に変換できない列がある場合は pickle の内容をそのまま共有する
+            logger.warning(f"共有データファイルを作成できませんでした: {e}")
+    
+    # データの妥当性チェック
+    df = saved_data.get('df')
+    if df is not None and isinstance(df, pd.DataFrame):
+        # 日付列の型確認・修正
+        if '日付' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['日付']):
+            df['日付'] = pd.to_datetime(df['日付'])
+    
+    # string[pyarrow] モード（オプトイン）の場合はコード列の型を揃える
+    df, target_data = apply_arrow_string_mode(df, saved_data.get('target_data'))
+    saved_data['df'] = df
+    saved_data['target_data'] = target_data
+    saved_data['data_version'] = data_version
+    if df is not None:
+        # マニフェストと対応付けるためのバージョン（浅いコピーにも引き継がれる）
+        df.attrs['data_version'] = data_version
+    
+    # 復元・インポート直後などでマニフェストが古い場合は作り直す
+    if load_manifest() is None:
+        try:
+            _write_manifest(_build_manifest(df, target_data, data_version, (get_data_info() or {}).get('snapshot_id')))
+        except Exception as e:
+            logger.warning(f"マニフェスト作成エラー: {e}")
+    logger.info(f"共有データセットを読み込みました: version={data_version}, {len(df) if df is not None else 0:,}行")
+    return saved_data
+
+def get_shared_dataset():
+    """プロセス共有の保存データを取得（保存データがなければ None）
+    
+    返される辞書の 'df' / 'target_data' は全セッション共有の読み取り専用データ。
+    セッションで使う場合は load_data_from_file() が返す浅いコピーを使うこと。
+    """
+    data_version = get_saved_data_version()
+    if data_version is None:
+        return None
+    return _load_shared_dataset(data_version)
+
+# ===== マニフェスト =====
+# 保存時に、スキーマ・行数・日付範囲・病棟/診療科の一覧・パーティション構成・
+# ファイルサイズ・バックアップ一覧を manifest.json にまとめて書き出す。
+# サイドバーやフィルター初期化はこれを参照し、データ本体やディレクトリを走査しない。
+MANIFEST_FORMAT_VERSION = 1
+_manifest_cache = {'mtime_ns': None, 'manifest': None}
+
+def _sorted_unique_strings(series):
+    return sorted(str(v) for v in pd.unique(series.dropna()))
+
+def _build_manifest(df, target_data, data_version, snapshot_id=None):
+    """保存データからマニフェストを作成（保存時に1回だけデータを走査する）"""
+    date_range, statistics = _build_data_statistics(df)
+    manifest = {
+        'format_version': MANIFEST_FORMAT_VERSION,
+        'data_version': data_version,
+        'created_at': datetime.now().isoformat(),
+        'snapshot_id': snapshot_id,
+        'row_count': len(df) if df is not None else 0,
+        'column_count': len(df.columns) if df is not None else 0,
+        'schema': [{'name': str(col), 'dtype': str(dtype)} for col, dtype in df.dtypes.items()] if df is not None else [],
+        'date_range': date_range,
+        'statistics': statistics,
+        'wards': _sorted_unique_strings(df['病棟コード']) if df is not None and '病棟コード' in df.columns else [],
+        'departments': _sorted_unique_strings(df['診療科名']) if df is not None and '診療科名' in df.columns else [],
+        'target_rows': len(target_data) if target_data is not None else 0,
+        'partitions': [],
+        'file_sizes': {},
+        'backups': None,
+    }
+    if snapshot_id:
+        try:
+            snapshot_manifest = _read_snapshot_manifest(f"{SNAPSHOT_PREFIX}{snapshot_id}.json")
+            manifest['partitions'] = [
+                {'key': p['key'], 'rows': p['rows']} for p in snapshot_manifest.get('partitions', [])
+            ]
+        except Exception:
+            pass
+    return manifest
+
+def _read_manifest_file():
+    """manifest.json を読み込む（更新時刻が変わらない限りキャッシュを返す）"""
+    try:
+        mtime_ns = os.stat(MANIFEST_FILE).st_mtime_ns
+    except OSError:
+        return None
+    if _manifest_cache['mtime_ns'] != mtime_ns:
+        try:
+            with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+                _manifest_cache['manifest'] = json.load(f)
+            _manifest_cache['mtime_ns'] = mtime_ns
+        except Exception:
+            return None
+    return _manifest_cache['manifest']
+
+def _write_manifest(manifest):
+    """ファイルサイズ・バックアップ一覧を最新化してマニフェストを書き込む"""
+    manifest['backups'] = _scan_backup_info()
+    manifest['file_sizes'] = _collect_file_size_bytes()
+    _atomic_write_json(manifest, MANIFEST_FILE)
+    return manifest
+
+def refresh_manifest():
+    """データ以外の項目（ファイルサイズ・バックアップ一覧）だけを更新"""
+    manifest = _read_manifest_file()
+    if manifest is None:
+        return None
+    try:
+        return _write_manifest(dict(manifest))
+    except Exception as e:
+        logger.warning(f"マニフェスト更新エラー: {e}")
+        return None
+
+def load_manifest():
+    """現在の保存データに対応するマニフェストを取得（古い・存在しない場合は None）"""
+    manifest = _read_manifest_file()
+    if manifest is None or manifest.get('data_version') != get_saved_data_version():
+        return None
+    return manifest
+
+def get_manifest_for_df(df):
+    """df が保存データ（共有データセット）そのものであればマニフェストを返す"""
+    if df is None or not hasattr(df, 'attrs'):
+        return None
+    manifest = load_manifest()
+    if manifest is None:
+        return None
+    if df.attrs.get('data_version') != manifest.get('data_version') or len(df) != manifest.get('row_count'):
+        return None
+    return manifest
+
 def load_data_from_file():
-    """ファイルからデータを読み込み（強化版）"""
+    """ファイルからデータを読み込み（強化版・プロセス共有データを参照）"""
     try:
         if not os.path.exists(MAIN_DATA_FILE):
             return None, None, None
         
-        # メインデータの読み込み
-        with open(MAIN_DATA_FILE, 'rb') as f:
-            saved_data = pickle.load(f)
+        # メインデータの読み込み（同じバージョンはプロセス内で1回のみ）
+        saved_data = get_shared_dataset()
+        if saved_data is None:
+            return None, None, None
         
         # メタデータの読み込み
         metadata = None
@@ -173,12 +841,12 @@ def load_data_from_file():
             with open(METADATA_FILE, 'r', encoding='utf-8') as f:
                 metadata = json.load(f)
         
-        # データの妥当性チェック
+        # セッションには共有データの浅いコピーを渡す（列の追加・置き換えは他セッションに影響しない）
         df = saved_data.get('df')
-        if df is not None and isinstance(df, pd.DataFrame):
-            # 日付列の型確認・修正
-            if '日付' in df.columns:
-                df['日付'] = pd.to_datetime(df['日付'])
+        target_data = saved_data.get('target_data')
+        df = df.copy(deep=False) if df is not None else None
+        target_data = target_data.copy(deep=False) if target_data is not None else None
+        st.session_state['shared_data_version'] = saved_data.get('data_version')
         
         # セッション情報の復元（可能な場合）
         session_info = saved_data.get('session_info', {})
@@ -191,7 +859,7 @@ def load_data_from_file():
             if session_info.get('performance_metrics'):
                 st.session_state['performance_metrics'] = session_info['performance_metrics']
         
-        return df, saved_data.get('target_data'), metadata
+        return df, target_data, metadata
         
     except Exception as e:
         st.error(f"データ読み込みエラー: {e}")
@@ -212,6 +880,7 @@ def save_settings_to_file(settings):
         with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
             json.dump(settings_to_save, f, ensure_ascii=False, indent=2)
         
+        refresh_manifest()
         return True
         
     except Exception as e:
@@ -250,7 +919,7 @@ def get_data_info():
 def delete_saved_data():
     """保存されたデータを削除"""
     try:
-        files_to_delete = [MAIN_DATA_FILE, METADATA_FILE, SETTINGS_FILE]
+        files_to_delete = [MAIN_DATA_FILE, METADATA_FILE, SETTINGS_FILE, MANIFEST_FILE]
         deleted_files = []
         
         for file_path in files_to_delete:
@@ -258,6 +927,16 @@ def delete_saved_data():
                 os.remove(file_path)
                 deleted_files.append(os.path.basename(file_path))
         
+        # 共有データファイルも削除（他セッションがマップ中の場合は次回保存時に削除される）
+        if os.path.exists(DATA_DIR):
+            for filename in os.listdir(DATA_DIR):
+                if filename.startswith(SHARED_DATA_PREFIX):
+                    try:
+                        os.remove(os.path.join(DATA_DIR, filename))
+                        deleted_files.append(filename)
+                    except OSError:
+                        pass
+        
         # バックアップディレクトリも削除
         if os.path.exists(BACKUP_DIR):
             shutil.rmtree(BACKUP_DIR)
@@ -291,8 +970,12 @@ def auto_load_data():
             st.session_state['data_source'] = 'auto_loaded'
             st.session_state['data_metadata'] = metadata
             
-            # 最新データ日付の設定
-            if '日付' in df.columns and not df['日付'].empty:
+            # 最新データ日付の設定（マニフェストがあればデータを走査しない）
+            manifest = get_manifest_for_df(df)
+            if manifest and manifest.get('date_range', {}).get('max_date'):
+                latest_date = pd.Timestamp(manifest['date_range']['max_date'])
+                st.session_state.latest_data_date_str = latest_date.strftime('%Y年%m月%d日')
+            elif '日付' in df.columns and not df['日付'].empty:
                 latest_date = df['日付'].max()
                 st.session_state.latest_data_date_str = latest_date.strftime('%Y年%m月%d日')
             else:
@@ -307,102 +990,161 @@ def auto_load_data():
         st.error(f"自動データ読み込みエラー: {str(e)}")
         return False
 
+def _collect_file_size_bytes():
+    """保存ファイルのサイズ（バイト）を取得。未保存のファイルは None"""
+    size_bytes = {}
+    files = [
+        (MAIN_DATA_FILE, 'メインデータ'),
+        (METADATA_FILE, 'メタデータ'), 
+        (SETTINGS_FILE, '設定ファイル')
+    ]
+    for filepath, display_name in files:
+        size_bytes[display_name] = os.path.getsize(filepath) if os.path.exists(filepath) else None
+    
+    # バックアップフォルダのサイズも追加
+    if os.path.exists(BACKUP_DIR):
+        size_bytes['バックアップ'] = sum(
+            os.path.getsize(os.path.join(root, f))
+            for root, _, filenames in os.walk(BACKUP_DIR)
+            for f in filenames
+        )
+    return size_bytes
+
 def get_file_sizes():
-    """保存ファイルのサイズ情報を取得（強化版）"""
+    """保存ファイルのサイズ情報を取得（強化版・マニフェストがあればディスクを走査しない）"""
     try:
-        sizes = {}
-        files = [
-            ('main_data', MAIN_DATA_FILE, 'メインデータ'),
-            ('metadata', METADATA_FILE, 'メタデータ'), 
-            ('settings', SETTINGS_FILE, '設定ファイル')
-        ]
+        manifest = load_manifest()
+        if manifest and manifest.get('file_sizes'):
+            size_bytes = manifest['file_sizes']
+        else:
+            size_bytes = _collect_file_size_bytes()
         
+        sizes = {}
         total_size = 0
         
-        for name, filepath, display_name in files:
-            if os.path.exists(filepath):
-                size_bytes = os.path.getsize(filepath)
-                total_size += size_bytes
+        for display_name, file_size in size_bytes.items():
+            if display_name == 'バックアップ':
+                continue
+            if file_size is not None:
+                total_size += file_size
                 
-                if size_bytes < 1024:
-                    sizes[display_name] = f"{size_bytes} B"
-                elif size_bytes < 1024 * 1024:
-                    sizes[display_name] = f"{size_bytes / 1024:.1f} KB"
+                if file_size < 1024:
+                    sizes[display_name] = f"{file_size} B"
                 else:
-                    sizes[display_name] = f"{size_bytes / (1024 * 1024):.1f} MB"
+                    sizes[display_name] = _format_file_size(file_size)
             else:
                 sizes[display_name] = "未保存"
         
-        # バックアップフォルダのサイズも追加
-        if os.path.exists(BACKUP_DIR):
-            backup_size = sum(
-                os.path.getsize(os.path.join(BACKUP_DIR, f)) 
-                for f in os.listdir(BACKUP_DIR) 
-                if os.path.isfile(os.path.join(BACKUP_DIR, f))
-            )
+        backup_size = size_bytes.get('バックアップ') or 0
+        if backup_size > 0:
             total_size += backup_size
-            
-            if backup_size > 0:
-                if backup_size < 1024 * 1024:
-                    sizes['バックアップ'] = f"{backup_size / 1024:.1f} KB"
-                else:
-                    sizes['バックアップ'] = f"{backup_size / (1024 * 1024):.1f} MB"
+            sizes['バックアップ'] = _format_file_size(backup_size)
         
         # 合計サイズ
         if total_size > 0:
-            if total_size < 1024 * 1024:
-                sizes['合計'] = f"{total_size / 1024:.1f} KB"
-            else:
-                sizes['合計'] = f"{total_size / (1024 * 1024):.1f} MB"
+            sizes['合計'] = _format_file_size(total_size)
         
         return sizes
         
     except Exception:
         return {}
 
-def get_backup_info():
-    """バックアップファイルの情報を取得（強化版）"""
+def _scan_backup_info():
+    """バックアップディレクトリを走査してバックアップ情報を作成"""
     try:
         if not os.path.exists(BACKUP_DIR):
             return []
         
-        backup_files = [f for f in os.listdir(BACKUP_DIR) if f.startswith("main_data_backup_")]
         backup_info = []
+        current_snapshot = _get_current_snapshot_file()
+        
+        for snapshot_file in _list_snapshot_files():
+            try:
+                manifest = _read_snapshot_manifest(snapshot_file)
+                timestamp = _snapshot_timestamp(manifest['snapshot_id'])
+                # 参照しているオブジェクトの合計（他スナップショットと共有される分を含む）
+                object_names = {p['object'] for p in manifest.get('partitions', [])}
+                object_names.update(manifest[k] for k in ('row_order', 'target_data', 'envelope') if manifest.get(k))
+                file_size = sum(
+                    os.path.getsize(os.path.join(SNAPSHOT_OBJECTS_DIR, name))
+                    for name in object_names
+                    if os.path.exists(os.path.join(SNAPSHOT_OBJECTS_DIR, name))
+                )
+                backup_info.append({
+                    'filename': snapshot_file,
+                    'timestamp': timestamp.strftime("%Y/%m/%d %H:%M:%S"),
+                    'size': _format_file_size(file_size),
+                    'path': os.path.join(BACKUP_DIR, snapshot_file),
+                    'has_metadata': bool(manifest.get('metadata')),
+                    'age_days': (datetime.now() - timestamp).days,
+                    'partitions': len(manifest.get('partitions', [])),
+                    'is_current': snapshot_file == current_snapshot,
+                    '_sort_key': timestamp,
+                })
+            except Exception:
+                continue
         
-        for backup_file in sorted(backup_files, reverse=True):
+        # 旧形式（ファイルコピー）のバックアップ
+        backup_files = [f for f in os.listdir(BACKUP_DIR) if f.startswith(LEGACY_BACKUP_PREFIX)]
+        for backup_file in backup_files:
             file_path = os.path.join(BACKUP_DIR, backup_file)
-            timestamp_str = backup_file.replace("main_data_backup_", "").replace(".pkl", "")
+            timestamp_str = backup_file.replace(LEGACY_BACKUP_PREFIX, "").replace(".pkl", "")
             
             try:
                 timestamp = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
-                formatted_time = timestamp.strftime("%Y/%m/%d %H:%M:%S")
-                file_size = os.path.getsize(file_path)
-                
-                if file_size < 1024 * 1024:
-                    size_str = f"{file_size / 1024:.1f} KB"
-                else:
-                    size_str = f"{file_size / (1024 * 1024):.1f} MB"
                 
                 # 対応するメタデータファイルがあるかチェック
                 metadata_file = os.path.join(BACKUP_DIR, f"metadata_backup_{timestamp_str}.json")
-                has_metadata = os.path.exists(metadata_file)
                 
                 backup_info.append({
                     'filename': backup_file,
-                    'timestamp': formatted_time,
-                    'size': size_str,
+                    'timestamp': timestamp.strftime("%Y/%m/%d %H:%M:%S"),
+                    'size': _format_file_size(os.path.getsize(file_path)),
                     'path': file_path,
-                    'has_metadata': has_metadata,
-                    'age_days': (datetime.now() - timestamp).days
+                    'has_metadata': os.path.exists(metadata_file),
+                    'age_days': (datetime.now() - timestamp).days,
+                    'partitions': None,
+                    'is_current': False,
+                    '_sort_key': timestamp,
                 })
             except:
                 continue
         
-        return backup_info[:10]  # 最新10個まで
+        backup_info.sort(key=lambda b: b['_sort_key'], reverse=True)
+        for backup in backup_info:
+            del backup['_sort_key']
+        
+        return backup_info[:DATA_PERSISTENCE.get('max_backup_snapshots', 10)]
         
     except Exception:
         return []
 
+def get_backup_info():
+    """バックアップファイルの情報を取得（強化版・マニフェストがあればディレクトリを走査しない）"""
+    manifest = load_manifest()
+    if manifest is None or manifest.get('backups') is None:
+        return _scan_backup_info()
+    
+    backup_info = []
+    for backup in manifest['backups']:
+        backup = dict(backup)
+        try:
+            # 経過日数は表示時点で計算し直す
+            timestamp = datetime.strptime(backup['timestamp'], "%Y/%m/%d %H:%M:%S")
+            backup['age_days'] = (datetime.now() - timestamp).days
+        except (KeyError, ValueError):
+            pass
+        backup_info.append(backup)
+    return backup_info
+
+def _clear_data_session_state():
+    keys_to_clear = ['df', 'target_data', 'data_processed', 'data_source', 'data_metadata',
+                    'latest_data_date_str', 'current_unified_filter_config', 'performance_metrics',
+                    'validation_results', 'all_results']
+    for key in keys_to_clear:
+        if key in st.session_state:
+            del st.session_state[key]
+
 def restore_from_backup(backup_filename):
     """バックアップからデータを復元（強化版）"""
     try:
@@ -410,85 +1152,270 @@ def restore_from_backup(backup_filename):
         if not os.path.exists(backup_path):
             return False, "バックアップファイルが見つかりません"
         
-        # 現在のファイルをバックアップ
-        create_backup()
+        # 現在のデータがまだスナップショット化されていなければ取得しておく
+        _snapshot_current_file()
         
-        # バックアップファイルを復元
-        shutil.copy2(backup_path, MAIN_DATA_FILE)
-        
-        # 対応するメタデータファイルも復元
-        timestamp_str = backup_filename.replace("main_data_backup_", "").replace(".pkl", "")
-        metadata_backup_path = os.path.join(BACKUP_DIR, f"metadata_backup_{timestamp_str}.json")
+        if backup_filename.startswith(SNAPSHOT_PREFIX):
+            # スナップショットからメインデータとメタデータを再構築
+            saved_data, metadata = read_snapshot(backup_filename)
+            with _save_write_lock:
+                _atomic_write_pickle(saved_data, MAIN_DATA_FILE)
+                _atomic_write_json(metadata, METADATA_FILE)
+        else:
+            # 旧形式のバックアップファイルを復元
+            with _save_write_lock:
+                shutil.copy2(backup_path, f"{MAIN_DATA_FILE}.tmp")
+                os.replace(f"{MAIN_DATA_FILE}.tmp", MAIN_DATA_FILE)
+                
+                # 対応するメタデータファイルも復元
+                timestamp_str = backup_filename.replace(LEGACY_BACKUP_PREFIX, "").replace(".pkl", "")
+                metadata_backup_path = os.path.join(BACKUP_DIR, f"metadata_backup_{timestamp_str}.json")
+                
+                if os.path.exists(metadata_backup_path):
+                    shutil.copy2(metadata_backup_path, METADATA_FILE)
         
-        if os.path.exists(metadata_backup_path):
-            shutil.copy2(metadata_backup_path, METADATA_FILE)
+        # マニフェストは次回読み込み時に復元データから作り直す
+        if os.path.exists(MANIFEST_FILE):
+            os.remove(MANIFEST_FILE)
         
         # セッション状態をクリア
-        keys_to_clear = ['df', 'target_data', 'data_processed', 'data_source', 'data_metadata',
-                        'latest_data_date_str', 'current_unified_filter_config', 'performance_metrics',
-                        'validation_results', 'all_results']
-        for key in keys_to_clear:
-            if key in st.session_state:
-                del st.session_state[key]
+        _clear_data_session_state()
         
         return True, "復元完了"
         
     except Exception as e:
         return False, f"復元エラー: {e}"
 
-def export_data_package(export_path=None):
-    """データパッケージのエクスポート（他端末への移行用）"""
+# ===== データパッケージ（端末間移行用） =====
+# パッケージは ZIP で、現在のスナップショットを構成する月別 Parquet パーティション・
+# 目標値CSV・設定・マニフェストを含む。各エントリはチャンク単位でストリーム書き込み/読み込みし、
+# SHA-256 チェックサムで整合性を検証する（データ全体をメモリ上に組み立てない）。
+PACKAGE_FORMAT_VERSION = 2
+PACKAGE_MANIFEST_NAME = "package_manifest.json"
+PACKAGE_CHUNK_SIZE = 1024 * 1024
+
+def _copy_stream_with_checksum(source, destination, progress=None):
+    """source から destination へチャンク単位でコピーし、(sha256, バイト数) を返す"""
+    hasher = hashlib.sha256()
+    total_bytes = 0
+    while True:
+        chunk = source.read(PACKAGE_CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        destination.write(chunk)
+        total_bytes += len(chunk)
+        if progress is not None:
+            progress(len(chunk))
+    return hasher.hexdigest(), total_bytes
+
+def _report_progress(progress_callback, fraction, message):
+    if progress_callback is not None:
+        try:
+            progress_callback(min(max(fraction, 0.0), 1.0), message)
+        except Exception:
+            pass
+
+def export_data_package(export_path=None, progress_callback=None):
+    """データパッケージのエクスポート（他端末への移行用）
+    
+    Args:
+        export_path (str): 出力先ZIPファイルのパス（省略時は data_export_<日時>.zip）
+        progress_callback (callable): progress_callback(進捗率0～1, メッセージ) で進捗を通知
+    """
     try:
+        import zipfile
+        
         if export_path is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             export_path = f"data_export_{timestamp}.zip"
         
-        import zipfile
+        if not os.path.exists(MAIN_DATA_FILE):
+            return False, "エクスポートする保存データがありません"
+        
+        # 現在の保存データのスナップショット（なければ作成）がパッケージの中身になる
+        _report_progress(progress_callback, 0.0, "スナップショットを確認中...")
+        _snapshot_current_file()
+        snapshot_file = _get_current_snapshot_file()
+        if snapshot_file is None:
+            return False, "スナップショットを作成できませんでした"
+        snapshot_manifest = _read_snapshot_manifest(snapshot_file)
+        
+        object_names = [p['object'] for p in snapshot_manifest.get('partitions', [])]
+        object_names += [snapshot_manifest[k] for k in ('row_order', 'target_data', 'envelope') if snapshot_manifest.get(k)]
+        object_names = list(dict.fromkeys(object_names))
+        
+        partition_by_object = {p['object']: p for p in snapshot_manifest.get('partitions', [])}
+        total_bytes = sum(os.path.getsize(os.path.join(SNAPSHOT_OBJECTS_DIR, name)) for name in object_names) or 1
+        written_bytes = [0]
+        
+        def on_chunk(chunk_bytes):
+            written_bytes[0] += chunk_bytes
+            _report_progress(progress_callback, 0.9 * written_bytes[0] / total_bytes, "パーティションを書き込み中...")
         
+        entries = []
         with zipfile.ZipFile(export_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            files_to_export = [
-                (MAIN_DATA_FILE, "main_data.pkl"),
-                (METADATA_FILE, "metadata.json"),
-                (SETTINGS_FILE, "settings.json")
-            ]
+            # 月別パーティション等（Parquet は圧縮済みのため無圧縮で格納）
+            for object_name in object_names:
+                archive_name = f"objects/{object_name}"
+                compress_type = zipfile.ZIP_STORED if object_name.endswith(".parquet") else zipfile.ZIP_DEFLATED
+                zip_info = zipfile.ZipInfo(archive_name, date_time=datetime.now().timetuple()[:6])
+                zip_info.compress_type = compress_type
+                with open(os.path.join(SNAPSHOT_OBJECTS_DIR, object_name), 'rb') as source, \
+                        zipf.open(zip_info, 'w', force_zip64=True) as destination:
+                    checksum, size = _copy_stream_with_checksum(source, destination, on_chunk)
+                partition = partition_by_object.get(object_name)
+                entries.append({
+                    'name': archive_name,
+                    'sha256': checksum,
+                    'bytes': size,
+                    'partition': partition['key'] if partition else None,
+                    'rows': partition['rows'] if partition else None,
+                })
             
-            for source_path, archive_name in files_to_export:
+            # 目標値データ（CSV）・設定・メタデータ
+            _report_progress(progress_callback, 0.92, "目標値・設定を書き込み中...")
+            extra_files = []
+            if snapshot_manifest.get('target_data'):
+                target_data = _read_object(snapshot_manifest['target_data'])
+                if target_data is not None:
+                    extra_files.append(("target_data.csv", target_data.to_csv(index=False).encode('utf-8-sig')))
+            for source_path, archive_name in ((SETTINGS_FILE, "settings.json"), (METADATA_FILE, "metadata.json")):
                 if os.path.exists(source_path):
-                    zipf.write(source_path, archive_name)
+                    with open(source_path, 'rb') as f:
+                        extra_files.append((archive_name, f.read()))
+            data_manifest = load_manifest()
+            if data_manifest:
+                extra_files.append(("manifest.json", json.dumps(data_manifest, ensure_ascii=False, indent=2, default=str).encode('utf-8')))
+            extra_files.append(("snapshot.json", json.dumps(snapshot_manifest, ensure_ascii=False, indent=2, default=str).encode('utf-8')))
+            
+            for archive_name, payload in extra_files:
+                zipf.writestr(archive_name, payload)
+                entries.append({
+                    'name': archive_name,
+                    'sha256': hashlib.sha256(payload).hexdigest(),
+                    'bytes': len(payload),
+                    'partition': None,
+                    'rows': None,
+                })
             
-            # 最新のバックアップも含める
-            backup_info = get_backup_info()
-            if backup_info:
-                latest_backup = backup_info[0]
-                zipf.write(latest_backup['path'], f"backup_{latest_backup['filename']}")
+            # パッケージマニフェスト（最後に書き込み、読み込み時は最初に参照する）
+            package_manifest = {
+                'package_format': PACKAGE_FORMAT_VERSION,
+                'created_at': datetime.now().isoformat(),
+                'snapshot_id': snapshot_manifest['snapshot_id'],
+                'row_count': sum(p['rows'] for p in snapshot_manifest.get('partitions', [])),
+                'entries': entries,
+            }
+            zipf.writestr(PACKAGE_MANIFEST_NAME, json.dumps(package_manifest, ensure_ascii=False, indent=2))
         
+        _report_progress(progress_callback, 1.0, "エクスポート完了")
         return True, export_path
         
     except Exception as e:
         return False, str(e)
 
-def import_data_package(import_file):
-    """データパッケージのインポート"""
+def _import_legacy_package(zipf):
+    """旧形式（main_data.pkl を含むZIP）のインポート"""
+    # 現在のデータをバックアップ
+    create_backup(force_create=True)
+    zipf.extractall(DATA_DIR)
+
+def import_data_package(import_file, progress_callback=None):
+    """データパッケージのインポート
+    
+    Args:
+        import_file: ZIPファイルのパスまたはファイルオブジェクト
+        progress_callback (callable): progress_callback(進捗率0～1, メッセージ) で進捗を通知
+    """
     try:
         import zipfile
         
         if not ensure_data_directory():
             return False, "ディレクトリ作成失敗"
-        
-        # 現在のデータをバックアップ
-        create_backup(force_create=True)
+        os.makedirs(SNAPSHOT_OBJECTS_DIR, exist_ok=True)
         
         with zipfile.ZipFile(import_file, 'r') as zipf:
-            zipf.extractall(DATA_DIR)
+            archive_names = set(zipf.namelist())
+            if PACKAGE_MANIFEST_NAME not in archive_names:
+                _import_legacy_package(zipf)
+                restored_snapshot = None
+            else:
+                package_manifest = json.loads(zipf.read(PACKAGE_MANIFEST_NAME).decode('utf-8'))
+                if package_manifest.get('package_format', 0) > PACKAGE_FORMAT_VERSION:
+                    return False, "このバージョンでは読み込めないパッケージ形式です"
+                
+                entries = package_manifest.get('entries', [])
+                missing = [e['name'] for e in entries if e['name'] not in archive_names]
+                if missing:
+                    return False, f"パッケージが不完全です: {', '.join(missing[:3])}"
+                
+                total_bytes = sum(e['bytes'] for e in entries) or 1
+                read_bytes = [0]
+                
+                def on_chunk(chunk_bytes):
+                    read_bytes[0] += chunk_bytes
+                    _report_progress(progress_callback, 0.8 * read_bytes[0] / total_bytes, "パッケージを検証・展開中...")
+                
+                # オブジェクトの展開からスナップショットの登録までは保存処理と排他にする
+                # （登録前のオブジェクトを、バックグラウンド保存のスナップショット整理が未参照として削除しないように）
+                with _save_write_lock:
+                    # 各エントリをチャンク単位で検証しながら展開（不一致なら何も反映しない）
+                    staged_files = []
+                    extra_payloads = {}
+                    try:
+                        for entry in entries:
+                            if entry['name'].startswith("objects/"):
+                                object_name = os.path.basename(entry['name'])
+                                temp_path = os.path.join(SNAPSHOT_OBJECTS_DIR, f"{object_name}.import.tmp")
+                                with zipf.open(entry['name'], 'r') as source, open(temp_path, 'wb') as destination:
+                                    checksum, _ = _copy_stream_with_checksum(source, destination, on_chunk)
+                                staged_files.append((temp_path, os.path.join(SNAPSHOT_OBJECTS_DIR, object_name)))
+                            else:
+                                payload = zipf.read(entry['name'])
+                                checksum = hashlib.sha256(payload).hexdigest()
+                                on_chunk(len(payload))
+                                extra_payloads[entry['name']] = payload
+                            if checksum != entry['sha256']:
+                                raise ValueError(f"チェックサム不一致: {entry['name']}")
+                    except Exception:
+                        for temp_path, _ in staged_files:
+                            if os.path.exists(temp_path):
+                                os.remove(temp_path)
+                        raise
+                
+                    for temp_path, object_path in staged_files:
+                        os.replace(temp_path, object_path)
+                
+                    # スナップショットとして登録（新しいIDを付与して整理対象から外す）
+                    snapshot_manifest = json.loads(extra_payloads["snapshot.json"].decode('utf-8'))
+                    snapshot_manifest['imported_from'] = snapshot_manifest.get('snapshot_id')
+                    snapshot_manifest['snapshot_id'] = _new_snapshot_id()
+                    snapshot_manifest['created_at'] = datetime.now().isoformat()
+                    if not snapshot_manifest.get('target_data') and "target_data.csv" in extra_payloads:
+                        target_data = pd.read_csv(io.BytesIO(extra_payloads["target_data.csv"]), encoding='utf-8-sig')
+                        snapshot_manifest['target_data'] = _write_frame_object(target_data, include_index=True)
+                    restored_snapshot = _write_snapshot_manifest(snapshot_manifest)
+                
+                if "settings.json" in extra_payloads:
+                    with open(SETTINGS_FILE, 'wb') as f:
+                        f.write(extra_payloads["settings.json"])
+        
+        if restored_snapshot is not None:
+            # 現在のデータを退避したうえでスナップショットからメインデータを再構築
+            _report_progress(progress_callback, 0.85, "データを復元中...")
+            success, message = restore_from_backup(restored_snapshot)
+            if not success:
+                return False, message
+        else:
+            # マニフェストは次回読み込み時にインポートしたデータから作り直す
+            if os.path.exists(MANIFEST_FILE):
+                os.remove(MANIFEST_FILE)
         
         # セッション状態をクリア
-        keys_to_clear = ['df', 'target_data', 'data_processed', 'data_source', 'data_metadata',
-                        'latest_data_date_str', 'current_unified_filter_config', 'performance_metrics',
-                        'validation_results', 'all_results']
-        for key in keys_to_clear:
-            if key in st.session_state:
-                del st.session_state[key]
+        _clear_data_session_state()
         
+        _report_progress(progress_callback, 1.0, "インポート完了")
         return True, "インポート完了"
         
     except Exception as e:
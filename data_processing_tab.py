@@ -20,7 +20,7 @@ from integrated_preprocessing import (
 )
 from loader import load_files
 from forecast import generate_filtered_summaries
-from utils import initialize_all_mappings, create_dept_mapping_table
+from utils import initialize_all_mappings, create_dept_mapping_table, apply_arrow_string_mode
 
 EXCEL_USE_COLUMNS = [
     "病棟コード", "診療科名", "日付", "在院患者数",
@@ -51,6 +51,8 @@ def perform_cleanup(deep=False):
             st.session_state.filtered_results = None
         if 'forecast_model_results' in st.session_state:
             st.session_state.forecast_model_results = None
+        if 'forecast_model_intervals' in st.session_state:
+            st.session_state.forecast_model_intervals = None
     try:
         temp_dir_root = tempfile.gettempdir()
         app_temp_files_pattern = os.path.join(temp_dir_root, "integrated_dashboard_temp_*")
@@ -308,6 +310,7 @@ def process_data_with_progress(base_file_uploader_obj, new_files_uploader_list,
         progress_bar.progress(30, text="3. データの前処理中...")
         preprocess_start_time = time.time()
         df_final, validation_results = integrated_preprocess_data(df_processed_duplicates, target_data_df=target_data)
+        df_final, target_data = apply_arrow_string_mode(df_final, target_data)
         preprocess_end_time = time.time()
         st.session_state.performance_metrics['processing_time'] = preprocess_end_time - preprocess_start_time
         del df_processed_duplicates
@@ -550,6 +553,17 @@ def create_data_processing_tab():
                             except Exception:
                                 st.metric("メモリ情報", "取得エラー")
 
+                        stage_metrics_disp_dp_after = perf_metrics_disp_dp_after.get('preprocess_stages')
+                        if stage_metrics_disp_dp_after:
+                            st.caption("前処理ステージ別の処理時間・メモリ")
+                            stage_df_dp_after = pd.DataFrame(stage_metrics_disp_dp_after)[
+                                ['label', 'duration_sec', 'rows', 'memory_mb', 'memory_delta_mb']
+                            ].rename(columns={
+                                'label': 'ステージ', 'duration_sec': '処理時間(秒)', 'rows': '行数',
+                                'memory_mb': 'メモリ(MB)', 'memory_delta_mb': 'メモリ増減(MB)'
+                            })
+                            st.dataframe(stage_df_dp_after, use_container_width=True, hide_index=True)
+
                 validation_res_main_dp_after = st.session_state.get('validation_results')
                 if validation_res_main_dp_after:
                     if validation_res_main_dp_after.get("warnings") or validation_res_main_dp_after.get("info") or validation_res_main_dp_after.get("errors"):
@@ -7,6 +7,11 @@ from datetime import datetime, timedelta
 import calendar # create_dow_heatmap で使用されている場合は残す (前回提案では直接は使っていなかった)
 import locale
 import streamlit as st # streamlit の機能(st.warningなど)を使用しているためインポート
+import threading
+import weakref
+from collections import OrderedDict
+
+from row_selection import get_row_selection_index
 
 # 日本語の曜日名を使用するための設定
 try:
@@ -21,6 +26,151 @@ except locale.Error:
 DOW_LABELS = ['月曜日', '火曜日', '水曜日', '木曜日', '金曜日', '土曜日', '日曜日'] # app 2.py に合わせる
 DOW_ORDER_INT = list(range(7)) # 0:月曜, ..., 6:日曜
 
+# 曜日別集計で常に計算する患者数指標（チャート・サマリー・ヒートマップで共有）
+DOW_METRIC_COLUMNS = ['入院患者数', '緊急入院患者数', '総入院患者数', '退院患者数', '死亡患者数', '総退院患者数', '在院患者数']
+# 集計単位タイプ → 集計単位の列名（病院全体は None）
+DOW_UNIT_COLUMNS = {'病院全体': None, '病棟別': '病棟コード', '診療科別': '診療科名'}
+# 保持する曜日別集計テンソルの数（データ・期間・集計単位の組み合わせごと）
+DOW_TENSOR_CACHE_SIZE = 16
+
+_dow_tensor_cache = OrderedDict()
+_dow_tensor_cache_lock = threading.Lock()
+
+
+def _numeric_values(values):
+    """集計用に float64 へ変換（欠損値・数値化できない値は 0）"""
+    if not (np.issubdtype(values.dtype, np.number) or np.issubdtype(values.dtype, np.bool_)):
+        values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy()
+    return np.nan_to_num(values.astype(np.float64))
+
+
+def _build_dow_tensor(df, index, positions, group_by_column, target_items, metrics):
+    """選択行から 集計単位 × 曜日 × 指標 の合計と集計日数を計算する"""
+    if group_by_column is None:
+        unit_names = ['病院全体']
+        row_slots = np.zeros(len(positions), dtype=np.int64)
+    else:
+        codes, uniques = index.column_codes(group_by_column)
+        # 文字列表記で照合する（末尾はコード -1 = 欠損値用）
+        unique_labels = [str(value) for value in uniques] + ['nan']
+        period_codes = codes[positions]
+        if target_items:
+            labels = list(dict.fromkeys(str(item) for item in target_items))
+        else:
+            labels = list(dict.fromkeys(unique_labels[code] for code in pd.unique(period_codes)))
+        unit_names = sorted(labels)
+        slot_of_label = {label: slot for slot, label in enumerate(unit_names)}
+        code_slots = np.array([slot_of_label.get(label, -1) for label in unique_labels], dtype=np.int64)
+        row_slots = code_slots[period_codes]
+        in_units = row_slots >= 0
+        positions = positions[in_units]
+        row_slots = row_slots[in_units]
+
+    n_units = len(unit_names)
+    day_codes = index.day_codes[positions]
+    if len(day_codes) == 0:
+        first_day, n_days = 0, 1
+    else:
+        first_day = int(day_codes.min())
+        n_days = int(day_codes.max()) - first_day + 1
+    cell_keys = row_slots * n_days + (day_codes - first_day)
+    n_cells = n_units * n_days
+
+    # 日ごとの曜日（1970-01-01 は木曜日）の one-hot 行列で、日次合計を曜日別に集約する
+    day_weekdays = (first_day + np.arange(n_days) + 3) % 7
+    weekday_onehot = np.zeros((n_days, 7))
+    weekday_onehot[np.arange(n_days), day_weekdays] = 1.0
+
+    has_data = np.bincount(cell_keys, minlength=n_cells).reshape(n_units, n_days) > 0
+    day_counts = np.rint(has_data.astype(np.float64) @ weekday_onehot).astype(np.int64)
+
+    sums = np.zeros((n_units, 7, len(metrics)))
+    integer_metrics = set()
+    for m, column in enumerate(metrics):
+        values = df[column].to_numpy()
+        if np.issubdtype(values.dtype, np.integer) or np.issubdtype(values.dtype, np.bool_):
+            integer_metrics.add(column)
+        daily = np.bincount(cell_keys, weights=_numeric_values(values[positions]), minlength=n_cells)
+        sums[:, :, m] = daily.reshape(n_units, n_days) @ weekday_onehot
+
+    # データのない集計単位は除外する
+    present = day_counts.sum(axis=1) > 0
+    return {
+        'units': [name for name, keep in zip(unit_names, present) if keep],
+        'metrics': list(metrics),
+        'sums': sums[present],
+        'day_counts': day_counts[present],
+        'integer_metrics': integer_metrics,
+    }
+
+
+def get_dow_tensor(df, start_date, end_date, group_by_column=None, target_items=None, metrics=None):
+    """
+    曜日別集計テンソル（集計単位 × 曜日 × 指標）を取得する（データ・期間・集計単位ごとにキャッシュ）
+
+    DOW_METRIC_COLUMNS のうちデータにある列は指標の指定によらず常に計算するため、
+    指標の切り替えではキャッシュ済みのテンソルをそのまま使える。
+    データのキーは行選択インデックスの aggregate_key のため、同じフィルター条件で
+    抽出し直したデータフレームでも再実行のたびに作り直さない。
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        分析対象のデータフレーム（'日付' 列と集計単位の列が必要）
+    start_date, end_date : datetime.date or pd.Timestamp
+        集計期間（両端を含む）
+    group_by_column : str or None
+        集計単位の列名 ('病棟コード', '診療科名')。None の場合は病院全体。
+    target_items : list or None
+        集計対象の項目（None または空の場合は期間内の全項目）
+    metrics : list or None
+        追加で集計する患者数指標の列名
+
+    Returns:
+    --------
+    dict or None
+        'units'（集計単位名、昇順）, 'metrics'（指標名）,
+        'sums'（集計単位 × 曜日(月=0) × 指標 の合計、np.ndarray）,
+        'day_counts'（集計単位 × 曜日 のデータのある日数）, 'integer_metrics'（整数型の指標）。
+        期間内にデータがない場合は None。キャッシュを共有するため呼び出し側で変更しないこと。
+    """
+    all_metrics = [col for col in DOW_METRIC_COLUMNS if col in df.columns]
+    all_metrics += [col for col in (metrics or []) if col in df.columns and col not in all_metrics]
+
+    index = get_row_selection_index(df)
+    aggregate_key = index.aggregate_key()
+    cache_key = (
+        aggregate_key,
+        pd.Timestamp(start_date).value,
+        pd.Timestamp(end_date).value,
+        group_by_column,
+        tuple(dict.fromkeys(map(str, target_items))) if target_items else None,
+        tuple(all_metrics),
+    )
+    with _dow_tensor_cache_lock:
+        entry = _dow_tensor_cache.get(cache_key)
+        if entry is not None and (aggregate_key[0] == 'version' or entry['index_ref']() is index):
+            _dow_tensor_cache.move_to_end(cache_key)
+            return entry['tensor']
+
+    positions = index.select(start_date, end_date)
+    if len(positions) == 0:
+        return None
+    tensor = _build_dow_tensor(df, index, positions, group_by_column, target_items, all_metrics)
+
+    with _dow_tensor_cache_lock:
+        _dow_tensor_cache[cache_key] = {'index_ref': weakref.ref(index), 'tensor': tensor}
+        _dow_tensor_cache.move_to_end(cache_key)
+        while len(_dow_tensor_cache) > DOW_TENSOR_CACHE_SIZE:
+            _dow_tensor_cache.popitem(last=False)
+    return tensor
+
+
+def _dow_categorical(weekday_codes):
+    """曜日番号（月=0）の配列から順序付きの曜日名カテゴリを作成"""
+    return pd.Categorical.from_codes(weekday_codes, categories=DOW_LABELS, ordered=True)
+
+
 def get_dow_data(df, unit_type, target_items, start_date, end_date, metric_type='average', patient_cols_to_analyze=None):
     """
     曜日別の入退院データを集計する関数
@@ -63,87 +213,45 @@ def get_dow_data(df, unit_type, target_items, start_date, end_date, metric_type=
         st.error(f"get_dow_data: 必要な患者数カラムが不足しています: {', '.join(missing_patient_cols)}")
         return None
 
-    df_period_filtered = df[
-        (df['日付'] >= pd.to_datetime(start_date)) &
-        (df['日付'] <= pd.to_datetime(end_date))
-    ].copy()
-
-    if df_period_filtered.empty:
-        st.info("get_dow_data: 選択された期間にデータがありません。")
-        return None
-
-    # 日付型に変換 (念のため)
-    df_period_filtered['日付'] = pd.to_datetime(df_period_filtered['日付'])
-
-    # 1. 日次単位での集計単位ごとの合計 (app 2.py の df_daily_unit_sum に相当)
-    daily_unit_sum_list = []
-    
-    group_by_for_daily_sum = ['日付']
-    unit_col_name = None
-
-    if unit_type == '病院全体':
-        # 日付ごとに各指標を合計
-        daily_sum_temp = df_period_filtered.groupby('日付', as_index=False)[patient_cols_to_analyze].sum()
-        daily_sum_temp['集計単位名'] = '病院全体'
-        daily_unit_sum_list.append(daily_sum_temp)
-    elif unit_type == '病棟別':
-        unit_col_name = '病棟コード'
-        group_by_for_daily_sum.append(unit_col_name)
-        items_to_process = target_items if target_items else df_period_filtered[unit_col_name].unique()
-        for item in items_to_process:
-            item_df = df_period_filtered[df_period_filtered[unit_col_name].astype(str) == str(item)]
-            if not item_df.empty:
-                daily_sum_temp = item_df.groupby('日付', as_index=False)[patient_cols_to_analyze].sum()
-                daily_sum_temp['集計単位名'] = str(item)
-                daily_unit_sum_list.append(daily_sum_temp)
-    elif unit_type == '診療科別':
-        unit_col_name = '診療科名'
-        group_by_for_daily_sum.append(unit_col_name)
-        items_to_process = target_items if target_items else df_period_filtered[unit_col_name].unique()
-        for item in items_to_process:
-            item_df = df_period_filtered[df_period_filtered[unit_col_name].astype(str) == str(item)]
-            if not item_df.empty:
-                daily_sum_temp = item_df.groupby('日付', as_index=False)[patient_cols_to_analyze].sum()
-                daily_sum_temp['集計単位名'] = str(item)
-                daily_unit_sum_list.append(daily_sum_temp)
-    else:
+    if unit_type not in DOW_UNIT_COLUMNS:
         st.error(f"get_dow_data: 未知の集計単位タイプです: {unit_type}")
         return None
 
-    if not daily_unit_sum_list:
-        st.info("get_dow_data: 日次集計データが作成できませんでした。")
+    tensor = get_dow_tensor(
+        df, start_date, end_date,
+        group_by_column=DOW_UNIT_COLUMNS[unit_type],
+        target_items=target_items,
+        metrics=patient_cols_to_analyze
+    )
+    if tensor is None:
+        st.info("get_dow_data: 選択された期間にデータがありません。")
         return None
-        
-    df_to_process_dow = pd.concat(daily_unit_sum_list, ignore_index=True)
-
-    # 2. 曜日情報の付与 (app 2.py と同様)
-    df_to_process_dow['曜日番号'] = df_to_process_dow['日付'].dt.weekday # Monday=0, Sunday=6
-    df_to_process_dow['曜日'] = df_to_process_dow['曜日番号'].apply(lambda x: DOW_LABELS[x])
-    df_to_process_dow['曜日'] = pd.Categorical(df_to_process_dow['曜日'], categories=DOW_LABELS, ordered=True)
-
-    # 3. 最終的な曜日別集計 (app 2.py と同様)
-    aggregation_func = 'mean' if metric_type == 'average' else 'sum'
-    
-    # 集計対象の列でグループ化して集計
-    agg_dict_for_final_dow = {col: aggregation_func for col in patient_cols_to_analyze}
-    
-    final_dow_df_intermediate = df_to_process_dow.groupby(
-        ['集計単位名', '曜日'], # '曜日番号' も含めてソート後、'曜日名' を使う
-        observed=False # categories を尊重
-    ).agg(agg_dict_for_final_dow).reset_index()
-
-    if final_dow_df_intermediate.empty:
-        st.info("get_dow_data: 最終的な曜日別集計結果が空です。")
+    if not tensor['units']:
+        st.info("get_dow_data: 日次集計データが作成できませんでした。")
         return None
 
-    # データをグラフ表示しやすいようにmelt (縦持ち変換)
-    final_dow_df_melted = final_dow_df_intermediate.melt(
-        id_vars=['集計単位名', '曜日'],
-        value_vars=patient_cols_to_analyze, # patient_cols_to_analyze にある列のみをmelt
-        var_name='指標タイプ',
-        value_name='患者数'
+    # テンソルから 集計単位 × 曜日 × 指標 の値を取り出す（平均は データのある日数 で割る）
+    metric_positions = [tensor['metrics'].index(col) for col in patient_cols_to_analyze]
+    values = tensor['sums'][:, :, metric_positions]
+    if metric_type == 'average':
+        day_counts = tensor['day_counts'][:, :, np.newaxis]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = np.where(day_counts > 0, values / day_counts, np.nan)
+    elif all(col in tensor['integer_metrics'] for col in patient_cols_to_analyze):
+        values = np.rint(values).astype(np.int64)
+
+    # 縦持ち（集計単位 → 曜日 → 指標 の順）に並べる
+    n_units, n_metrics = len(tensor['units']), len(patient_cols_to_analyze)
+    unit_idx, weekday_idx, metric_idx = np.meshgrid(
+        np.arange(n_units), np.arange(7), np.arange(n_metrics), indexing='ij'
     )
-    final_dow_df_melted.sort_values(by=['集計単位名', '曜日'], inplace=True) # 曜日カテゴリでソートされるはず
+    unit_idx, weekday_idx, metric_idx = unit_idx.ravel(), weekday_idx.ravel(), metric_idx.ravel()
+    final_dow_df_melted = pd.DataFrame({
+        '集計単位名': np.array(tensor['units'], dtype=object)[unit_idx],
+        '曜日': _dow_categorical(weekday_idx),
+        '指標タイプ': np.array(patient_cols_to_analyze, dtype=object)[metric_idx],
+        '患者数': values.ravel(),
+    }, index=metric_idx * n_units * 7 + unit_idx * 7 + weekday_idx)
 
     return final_dow_df_melted
 
@@ -265,17 +373,6 @@ def calculate_dow_summary(df: pd.DataFrame, start_date: datetime, end_date: date
         st.warning("calculate_dow_summary: 入力データフレームが空です。")
         return None
 
-    df_period_filtered = df[
-        (df['日付'] >= pd.to_datetime(start_date)) &
-        (df['日付'] <= pd.to_datetime(end_date))
-    ].copy()
-
-    if df_period_filtered.empty:
-        st.info("calculate_dow_summary: 選択された期間にデータがありません。")
-        return None
-    
-    df_period_filtered['日付'] = pd.to_datetime(df_period_filtered['日付'])
-
     # 集計対象とする患者数指標の列
     # 注意:「在院患者数」はスナップショットのため、日次で単純合計するのは通常不適切。
     #       曜日別の平均在院者数などを出したい場合は、元データの持ち方や集計方法の再検討が必要。
@@ -284,97 +381,92 @@ def calculate_dow_summary(df: pd.DataFrame, start_date: datetime, end_date: date
                       '退院患者数', '死亡患者数', '総退院患者数', '在院患者数']  # '在院患者数'を追加]
     
     # dfに存在する列のみを対象とする
-    actual_sum_cols_daily = [col for col in sum_cols_daily if col in df_period_filtered.columns]
+    actual_sum_cols_daily = [col for col in sum_cols_daily if col in df.columns]
     if not actual_sum_cols_daily:
         st.error("calculate_dow_summary: 集計対象の患者数カラムが見つかりません。")
         return None
 
-    # 1. 日次レベルでの集計 (選択された集計単位ごと)
-    daily_aggregated_list = []
-    
-    if group_by_column is None: # 病院全体
-        daily_temp_df = df_period_filtered.groupby('日付', as_index=False)[actual_sum_cols_daily].sum()
-        daily_temp_df['集計単位'] = '病院全体'
-        daily_aggregated_list.append(daily_temp_df)
-    elif group_by_column in ['病棟コード', '診療科名']:
-        items_to_process_daily = target_items if target_items else df_period_filtered[group_by_column].unique()
-        for item in items_to_process_daily:
-            item_daily_df = df_period_filtered[df_period_filtered[group_by_column].astype(str) == str(item)]
-            if not item_daily_df.empty:
-                summed_item_daily_df = item_daily_df.groupby('日付', as_index=False)[actual_sum_cols_daily].sum()
-                summed_item_daily_df['集計単位'] = str(item)
-                daily_aggregated_list.append(summed_item_daily_df)
-    else:
+    if group_by_column not in (None, '病棟コード', '診療科名'):
         st.error(f"calculate_dow_summary: 未知のgroup_by_columnです: {group_by_column}")
         return None
 
-    if not daily_aggregated_list:
+    tensor = get_dow_tensor(df, start_date, end_date, group_by_column=group_by_column, target_items=target_items)
+    if tensor is None:
+        st.info("calculate_dow_summary: 選択された期間にデータがありません。")
+        return None
+    if not tensor['units']:
         st.info("calculate_dow_summary: 日次集計データが作成できませんでした。")
         return None
-        
-    daily_aggregated_df = pd.concat(daily_aggregated_list, ignore_index=True)
 
-    # 2. 曜日情報の付与
-    daily_aggregated_df['曜日番号'] = daily_aggregated_df['日付'].dt.weekday # Monday=0, Sunday=6
-    daily_aggregated_df['曜日名'] = daily_aggregated_df['曜日番号'].apply(lambda x: DOW_LABELS[x])
-    
-    # 3. 曜日別の最終集計
-    # 各曜日が何回出現したか（集計日数）も計算
-    # 指標ごとの合計値と、各曜日が期間内に何日あったかを計算
-    
-    final_group_by_cols = ['集計単位', '曜日番号', '曜日名']
-    
-    # 各指標の合計値を計算
-    agg_funcs_for_sum = {col: 'sum' for col in actual_sum_cols_daily}
-    # 各曜日が何日あったかをカウント
-    agg_funcs_for_sum['日付'] = 'count' # その曜日の日数をカウントするため
-
-    summary_sum_df = daily_aggregated_df.groupby(final_group_by_cols, as_index=False, observed=False).agg(agg_funcs_for_sum)
-    summary_sum_df.rename(columns={'日付': '集計日数'}, inplace=True)
+    # データのある (集計単位, 曜日) の組のみを行にする
+    day_counts = tensor['day_counts']
+    unit_idx, weekday_idx = np.nonzero(day_counts > 0)
+    row_day_counts = day_counts[unit_idx, weekday_idx]
+
+    summary = {
+        '集計単位': np.array(tensor['units'], dtype=object)[unit_idx],
+        '曜日番号': weekday_idx.astype(np.int32),
+        '曜日名': _dow_categorical(weekday_idx),
+    }
+    row_sums = {}
+    for col in actual_sum_cols_daily:
+        sums = tensor['sums'][unit_idx, weekday_idx, tensor['metrics'].index(col)]
+        row_sums[col] = sums
+        summary[f"{col}合計"] = np.rint(sums).astype(np.int64) if col in tensor['integer_metrics'] else sums
+    summary['集計日数'] = row_day_counts
 
-    # 各指標の平均値/日を計算 (合計値 / 集計日数)
-    summary_avg_df = summary_sum_df.copy()
+    # 各指標の平均値/日（合計値 / 集計日数）
     for col in actual_sum_cols_daily:
-        avg_col_name = f"平均{col}"
-        sum_col_name = col # summary_sum_dfでは合計値が元の列名で入っている
-        summary_avg_df[avg_col_name] = summary_avg_df.apply(
-            lambda row: row[sum_col_name] / row['集計日数'] if row['集計日数'] > 0 else 0, axis=1
-        )
+        summary[f"平均{col}"] = row_sums[col] / row_day_counts
 
     # 率の計算 (緊急入院率、死亡退院率など) - 合計ベースで計算
-    if '総入院患者数' in summary_avg_df.columns and '緊急入院患者数' in summary_avg_df.columns:
-        summary_avg_df['緊急入院率'] = summary_avg_df.apply(
-            lambda row: (row['緊急入院患者数'] / row['総入院患者数'] * 100) if row['総入院患者数'] > 0 else 0, axis=1
-        )
-    else:
-        summary_avg_df['緊急入院率'] = np.nan
+    def rate(numerator_col, denominator_col):
+        if numerator_col not in row_sums or denominator_col not in row_sums:
+            return np.full(len(unit_idx), np.nan)
+        denominator = row_sums[denominator_col]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(denominator > 0, row_sums[numerator_col] / denominator * 100, 0.0)
 
-    if '総退院患者数' in summary_avg_df.columns and '死亡患者数' in summary_avg_df.columns:
-        summary_avg_df['死亡退院率'] = summary_avg_df.apply(
-            lambda row: (row['死亡患者数'] / row['総退院患者数'] * 100) if row['総退院患者数'] > 0 else 0, axis=1
-        )
-    else:
-        summary_avg_df['死亡退院率'] = np.nan
+    summary['緊急入院率'] = rate('緊急入院患者数', '総入院患者数')
+    summary['死亡退院率'] = rate('死亡患者数', '総退院患者数')
 
-    # 列名を調整 (app 2.py の run_dow_trend_analysis 関数の最終的なmelt前のカラム名に近い形にする)
-    # ここでは、合計値と平均値の両方を持つDataFrameを返すようにする
     # 表示側 (dow_analysis_tab.py) で、ユーザーが選択した metric_type ('average' or 'sum') に応じて
-    # 表示する列を選択する形が良いでしょう。
-    
-    # 合計値のカラム名を変更 (例: "総入院患者数" -> "総入院患者数合計")
-    rename_map_sum = {col: f"{col}合計" for col in actual_sum_cols_daily}
-    summary_avg_df.rename(columns=rename_map_sum, inplace=True)
-    
-    # 曜日の順序でソート
-    summary_avg_df['曜日名'] = pd.Categorical(summary_avg_df['曜日名'], categories=DOW_LABELS, ordered=True)
-    final_summary_df = summary_avg_df.sort_values(['集計単位', '曜日番号'])
-
-    # 不要な曜日番号列を削除しても良い
-    # final_summary_df = final_summary_df.drop(columns=['曜日番号'])
+    # 合計値（"{指標}合計"）と平均値（"平均{指標}"）のどちらを表示するか選択する。
+    # 行は 集計単位 → 曜日番号 の順に並んでいる
+    final_summary_df = pd.DataFrame(summary)
     
     return final_summary_df
 
 
+def _dow_pivot(dow_data, value_col):
+    """
+    曜日別サマリーを 曜日 × 集計単位 の表に並べ替える（同じ組が複数ある場合は先頭の値）
+
+    曜日は '曜日番号' 列（なければ '曜日名'）で DOW_LABELS の順に並べ、
+    値がすべて欠損の集計単位は除外する。
+    """
+    if '曜日番号' in dow_data.columns:
+        weekday_codes = dow_data['曜日番号'].to_numpy(dtype=np.int64)
+    else:
+        weekday_codes = pd.Categorical(dow_data['曜日名'], categories=DOW_LABELS).codes.astype(np.int64)
+    unit_codes, units = pd.factorize(dow_data['集計単位'], sort=True)
+    values = pd.to_numeric(dow_data[value_col], errors='coerce').to_numpy(dtype=np.float64)
+
+    valid = (weekday_codes >= 0) & (unit_codes >= 0)
+    cell_keys = (weekday_codes * len(units) + unit_codes)[valid]
+    _, first_rows = np.unique(cell_keys, return_index=True)
+    matrix = np.full(7 * len(units), np.nan)
+    matrix[cell_keys[first_rows]] = values[valid][first_rows]
+    matrix = matrix.reshape(7, len(units))
+
+    keep_units = ~np.isnan(matrix).all(axis=0)
+    return pd.DataFrame(
+        matrix[:, keep_units],
+        index=pd.Index(DOW_LABELS, name='曜日名'),
+        columns=pd.Index(units[keep_units], name='集計単位')
+    )
+
+
 def create_dow_heatmap(dow_data: pd.DataFrame, metric: str = '入院患者数', unit_type: str = '病院全体'):
     """
     曜日別のヒートマップまたはバーチャートを作成する関数。
@@ -455,21 +547,9 @@ def create_dow_heatmap(dow_data: pd.DataFrame, metric: str = '入院患者数',
                 print(f"create_dow_heatmap: '集計単位' 列がデータにありません (unit_type: {unit_type})。")
                 return None
             
-            # ピボットテーブルを作成 (曜日を行、集計単位を列、値を患者数)
+            # ピボット (曜日を行、集計単位を列、値を患者数)
             try:
-                # '曜日名' をカテゴリカル型にして順序を保証
-                dow_data_copy = dow_data.copy() # 元のDFを変更しないようにコピー
-                dow_data_copy['曜日名'] = pd.Categorical(dow_data_copy['曜日名'], categories=DOW_LABELS, ordered=True)
-                
-                pivot_data = dow_data_copy.pivot_table(
-                    index='曜日名',
-                    columns='集計単位',
-                    values=value_col_to_use,
-                    aggfunc='first' # 既に集計済みなので 'first' または 'mean'
-                )
-                # pivot_table の結果、インデックスの順序が保たれない場合があるので、DOW_LABELSで再インデックス
-                pivot_data = pivot_data.reindex(DOW_LABELS)
-
+                pivot_data = _dow_pivot(dow_data, value_col_to_use)
             except KeyError as e: # ピボットに必要な列がない場合
                 print(f"create_dow_heatmap: ピボット操作に必要な列がありません ({e})。")
                 return None
@@ -1,5 +1,4 @@
 import pandas as pd
-import jpholiday # jpholiday.is_holiday のために必要
 import streamlit as st
 from datetime import datetime, timedelta # datetime.now(), timedelta のために必要
 import numpy as np # pd.isna での NaN チェックは pandas に含まれますが、numpy も関連ライブラリとして記載
@@ -13,46 +12,141 @@ import numpy as np # pd.isna での NaN チェックは pandas に含まれま
 #     return (end_date - start_date).days + 1
 from datetime import datetime, timedelta # timedelta も使用されているため
 
+from config import FORECAST_SETTINGS
+from period_calendar import build_forecast_horizon, get_fiscal_year_start, holiday_flags
+from row_selection import NS_PER_DAY, get_row_selection_index
+
+# 月末予測の対象指標
+MONTHLY_COMPLETION_METRICS = ['在院患者数', '入院患者数', '退院患者数', '緊急入院患者数']
+
+
+def build_monthly_completion(df, end_date, unit_column=None, metrics=None, lookback_days=None):
+    """
+    月末までの予測（全集計単位をまとめて配列で計算する）
+
+    直近 lookback_days 日の 集計単位 × 日 の合計から、集計単位ごとの平日・休日の
+    日平均を求め、基準日の翌日から月末までの各日に休日カレンダーに従って割り当てる。
+    平日（休日）のデータがない集計単位は、全日の日平均で代用する。
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        前処理済みデータ
+    end_date : pd.Timestamp
+        基準日（実績の最終日）
+    unit_column : str or None
+        集計単位の列（'病棟コード'・'診療科名' など）。None の場合は病院全体
+    metrics : list or None
+        予測する指標の列（省略時は MONTHLY_COMPLETION_METRICS のうち存在する列）
+    lookback_days : int or None
+        日平均を求める直近の日数（省略時は FORECAST_SETTINGS['monthly_completion_lookback_days']）
+
+    Returns:
+    --------
+    dict or None
+        units（集計単位）, metrics（指標）, dates（予測日）, is_holiday（予測日の休日フラグ）,
+        weekday_rates, holiday_rates（集計単位 × 指標 の日平均）,
+        actual（月初から基準日までの実績合計, 集計単位 × 指標）,
+        projected（集計単位 × 予測日 × 指標）, month_total（月末までの実績＋予測, 集計単位 × 指標）,
+        elapsed_days, remaining_days。データがない場合は None
+    """
+    if df is None or df.empty or '日付' not in df.columns:
+        return None
+    if metrics is None:
+        metrics = MONTHLY_COMPLETION_METRICS
+    metrics = [metric for metric in metrics if metric in df.columns]
+    if not metrics:
+        return None
+    if lookback_days is None:
+        lookback_days = FORECAST_SETTINGS.get('monthly_completion_lookback_days', 28)
+
+    end_date = pd.Timestamp(end_date).normalize()
+    month_start = end_date.replace(day=1)
+    month_end = month_start + pd.offsets.MonthEnd(0)
+    first_date = min(month_start, end_date - pd.Timedelta(days=lookback_days - 1))
+
+    index = get_row_selection_index(df)
+    positions = index.select(start_date=first_date, end_date=end_date + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns'))
+    if unit_column is None:
+        units = ['全体']
+        row_units = np.zeros(len(positions), dtype=np.int64)
+    else:
+        codes, uniques = index.column_codes(unit_column)
+        row_codes = codes[positions]
+        positions = positions[row_codes >= 0]
+        used_codes, row_units = np.unique(row_codes[row_codes >= 0], return_inverse=True)
+        order = np.argsort(np.array([str(value) for value in uniques[used_codes]], dtype=object), kind='stable')
+        row_units = np.argsort(order)[row_units]
+        units = list(uniques[used_codes[order]])
+    if len(positions) == 0:
+        return None
+
+    # 集計単位 × 日 × 指標 の合計（1回のbincount）
+    n_units = len(units)
+    n_days = (end_date - first_date).days + 1
+    day_offsets = index.day_codes[positions] - first_date.value // NS_PER_DAY
+    cell_keys = row_units * n_days + day_offsets
+    n_cells = n_units * n_days
+    daily = np.empty((n_units, n_days, len(metrics)))
+    for m, metric in enumerate(metrics):
+        values = df[metric].to_numpy()[positions]
+        if not (np.issubdtype(values.dtype, np.number) or np.issubdtype(values.dtype, np.bool_)):
+            values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy()
+        weights = np.nan_to_num(values.astype(np.float64))
+        daily[:, :, m] = np.bincount(cell_keys, weights=weights, minlength=n_cells).reshape(n_units, n_days)
+    has_data = np.bincount(cell_keys, minlength=n_cells).reshape(n_units, n_days) > 0
+
+    # 直近期間の平日・休日別の日平均
+    day_holidays = holiday_flags(pd.date_range(first_date, end_date, freq='D'))
+    in_lookback = np.arange(n_days) >= n_days - lookback_days
+
+    def daily_rate(day_selection):
+        selected = has_data & day_selection[None, :]
+        counts = selected.sum(axis=1)
+        sums = (daily * selected[:, :, None]).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts[:, None] > 0, sums / counts[:, None], np.nan)
+
+    all_rates = np.nan_to_num(daily_rate(in_lookback))
+    weekday_rates = daily_rate(in_lookback & ~day_holidays)
+    holiday_rates = daily_rate(in_lookback & day_holidays)
+    weekday_rates = np.where(np.isnan(weekday_rates), all_rates, weekday_rates)
+    holiday_rates = np.where(np.isnan(holiday_rates), all_rates, holiday_rates)
+
+    # 月末までの予測（休日カレンダーで平日・休日の日平均を割り当てる）
+    forecast_dates = pd.date_range(end_date + pd.Timedelta(days=1), month_end, freq='D')
+    forecast_holidays = holiday_flags(forecast_dates)
+    projected = np.where(forecast_holidays[None, :, None], holiday_rates[:, None, :], weekday_rates[:, None, :])
+    actual = daily[:, (month_start - first_date).days:, :].sum(axis=1)
+
+    return {
+        'units': units,
+        'metrics': metrics,
+        'dates': forecast_dates,
+        'is_holiday': forecast_holidays,
+        'weekday_rates': weekday_rates,
+        'holiday_rates': holiday_rates,
+        'actual': actual,
+        'projected': projected,
+        'month_total': actual + projected.sum(axis=1),
+        'elapsed_days': (end_date - month_start).days + 1,
+        'remaining_days': len(forecast_dates),
+    }
+
+
 def predict_monthly_completion(df_actual, period_dates):
-    """月末までの予測（簡易版）"""
+    """月末までの予測（病院全体の日別予測行、build_monthly_completion の結果から作成）"""
     try:
-        # 現在の日数と月の総日数
-        days_elapsed = (period_dates['end_date'] - period_dates['start_date']).days + 1
-        days_in_month = pd.Timestamp(period_dates['end_date'].year, period_dates['end_date'].month, 1).days_in_month
-        remaining_days = days_in_month - days_elapsed
-        
-        if remaining_days <= 0:
-            return pd.DataFrame()  # 既に月末
-        
-        # 直近7日間の平均を使用して予測
-        recent_data = df_actual.tail(7)
-        daily_averages = recent_data.groupby('日付')[['在院患者数', '入院患者数', '退院患者数', '緊急入院患者数']].sum().mean()
-        
-        # 残り日数分の予測データを生成
-        predicted_dates = pd.date_range(
-            start=period_dates['end_date'] + pd.Timedelta(days=1),
-            periods=remaining_days,
-            freq='D'
-        )
-        
-        predicted_data = []
-        for date in predicted_dates:
-            # 曜日効果を考慮（簡易版）
-            day_of_week = date.dayofweek
-            weekend_factor = 0.7 if day_of_week >= 5 else 1.0  # 土日は70%
-            
-            predicted_data.append({
-                '日付': date,
-                '在院患者数': daily_averages['在院患者数'] * weekend_factor,
-                '入院患者数': daily_averages['入院患者数'] * weekend_factor,
-                '退院患者数': daily_averages['退院患者数'] * weekend_factor,
-                '緊急入院患者数': daily_averages['緊急入院患者数'] * weekend_factor,
-                '病棟コード': '予測',
-                '診療科名': '予測'
-            })
-        
-        return pd.DataFrame(predicted_data)
-        
+        completion = build_monthly_completion(df_actual, period_dates['end_date'])
+        if completion is None or completion['remaining_days'] <= 0:
+            return pd.DataFrame()  # 既に月末、またはデータなし
+
+        predicted = pd.DataFrame(completion['projected'][0], columns=completion['metrics'])
+        predicted.insert(0, '日付', completion['dates'])
+        predicted['病棟コード'] = '予測'
+        predicted['診療科名'] = '予測'
+        return predicted
+
     except Exception as e:
         print(f"予測データ生成エラー: {e}")
         return pd.DataFrame()
@@ -108,15 +202,8 @@ def generate_filtered_summaries(df, filter_type=None, filter_value=None):
             
         # '平日判定'列の存在確認と追加
         if '平日判定' not in filtered_df.columns:
-            # integrated_preprocessing.py の add_weekday_flag と同様のロジック
-            def is_holiday(date_val):
-                return (
-                    date_val.weekday() >= 5 or
-                    jpholiday.is_holiday(date_val) or
-                    (date_val.month == 12 and date_val.day >= 29) or
-                    (date_val.month == 1 and date_val.day <= 3)
-                )
-            filtered_df['平日判定'] = filtered_df['日付'].apply(lambda x: "休日" if is_holiday(x) else "平日")
+            # integrated_preprocessing.py の add_weekday_flag と同様の判定（ベクトル化したカレンダー）
+            filtered_df['平日判定'] = np.where(holiday_flags(filtered_df['日付']), "休日", "平日")
 
 
         # 日付単位で合算
@@ -210,42 +297,34 @@ def generate_filtered_summaries(df, filter_type=None, filter_value=None):
             ]
             add_summary(label, period_data)
 
-        # 年度期間の設定
-        fy2024_start = pd.Timestamp("2024-04-01")
-        fy2024_end = pd.Timestamp("2025-03-31")
+        # 年度期間の設定（最新データ日付の属する年度と前年度）
+        current_fy_start = get_fiscal_year_start(latest_data_date)
+        current_fy = current_fy_start.year
+        prev_fy = current_fy - 1
+        prev_fy_start = current_fy_start - pd.DateOffset(years=1)
+        prev_fy_end = current_fy_start - pd.Timedelta(days=1)
         # grouped データの日付範囲でフィルタリング
-        fy2024_data = grouped[
-            (grouped["日付"] >= fy2024_start) &
-            (grouped["日付"] <= fy2024_end)
+        prev_fy_data = grouped[
+            (grouped["日付"] >= prev_fy_start) &
+            (grouped["日付"] <= prev_fy_end)
         ]
-        add_summary("2024年度平均", fy2024_data)
-
-        # 2024年度（同期間）の計算
-        # NameError修正: latest_date -> latest_data_date
-        if latest_data_date >= pd.Timestamp("2025-04-01"):
-            # NameError修正: latest_date -> latest_data_date
-            days_elapsed = (latest_data_date - pd.Timestamp("2025-04-01")).days
-            same_period_end_2024 = fy2024_start + pd.Timedelta(days=days_elapsed)
-            
-            if same_period_end_2024 >= fy2024_start:
-                fy2024_same_period = grouped[
-                    (grouped["日付"] >= fy2024_start) &
-                    (grouped["日付"] <= same_period_end_2024)
-                ]
-                add_summary("2024年度（同期間）", fy2024_same_period)
-            else:
-                add_summary("2024年度（同期間）", pd.DataFrame(columns=grouped.columns)) # 空のデータフレームを渡す
-        else:
-            add_summary("2024年度（同期間）", pd.DataFrame(columns=grouped.columns)) # 空のデータフレームを渡す
+        add_summary(f"{prev_fy}年度平均", prev_fy_data)
+
+        # 前年度（同期間）の計算
+        days_elapsed = (latest_data_date - current_fy_start).days
+        same_period_end_prev = prev_fy_start + pd.Timedelta(days=days_elapsed)
+        fy_prev_same_period = grouped[
+            (grouped["日付"] >= prev_fy_start) &
+            (grouped["日付"] <= same_period_end_prev)
+        ]
+        add_summary(f"{prev_fy}年度（同期間）", fy_prev_same_period)
 
-        # 2025年度平均
-        fy2025_start = pd.Timestamp("2025-04-01")
-        # NameError修正: latest_date -> latest_data_date
-        fy2025_data = grouped[
-            (grouped["日付"] >= fy2025_start) &
+        # 今年度平均
+        current_fy_data = grouped[
+            (grouped["日付"] >= current_fy_start) &
             (grouped["日付"] <= latest_data_date)
         ]
-        add_summary("2025年度平均", fy2025_data)
+        add_summary(f"{current_fy}年度平均", current_fy_data)
 
         # 表示順序
         display_order = [
@@ -253,9 +332,9 @@ def generate_filtered_summaries(df, filter_type=None, filter_value=None):
             "直近14日平均",
             "直近30日平均",
             "直近60日平均",
-            "2024年度平均",
-            "2024年度（同期間）",
-            "2025年度平均"
+            f"{prev_fy}年度平均",
+            f"{prev_fy}年度（同期間）",
+            f"{current_fy}年度平均"
         ]
 
         # DataFrameを作成
@@ -341,58 +420,27 @@ def create_forecast_dataframe(df_summary, df_weekday, df_holiday, today):
         # 基準日をPandas Timestampに変換
         today_ts = pd.Timestamp(today_obj).normalize()
 
-        # 2025年度末までの日付範囲を生成
-        end_fy2025 = pd.Timestamp("2026-03-31")
+        # 基準日の属する年度の予測期間（翌日 ～ 年度末、平日・休日の日数を含む）
+        horizon = build_forecast_horizon(today_ts)
+        fiscal_year = horizon['fiscal_year']
+        current_fy_label = f"{fiscal_year}年度平均"
 
-        if today_ts >= end_fy2025:
-            st.info("予測対象期間（2025年度末まで）が終了しています。")
+        if horizon['remaining_days'] <= 0:
+            st.info(f"予測対象期間（{fiscal_year}年度末まで）の残りがありません。")
             return pd.DataFrame()
 
-        # 残りの日数を計算
-        # 予測開始日は基準日の翌日
-        forecast_start_date = today_ts + pd.Timedelta(days=1)
-        if forecast_start_date > end_fy2025:
-            st.info("予測対象期間の残りがありません（基準日が年度末以降）。")
-            return pd.DataFrame()
-            
-        remain_dates = pd.date_range(start=forecast_start_date, end=end_fy2025)
-        if remain_dates.empty: # 通常は上のチェックでカバーされるが一応残す
-            st.info("予測対象期間の残りがありません。")
-            return pd.DataFrame()
+        num_weekdays = horizon['remaining_weekdays']
+        num_holidays = horizon['remaining_holidays']
 
-        remain_df = pd.DataFrame({"日付": remain_dates})
-
-        # 平日/休日の判定
-        def is_holiday_for_forecast(date_val):
-            return (
-                date_val.weekday() >= 5 or  # 土曜日または日曜日
-                jpholiday.is_holiday(date_val) or
-                (date_val.month == 12 and date_val.day >= 29) or  # 年末
-                (date_val.month == 1 and date_val.day <= 3)  # 年始
-            )
-        
-        remain_df["平日判定"] = remain_df["日付"].apply(
-            lambda x: "休日" if is_holiday_for_forecast(x) else "平日"
-        )
-
-        num_weekdays = (remain_df["平日判定"] == "平日").sum()
-        num_holidays = len(remain_df) - num_weekdays
-
-        # 2025年度の経過日数を計算 (基準日 today_ts まで)
-        fy2025_start_ts = pd.Timestamp("2025-04-01")
-        elapsed_days_fy2025 = 0
-        if today_ts >= fy2025_start_ts:
-            elapsed_days_fy2025 = (today_ts - fy2025_start_ts).days + 1
-        
-        # 年度の総日数
-        # この関数が同じファイル内またはインポートされていることを確認
-        total_days_in_fy2025 = calculate_fiscal_year_days(2025) 
+        # 今年度の経過日数 (基準日 today_ts まで) と年度の総日数
+        elapsed_days_fy = horizon['elapsed_days']
+        total_days_in_fy = horizon['total_days']
 
         forecast_rows = []
         
         # 予測に使用する基準期間を選択（直近期間と年度平均）
         relevant_labels = [
-            "直近7日平均", "直近14日平均", "直近30日平均", "直近60日平均", "2025年度平均"
+            "直近7日平均", "直近14日平均", "直近30日平均", "直近60日平均", current_fy_label
         ]
         
         for label in relevant_labels:
@@ -401,7 +449,7 @@ def create_forecast_dataframe(df_summary, df_weekday, df_holiday, today):
                 continue
             
             # df_summary は実績計算で使用
-            if label == "2025年度平均" and (df_summary is None or label not in df_summary.index):
+            if label == current_fy_label and (df_summary is None or label not in df_summary.index):
                  st.warning(f"基準期間 '{label}' のデータが全日集計にありません（実績計算用）。スキップします。")
                  continue
                 
@@ -424,32 +472,32 @@ def create_forecast_dataframe(df_summary, df_weekday, df_holiday, today):
                 # 将来の予測延べ患者数
                 future_total = weekday_avg * num_weekdays + holiday_avg * num_holidays
 
-                # 実績の計算（2025年度平均を使用）
+                # 実績の計算（今年度平均を使用）
                 actual_total = 0
-                if label == "2025年度平均": # 2025年度平均の場合のみ実績を加味する（他のラベルは将来の平均値としての予測）
-                    if df_summary is not None and "2025年度平均" in df_summary.index and \
-                       "入院患者数（在院）" in df_summary.loc["2025年度平均"] and \
-                       not pd.isna(df_summary.loc["2025年度平均"]["入院患者数（在院）"]):
+                if label == current_fy_label: # 今年度平均の場合のみ実績を加味する（他のラベルは将来の平均値としての予測）
+                    if df_summary is not None and current_fy_label in df_summary.index and \
+                       "入院患者数（在院）" in df_summary.loc[current_fy_label] and \
+                       not pd.isna(df_summary.loc[current_fy_label]["入院患者数（在院）"]):
                         
-                        actual_avg_2025 = df_summary.loc["2025年度平均"]["入院患者数（在院）"]
-                        actual_total = actual_avg_2025 * elapsed_days_fy2025
+                        actual_avg_current = df_summary.loc[current_fy_label]["入院患者数（在院）"]
+                        actual_total = actual_avg_current * elapsed_days_fy
                     else:
-                        st.warning("2025年度平均の実績値が取得できないため、実績加算は0とします。")
+                        st.warning(f"{current_fy_label}の実績値が取得できないため、実績加算は0とします。")
 
                 # 年間平均人日
-                # 「2025年度平均」ラベルの場合のみ実績を含めて計算
+                # 今年度平均ラベルの場合のみ実績を含めて計算
                 # それ以外のラベルは、その平均が将来も続いた場合の純粋な予測を示す
-                if label == "2025年度平均":
+                if label == current_fy_label:
                     total_for_avg = actual_total + future_total
                 else:
                     # 他ラベルでは、その平均値が通年続いた場合の仮想的な年度平均
                     # もし「実績＋予測」という列名が誤解を招くなら、列名変更か計算方法の再考が必要
-                    # ここでは、提供されたロジックに基づき、実績は2025年度平均の場合のみ加味
-                    total_for_avg = (weekday_avg * (total_days_in_fy2025 * (num_weekdays / (num_weekdays + num_holidays + 1e-6)))) + \
-                                  (holiday_avg * (total_days_in_fy2025 * (num_holidays / (num_weekdays + num_holidays + 1e-6))))
+                    # ここでは、提供されたロジックに基づき、実績は今年度平均の場合のみ加味
+                    total_for_avg = (weekday_avg * (total_days_in_fy * (num_weekdays / (num_weekdays + num_holidays + 1e-6)))) + \
+                                  (holiday_avg * (total_days_in_fy * (num_holidays / (num_weekdays + num_holidays + 1e-6))))
 
 
-                forecast_avg_per_day = total_for_avg / total_days_in_fy2025 if total_days_in_fy2025 > 0 else 0
+                forecast_avg_per_day = total_for_avg / total_days_in_fy if total_days_in_fy > 0 else 0
 
                 forecast_rows.append({
                     "基準期間": label,
@@ -475,8 +523,8 @@ def create_forecast_dataframe(df_summary, df_weekday, df_holiday, today):
         forecast_df = pd.DataFrame(forecast_rows)
         
         if not forecast_df.empty:
-            # 2024年度関連を除外 (もし '2024年度平均' などがあれば)
-            forecast_df = forecast_df[~forecast_df["基準期間"].str.contains("2024年度", na=False)]
+            # 前年度関連を除外 (もし前年度平均などがあれば)
+            forecast_df = forecast_df[~forecast_df["基準期間"].str.contains(f"{fiscal_year - 1}年度", na=False)]
             
             if not forecast_df.empty:
                 forecast_df = forecast_df.set_index("基準期間")
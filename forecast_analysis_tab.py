@@ -11,6 +11,9 @@ try:
         simple_moving_average_forecast,
         holt_winters_forecast,
         arima_forecast,
+        seasonal_naive_forecast,
+        weighted_moving_average_forecast,
+        yoy_scaled_forecast,
         prepare_daily_total_patients,
         generate_annual_forecast_summary,
     )
@@ -20,14 +23,19 @@ except ImportError as e:
     simple_moving_average_forecast = None
     holt_winters_forecast = None
     arima_forecast = None
+    seasonal_naive_forecast = None
+    weighted_moving_average_forecast = None
+    yoy_scaled_forecast = None
     generate_annual_forecast_summary = None
 
 # グラフ作成関数をインポート（dashboard_charts.py から）
 try:
     from dashboard_charts import create_monthly_trend_chart
+    from chart_cache import compact_figure
     # 予測比較チャート用の関数を作成
-    def create_forecast_comparison_chart(actual_series, forecast_dict, title="予測比較", display_days_past=180, display_days_future=365):
-        """予測比較チャートを作成"""
+    def create_forecast_comparison_chart(actual_series, forecast_dict, title="予測比較", display_days_past=180, display_days_future=365,
+                                         forecast_intervals=None):
+        """予測比較チャートを作成（forecast_intervals があればモデルごとの予測区間を帯で表示）"""
         import plotly.graph_objects as go
         from plotly.subplots import make_subplots
         
@@ -55,7 +63,7 @@ try:
         )
         
         # 各予測モデルをプロット
-        colors = ['#ff9800', '#4caf50', '#f44336', '#9c27b0']
+        colors = ['#ff9800', '#4caf50', '#f44336', '#9c27b0', '#795548', '#00bcd4', '#607d8b']
         for i, (model_name, forecast_series) in enumerate(forecast_dict.items()):
             if forecast_series is not None and not forecast_series.empty:
                 # 予測データの表示範囲を制限
@@ -64,6 +72,24 @@ try:
                     forecast_display = forecast_series[forecast_series.index <= end_date]
                 else:
                     forecast_display = forecast_series
+                
+                # 予測区間（予測時に求めた下限・上限をそのまま帯にする）
+                interval = (forecast_intervals or {}).get(model_name)
+                if interval is not None and interval.get('lower') is not None:
+                    lower = interval['lower'].reindex(forecast_display.index)
+                    upper = interval['upper'].reindex(forecast_display.index)
+                    fig.add_trace(
+                        go.Scatter(
+                            x=list(forecast_display.index) + list(forecast_display.index[::-1]),
+                            y=list(upper.round(1)) + list(lower.round(1)[::-1]),
+                            fill='toself',
+                            fillcolor=colors[i % len(colors)],
+                            opacity=0.2,
+                            line=dict(width=0),
+                            hoverinfo='skip',
+                            name=f'{model_name} {interval["level"]:.0%}予測区間'
+                        )
+                    )
                     
                 fig.add_trace(
                     go.Scatter(
@@ -85,7 +111,8 @@ try:
             height=500
         )
         
-        return fig
+        # 長期間の表示では実績・予測の線を間引いて送る
+        return compact_figure(fig)
         
 except ImportError as e:
     st.error(f"グラフ作成に必要なモジュールのインポートに失敗しました: {e}")
@@ -144,6 +171,9 @@ def display_forecast_analysis_tab():
         if simple_moving_average_forecast: model_options.append("単純移動平均")
         if holt_winters_forecast: model_options.append("Holt-Winters")
         if arima_forecast: model_options.append("ARIMA")
+        if seasonal_naive_forecast: model_options.append("季節ナイーブ（曜日・祝日）")
+        if weighted_moving_average_forecast: model_options.append("加重移動平均（曜日係数）")
+        if yoy_scaled_forecast: model_options.append("前年同期比")
         
         if not model_options:
             st.error("利用可能な予測モデルがありません。forecast_models.py を確認してください。")
@@ -157,6 +187,7 @@ def display_forecast_analysis_tab():
 
     with st.expander("モデルパラメータ詳細設定（上級者向け）", expanded=False):
         sma_window = st.slider("単純移動平均: ウィンドウサイズ（日数）", 3, 30, 7, key="pred_sma_window")
+        wma_window = st.slider("加重移動平均（曜日係数）: ウィンドウサイズ（日数）", 7, 84, 28, key="pred_wma_window")
         hw_seasonal_periods = st.slider("Holt-Winters: 季節周期（日数）", 7, 365, 7, key="pred_hw_seasonal_periods", help="週周期なら7、年周期なら365など。")
         arima_m = st.slider("ARIMA: 季節周期 (m)", 7, 52, 7, key="pred_arima_m", help="週周期の季節性(m=7)を考慮します。")
 
@@ -176,6 +207,7 @@ def display_forecast_analysis_tab():
                     st.error("予測用の日次患者数データを作成できませんでした。元データを確認してください。")
                 else:
                     forecast_model_results_dict = {} 
+                    forecast_model_intervals_dict = {}
                     forecast_annual_summary_list = []
 
                     forecast_horizon_end_date = pd.Timestamp(f"{predict_fiscal_year + 1}-03-31")
@@ -197,13 +229,25 @@ def display_forecast_analysis_tab():
                             progress_bar.progress((idx) / len(selected_models))
                             
                             pred_series = None
+                            forecast_result = None
                             try:
                                 if model_name == "単純移動平均" and simple_moving_average_forecast:
-                                    pred_series = simple_moving_average_forecast(daily_total_patients, window=sma_window, forecast_horizon=horizon_days)
+                                    forecast_result = simple_moving_average_forecast(daily_total_patients, window=sma_window, forecast_horizon=horizon_days, return_interval=True)
                                 elif model_name == "Holt-Winters" and holt_winters_forecast:
-                                    pred_series = holt_winters_forecast(daily_total_patients, seasonal_periods=hw_seasonal_periods, forecast_horizon=horizon_days)
+                                    forecast_result = holt_winters_forecast(daily_total_patients, seasonal_periods=hw_seasonal_periods, forecast_horizon=horizon_days, series_key="病院全体", return_interval=True)
                                 elif model_name == "ARIMA" and arima_forecast:
-                                    pred_series = arima_forecast(daily_total_patients, forecast_horizon=horizon_days, m=arima_m)
+                                    forecast_result = arima_forecast(daily_total_patients, forecast_horizon=horizon_days, m=arima_m, series_key="病院全体", return_interval=True)
+                                elif model_name == "季節ナイーブ（曜日・祝日）" and seasonal_naive_forecast:
+                                    forecast_result = seasonal_naive_forecast(daily_total_patients, forecast_horizon=horizon_days, return_interval=True)
+                                elif model_name == "加重移動平均（曜日係数）" and weighted_moving_average_forecast:
+                                    forecast_result = weighted_moving_average_forecast(daily_total_patients, window=wma_window, forecast_horizon=horizon_days, return_interval=True)
+                                elif model_name == "前年同期比" and yoy_scaled_forecast:
+                                    forecast_result = yoy_scaled_forecast(daily_total_patients, forecast_horizon=horizon_days, return_interval=True)
+                                
+                                if forecast_result is not None:
+                                    pred_series = forecast_result['forecast']
+                                    if forecast_result['lower'] is not None:
+                                        forecast_model_intervals_dict[model_name] = forecast_result
                                 
                                 if pred_series is not None and not pred_series.empty:
                                     forecast_model_results_dict[model_name] = pred_series
@@ -233,6 +277,7 @@ def display_forecast_analysis_tab():
                         
                         # セッションステートに結果を保存
                         st.session_state.forecast_model_results = forecast_model_results_dict
+                        st.session_state.forecast_model_intervals = forecast_model_intervals_dict
                         if forecast_annual_summary_list:
                             st.session_state.forecast_annual_summary_df = pd.DataFrame(forecast_annual_summary_list).set_index("モデル名")
                         else:
@@ -275,7 +320,8 @@ def display_forecast_analysis_tab():
                 st.session_state.forecast_model_results,
                 title=f"{predict_fiscal_year}年度 全日入院患者数予測比較",
                 display_days_past=display_past_days_chart,
-                display_days_future=display_future_days_chart 
+                display_days_future=display_future_days_chart,
+                forecast_intervals=st.session_state.get('forecast_model_intervals')
             )
             if forecast_comparison_fig:
                 st.plotly_chart(forecast_comparison_fig, use_container_width=True)
@@ -0,0 +1,214 @@
+# forecast_backtest.py - 予測モデルのローリング起点バックテスト
+"""
+過去の複数の時点（予測起点）で、その時点までのデータだけを使って予測モデルを学習し、
+その後の実績と比べて予測精度（MAE・MAPE）と学習時間を測る。
+
+予測起点 × モデル × 集計単位 の組み合わせをプロセスプールで並列に実行し、
+結果を モデル・予測日数・集計単位・予測起点 ごとの1行の表にまとめる。
+モデルストアは使わない（過去の起点で学習したパラメータを保存しない）。
+"""
+import logging
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import EXCLUDED_WARDS, FORECAST_SETTINGS
+from forecast_runner import (
+    FORECAST_MODEL_FUNCTIONS, FORECAST_RESULT_FUNCTIONS, build_unit_daily_matrix, get_runner_worker_count,
+)
+
+logger = logging.getLogger(__name__)
+
+BACKTEST_RESULT_COLUMNS = ["モデル", "集計単位", "予測起点", "予測日数", "MAE", "MAPE", "学習時間（秒）", "学習日数"]
+
+
+def default_cutoffs(last_date, max_horizon, n_cutoffs=None, step_days=None):
+    """
+    最新日から遡った予測起点（最も長い予測日数の実績が揃う日まで、古い順）
+
+    Returns:
+    --------
+    list of pd.Timestamp
+    """
+    if n_cutoffs is None:
+        n_cutoffs = FORECAST_SETTINGS.get('backtest_n_cutoffs', 4)
+    if step_days is None:
+        step_days = FORECAST_SETTINGS.get('backtest_cutoff_step_days', 28)
+    latest_cutoff = pd.Timestamp(last_date) - pd.Timedelta(days=max_horizon)
+    return [latest_cutoff - pd.Timedelta(days=step_days * i) for i in range(n_cutoffs - 1, -1, -1)]
+
+
+def forecast_errors(actual, predicted, horizons):
+    """
+    予測日数ごとの MAE・MAPE（%）
+
+    MAPE は実績が0の日を除いて計算する（全日0なら NaN）。
+
+    Returns:
+    --------
+    dict
+        予測日数 → (MAE, MAPE)
+    """
+    actual = np.asarray(actual, dtype=np.float64)
+    predicted = np.asarray(predicted, dtype=np.float64)
+    errors = {}
+    for horizon in horizons:
+        absolute_errors = np.abs(actual[:horizon] - predicted[:horizon])
+        nonzero = actual[:horizon] != 0
+        mape = float(np.mean(absolute_errors[nonzero] / np.abs(actual[:horizon][nonzero])) * 100) if nonzero.any() else np.nan
+        errors[horizon] = (float(np.mean(absolute_errors)), mape)
+    return errors
+
+
+def _backtest_worker(task):
+    """
+    ワーカー: 1つの 予測起点 × モデル × 集計単位 を学習・予測して誤差を測る
+
+    Returns:
+    --------
+    list of dict
+        予測日数ごとの結果の行（失敗時・単純予測に切り替わった場合は空）
+    """
+    label, model_name, model_kwargs, unit, cutoff, train_start, train_values, actual_values, horizons = task
+    series = pd.Series(train_values, index=pd.date_range(train_start, periods=len(train_values), freq='D'))
+    try:
+        started = time.perf_counter()
+        if model_name in FORECAST_RESULT_FUNCTIONS:
+            result = FORECAST_RESULT_FUNCTIONS[model_name](series, forecast_horizon=max(horizons), **model_kwargs)
+            predicted = result['forecast']
+        else:
+            result = None
+            predicted = FORECAST_MODEL_FUNCTIONS[model_name](series, forecast_horizon=max(horizons), **model_kwargs)
+        fit_seconds = time.perf_counter() - started
+    except Exception as e:
+        logger.warning(f"バックテストでエラーが発生しました ({label}, {unit}, {cutoff.date()}): {e}")
+        return []
+    if result is not None and result['fallback']:
+        # モデルの学習に失敗して単純予測に切り替わった結果は、そのモデルの精度として記録しない
+        logger.warning(f"バックテストでモデルを学習できず、評価から除外しました ({label}, {unit}, {cutoff.date()})")
+        return []
+    if predicted is None or len(predicted) < max(horizons):
+        return []
+
+    return [
+        {
+            "モデル": label,
+            "集計単位": unit,
+            "予測起点": cutoff,
+            "予測日数": horizon,
+            "MAE": mae,
+            "MAPE": mape,
+            "学習時間（秒）": fit_seconds,
+            "学習日数": len(series),
+        }
+        for horizon, (mae, mape) in forecast_errors(actual_values, predicted.to_numpy(), horizons).items()
+    ]
+
+
+def run_backtest(df, unit_column=None, model_specs=None, horizons=None, cutoffs=None,
+                 max_workers=None, progress_callback=None):
+    """
+    ローリング起点バックテストを実行する
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        前処理済みデータ
+    unit_column : str or None
+        集計単位の列（'診療科名'・'病棟コード'）。None の場合は病院全体
+    model_specs : dict or None
+        表示名 → (FORECAST_MODEL_FUNCTIONS のモデル名, 予測関数の引数)。
+        例: {"ARIMA (p,q≤1)": ("ARIMA", {"search_limits": {"max_p": 1, "max_q": 1}})}。
+        省略時は全モデルを既定の引数で評価する
+    horizons : list of int or None
+        評価する予測日数（省略時は FORECAST_SETTINGS['backtest_horizons']）
+    cutoffs : list of pd.Timestamp or None
+        予測起点（この日までのデータで学習する。省略時は default_cutoffs）
+    max_workers : int or None
+        ワーカー数（1 の場合はプロセスプールを使わない）
+    progress_callback : callable or None
+        progress_callback(進捗率, メッセージ)
+
+    Returns:
+    --------
+    pd.DataFrame
+        BACKTEST_RESULT_COLUMNS の列を持つ結果の表（モデル・集計単位・予測起点・予測日数順）
+    """
+    if model_specs is None:
+        model_specs = {name: (name, {}) for name in FORECAST_MODEL_FUNCTIONS}
+    if horizons is None:
+        horizons = FORECAST_SETTINGS.get('backtest_horizons', [7, 30, 90])
+    horizons = sorted(horizons)
+    max_horizon = horizons[-1]
+
+    exclude_wards = EXCLUDED_WARDS if unit_column == '病棟コード' else None
+    daily_matrix = build_unit_daily_matrix(df, unit_column, exclude_wards=exclude_wards)
+    if daily_matrix is None:
+        return pd.DataFrame(columns=BACKTEST_RESULT_COLUMNS)
+
+    dates = daily_matrix['dates']
+    if cutoffs is None:
+        cutoffs = default_cutoffs(dates[-1], max_horizon)
+
+    tasks = []
+    for cutoff in cutoffs:
+        cutoff = pd.Timestamp(cutoff).normalize()
+        end = (cutoff - dates[0]).days + 1
+        if end <= 0 or end + max_horizon > len(dates):
+            logger.info(f"予測起点 {cutoff.date()} は学習データまたは {max_horizon}日分の実績が不足するため除外します")
+            continue
+        for position, unit in enumerate(daily_matrix['units']):
+            first = daily_matrix['first_positions'][position]
+            if first >= end:
+                continue
+            values = daily_matrix['values'][position]
+            for label, (model_name, model_kwargs) in model_specs.items():
+                tasks.append((
+                    label, model_name, model_kwargs, unit, cutoff, dates[first],
+                    values[first:end], values[end:end + max_horizon], horizons,
+                ))
+
+    if not tasks:
+        return pd.DataFrame(columns=BACKTEST_RESULT_COLUMNS)
+
+    rows = []
+
+    def collect(results):
+        for completed, task_rows in enumerate(results, start=1):
+            rows.extend(task_rows)
+            if progress_callback:
+                progress_callback(completed / len(tasks), f"バックテスト中: {completed}/{len(tasks)}")
+
+    n_workers = get_runner_worker_count(len(tasks), max_workers)
+    if n_workers <= 1:
+        collect(map(_backtest_worker, tasks))
+    else:
+        max_tasks_per_child = FORECAST_SETTINGS.get('runner_max_tasks_per_child', 8)
+        logger.info(f"バックテスト: {len(tasks)}件, ワーカー数 {n_workers}")
+        with multiprocessing.Pool(processes=n_workers, maxtasksperchild=max_tasks_per_child) as pool:
+            collect(pool.imap_unordered(_backtest_worker, tasks))
+
+    results = pd.DataFrame(rows, columns=BACKTEST_RESULT_COLUMNS)
+    results["集計単位"] = results["集計単位"].astype(str)
+    return results.sort_values(["モデル", "集計単位", "予測起点", "予測日数"], ignore_index=True)
+
+
+def summarize_backtest(results):
+    """
+    バックテスト結果をモデル・予測日数ごとに平均する
+
+    Returns:
+    --------
+    pd.DataFrame
+        インデックス (モデル, 予測日数)、列 MAE・MAPE・学習時間（秒）・評価数
+    """
+    if results is None or results.empty:
+        return pd.DataFrame(columns=["MAE", "MAPE", "学習時間（秒）", "評価数"])
+    return results.groupby(["モデル", "予測日数"]).agg(
+        MAE=("MAE", "mean"),
+        MAPE=("MAPE", "mean"),
+        **{"学習時間（秒）": ("学習時間（秒）", "mean")},
+        評価数=("MAE", "size"),
+    )
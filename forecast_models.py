@@ -2,7 +2,16 @@ import pandas as pd
 import numpy as np
 from datetime import timedelta
 import streamlit as st
+import threading
 import warnings
+from collections import OrderedDict
+
+from config import FORECAST_SETTINGS
+from period_calendar import holiday_flags
+from model_store import (
+    REFIT_FULL, REFIT_UPDATE, load_model_entry, make_model_entry, model_store_enabled, plan_refit, save_model_entry,
+    values_hash,
+)
 
 # statsmodelsとpmdarimaの動的インポート
 try:
@@ -22,6 +31,36 @@ except ImportError:
 # 警告を抑制
 warnings.filterwarnings('ignore')
 
+# 保存パラメータから状態だけ更新する場合の ARIMA の最大反復回数
+ARIMA_UPDATE_MAXITER = 10
+# auto_arima の探索開始次数の既定値（上限がこれより小さい場合は上限に合わせる）
+ARIMA_DEFAULT_START_ORDERS = {'p': 2, 'q': 2, 'P': 1, 'Q': 1}
+
+# 曜日プロファイルの区分（0～6: 月～日、7: 平日に当たる祝日・年末年始）
+PROFILE_HOLIDAY_CATEGORY = 7
+N_PROFILE_CATEGORIES = 8
+# 前年同期比の比較に使う日数（曜日をそろえるため52週）
+YOY_LAG_DAYS = 364
+
+# 残差ブートストラップの予測区間のキャッシュ（系列・設定・予測日数・信頼水準ごと）
+INTERVAL_CACHE_SIZE = 32
+_interval_cache = OrderedDict()
+_interval_cache_lock = threading.Lock()
+
+
+def make_forecast_result(forecast, lower=None, upper=None, level=None, method=None, fallback=False):
+    """
+    予測値と予測区間をまとめた結果
+
+    Returns:
+    --------
+    dict
+        forecast（予測値の Series）, lower, upper（予測区間の下限・上限の Series。
+        区間を計算できない場合は None）, level（信頼水準）, method（'analytic' または 'bootstrap'）,
+        fallback（データ不足・学習エラーのためモデルを使わない単純予測を返した場合は True）
+    """
+    return {'forecast': forecast, 'lower': lower, 'upper': upper, 'level': level, 'method': method, 'fallback': fallback}
+
 @st.cache_data(ttl=3600, show_spinner=False)
 def prepare_daily_total_patients(df):
     """全日入院患者数の日次時系列データを準備する"""
@@ -61,8 +100,97 @@ def prepare_daily_total_patients(df):
         st.error(f"日次患者数データの準備中にエラーが発生しました: {e}")
         return pd.Series(dtype=float)
 
-def simple_moving_average_forecast(series, window=7, forecast_horizon=365):
-    """単純移動平均による予測"""
+def _cached_interval_deviations(cache_key, compute):
+    """予測区間の幅をキャッシュから取得する（なければ compute() で求めて保存）"""
+    with _interval_cache_lock:
+        deviations = _interval_cache.get(cache_key)
+        if deviations is not None:
+            _interval_cache.move_to_end(cache_key)
+            return deviations
+
+    deviations = compute()
+    if deviations is None:
+        return None
+
+    with _interval_cache_lock:
+        _interval_cache[cache_key] = deviations
+        _interval_cache.move_to_end(cache_key)
+        while len(_interval_cache) > INTERVAL_CACHE_SIZE:
+            _interval_cache.popitem(last=False)
+    return deviations
+
+
+def _bootstrap_residual_deviations(residuals, forecast_horizon, level, period):
+    """
+    1日先予測の残差の再標本化による予測区間の幅（予測値からの下側・上側の幅）
+
+    閉形式のモデルは水準・曜日ごとの値を period 日ごとに推定し直すとみなし、
+    h 日先の誤差を、再標本化した残差を period 日ごとに1つずつ積み上げた経路で表す
+    （季節ナイーブでは週ごとの差分の和になり、そのまま h 日先の誤差に一致する）。
+    残差が2つ未満の場合は None。
+    """
+    residuals = np.asarray(residuals, dtype=np.float64)
+    residuals = residuals[np.isfinite(residuals)]
+    if len(residuals) < 2:
+        return None
+    repetitions = FORECAST_SETTINGS.get('bootstrap_repetitions', 500)
+    n_periods = -(-forecast_horizon // period)
+    draws = np.random.default_rng(0).choice(residuals, size=(repetitions, n_periods))
+    paths = np.cumsum(draws, axis=1)[:, np.arange(forecast_horizon) // period]
+    centered = paths - paths.mean(axis=0)
+    tail = (1 - level) / 2
+    return np.quantile(centered, tail, axis=0), np.quantile(centered, 1 - tail, axis=0)
+
+
+def _with_residual_bootstrap_interval(model_name, forecast, series, residual_function, model_config,
+                                      forecast_horizon, level, period):
+    """閉形式のモデルの予測値に残差ブートストラップの予測区間を付けた make_forecast_result の辞書"""
+    repetitions = FORECAST_SETTINGS.get('bootstrap_repetitions', 500)
+    cache_key = (
+        model_name, values_hash(series.to_numpy()), series.index[-1], repr(sorted(model_config.items())),
+        forecast_horizon, level, repetitions,
+    )
+    deviations = _cached_interval_deviations(
+        cache_key, lambda: _bootstrap_residual_deviations(residual_function(), forecast_horizon, level, period)
+    )
+    if deviations is None:
+        return make_forecast_result(forecast)
+    lower_deviation, upper_deviation = deviations
+    lower = (forecast + lower_deviation).clip(lower=0)
+    upper = (forecast + upper_deviation).clip(lower=0)
+    return make_forecast_result(forecast, lower, upper, level, 'bootstrap')
+
+
+def _moving_average_residuals(values, window, n_origins):
+    """単純移動平均の直近 n_origins 日の1日先予測の残差（実績 - 直前 window 日の平均）"""
+    cumulative = np.concatenate([[0.0], np.cumsum(values)])
+    origins = np.arange(max(window, len(values) - n_origins), len(values))
+    return values[origins] - (cumulative[origins] - cumulative[origins - window]) / window
+
+
+def simple_moving_average_forecast(series, window=7, forecast_horizon=365, return_interval=False, level=None):
+    """
+    単純移動平均による予測
+
+    return_interval=True の場合は、予測値と1日先予測の残差ブートストラップによる予測区間
+    （信頼水準 level、省略時は FORECAST_SETTINGS['confidence_interval']）を
+    make_forecast_result の辞書で返す。
+    """
+    forecast = _simple_moving_average_point(series, window, forecast_horizon)
+    if not return_interval:
+        return forecast
+    if len(series) < window or forecast.empty:
+        return make_forecast_result(forecast, fallback=True)
+    n_origins = FORECAST_SETTINGS.get('bootstrap_residual_days', 56)
+    return _with_residual_bootstrap_interval(
+        'simple_moving_average', forecast, series,
+        lambda: _moving_average_residuals(series.to_numpy(dtype=np.float64), window, n_origins),
+        {'window': window}, forecast_horizon, level or FORECAST_SETTINGS.get('confidence_interval', 0.95), window,
+    )
+
+
+def _simple_moving_average_point(series, window, forecast_horizon):
+    """単純移動平均による予測値"""
     if series.empty or len(series) < window:
         # データ不足の場合は空のSeriesを返す
         return pd.Series(
@@ -93,11 +221,319 @@ def simple_moving_average_forecast(series, window=7, forecast_horizon=365):
         st.error(f"移動平均予測でエラーが発生しました: {e}")
         return pd.Series(dtype=float)
 
-def holt_winters_forecast(series, seasonal_periods=7, trend='add', seasonal='add', forecast_horizon=365):
-    """Holt-Winters法による予測"""
+# ===== 閉形式のベースラインモデル（集計単位 × 日 の行列をまとめて予測） =====
+# values は 集計単位 × 日 の配列（データのない日は NaN）、dates はその日付。
+# 戻り値は 集計単位 × 予測日 の配列。
+
+def _profile_categories(dates):
+    """日付ごとの曜日プロファイルの区分（平日の祝日・年末年始は PROFILE_HOLIDAY_CATEGORY）"""
+    dates = pd.DatetimeIndex(dates)
+    day_of_week = dates.dayofweek.values
+    return np.where(holiday_flags(dates) & (day_of_week < 5), PROFILE_HOLIDAY_CATEGORY, day_of_week)
+
+
+def _baseline_forecast_dates(dates, forecast_horizon):
+    """予測日（最終日の翌日から forecast_horizon 日）"""
+    return pd.date_range(pd.DatetimeIndex(dates)[-1] + timedelta(days=1), periods=forecast_horizon, freq='D')
+
+
+def _fill_missing_forecast(forecast, values, lookback_days):
+    """区分のデータがなく予測できない日を直近の平均で埋める（直近も欠損なら0）"""
+    with warnings.catch_warnings(), np.errstate(invalid='ignore'):
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        recent_mean = np.nanmean(values[:, -lookback_days:], axis=1)
+    recent_mean = np.nan_to_num(recent_mean)
+    return np.clip(np.where(np.isnan(forecast), recent_mean[:, None], forecast), 0, None)
+
+
+def dow_profile_factors(values, dates, lookback_weeks=None):
+    """
+    直近 lookback_weeks 週の曜日プロファイル係数（区分平均 / 全日平均、集計単位 × 区分）
+
+    データのない区分は1、祝日の区分がない場合は日曜の係数で代用する。
+    """
+    if lookback_weeks is None:
+        lookback_weeks = FORECAST_SETTINGS.get('baseline_lookback_weeks', 8)
+    lookback_days = lookback_weeks * 7
+    recent = values[:, -lookback_days:]
+    categories = _profile_categories(dates)[-lookback_days:]
+    one_hot = (categories[:, None] == np.arange(N_PROFILE_CATEGORIES)[None, :]).astype(np.float64)
+    valid = ~np.isnan(recent)
+    sums = np.where(valid, recent, 0.0) @ one_hot
+    counts = valid.astype(np.float64) @ one_hot
+    with np.errstate(invalid='ignore', divide='ignore'):
+        category_means = sums / counts
+        overall_means = np.where(valid, recent, 0.0).sum(axis=1) / valid.sum(axis=1)
+        factors = category_means / overall_means[:, None]
+    factors[:, PROFILE_HOLIDAY_CATEGORY] = np.where(
+        np.isnan(factors[:, PROFILE_HOLIDAY_CATEGORY]), factors[:, 6], factors[:, PROFILE_HOLIDAY_CATEGORY]
+    )
+    return np.where(np.isfinite(factors), factors, 1.0)
+
+
+def seasonal_naive_profile_matrix(values, dates, forecast_horizon):
+    """
+    季節ナイーブ（曜日・祝日プロファイル）
+
+    各予測日に、同じ区分（曜日、または平日の祝日）の直近の実績値をそのまま使う。
+    祝日の実績がない場合は日曜の値で代用する。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_units = values.shape[0]
+    categories = _profile_categories(dates)
+    last_values = np.full((n_units, N_PROFILE_CATEGORIES), np.nan)
+    for category in range(N_PROFILE_CATEGORIES):
+        columns = np.flatnonzero(categories == category)
+        if len(columns) == 0:
+            continue
+        category_values = values[:, columns]
+        valid = ~np.isnan(category_values)
+        last_position = valid.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+        last_values[:, category] = np.where(valid.any(axis=1), category_values[np.arange(n_units), last_position], np.nan)
+    last_values[:, PROFILE_HOLIDAY_CATEGORY] = np.where(
+        np.isnan(last_values[:, PROFILE_HOLIDAY_CATEGORY]), last_values[:, 6], last_values[:, PROFILE_HOLIDAY_CATEGORY]
+    )
+
+    forecast = last_values[:, _profile_categories(_baseline_forecast_dates(dates, forecast_horizon))]
+    return _fill_missing_forecast(forecast, values, 7)
+
+
+def weighted_moving_average_dow_matrix(values, dates, forecast_horizon, window=28, lookback_weeks=None):
+    """
+    曜日係数付き加重移動平均
+
+    直近 window 日を曜日プロファイル係数で割って季節性を除き、新しい日ほど重い
+    線形の重みで平均した水準に、予測日の区分の係数を掛ける。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    factors = dow_profile_factors(values, dates, lookback_weeks)
+    categories = _profile_categories(dates)[-window:]
+    recent_factors = factors[:, categories]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        deseasonalized = np.where(recent_factors > 0, values[:, -window:] / recent_factors, np.nan)
+    weights = np.arange(1, deseasonalized.shape[1] + 1, dtype=np.float64)[None, :]
+    valid = ~np.isnan(deseasonalized)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        level = np.where(valid, deseasonalized * weights, 0.0).sum(axis=1) / np.where(valid, weights, 0.0).sum(axis=1)
+
+    forecast = level[:, None] * factors[:, _profile_categories(_baseline_forecast_dates(dates, forecast_horizon))]
+    return _fill_missing_forecast(forecast, values, window)
+
+
+def yoy_scaled_matrix(values, dates, forecast_horizon, scale_window=28, lookback_weeks=None):
+    """
+    前年同期比
+
+    52週前（1年を超える予測日は104週前…）の同じ曜日の実績に、直近 scale_window 日と
+    その52週前の合計の比を掛ける。前年と祝日の有無が異なる日は曜日プロファイル係数で
+    補正し、前年の実績がない日は曜日係数付き加重移動平均で代用する。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_days = values.shape[1]
+    factors = dow_profile_factors(values, dates, lookback_weeks)
+    categories = _profile_categories(dates)
+    forecast_categories = _profile_categories(_baseline_forecast_dates(dates, forecast_horizon))
+
+    steps = np.arange(1, forecast_horizon + 1)
+    source = n_days - 1 + steps - YOY_LAG_DAYS * np.ceil(steps / YOY_LAG_DAYS).astype(np.int64)
+    has_source = source >= 0
+    source = np.where(has_source, source, 0)
+
+    if n_days >= scale_window + YOY_LAG_DAYS:
+        recent_total = np.nansum(values[:, -scale_window:], axis=1)
+        prior_total = np.nansum(values[:, n_days - YOY_LAG_DAYS - scale_window:n_days - YOY_LAG_DAYS], axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scale = np.where(prior_total > 0, recent_total / prior_total, np.nan)
+    else:
+        scale = np.full(values.shape[0], np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        holiday_adjustment = factors[:, forecast_categories] / factors[:, categories[source]]
+    holiday_adjustment = np.where(np.isfinite(holiday_adjustment), holiday_adjustment, 1.0)
+    forecast = values[:, source] * holiday_adjustment * scale[:, None]
+    forecast[:, ~has_source] = np.nan
+
+    fallback = weighted_moving_average_dow_matrix(values, dates, forecast_horizon, lookback_weeks=lookback_weeks)
+    return np.clip(np.where(np.isnan(forecast), fallback, forecast), 0, None)
+
+
+# 閉形式モデル名 → 行列の予測関数
+BASELINE_MATRIX_FUNCTIONS = {
+    "季節ナイーブ（曜日・祝日）": seasonal_naive_profile_matrix,
+    "加重移動平均（曜日係数）": weighted_moving_average_dow_matrix,
+    "前年同期比": yoy_scaled_matrix,
+}
+
+
+def _baseline_one_step_residuals(matrix_function, values, dates, n_origins, **kwargs):
+    """直近 n_origins 日について、前日までのデータで予測した1日先予測の残差（実績 - 予測）"""
+    origins = range(max(1, len(values) - n_origins), len(values))
+    predictions = np.array([
+        matrix_function(values[None, :origin], dates[:origin], 1, **kwargs)[0, 0] for origin in origins
+    ])
+    return values[list(origins)] - predictions
+
+
+def _baseline_series_forecast(matrix_function, series, forecast_horizon, return_interval=False, level=None, **kwargs):
+    """
+    1系列を行列の予測関数で予測して Series で返す
+
+    return_interval=True の場合は、1日先予測の残差ブートストラップによる予測区間を付けた
+    make_forecast_result の辞書で返す。
+    """
+    if series.empty:
+        forecast = pd.Series(dtype=float)
+        return make_forecast_result(forecast, fallback=True) if return_interval else forecast
+    try:
+        values = series.to_numpy(dtype=np.float64)
+        forecast = pd.Series(
+            matrix_function(values[None, :], series.index, forecast_horizon, **kwargs)[0],
+            index=_baseline_forecast_dates(series.index, forecast_horizon),
+        )
+        if not return_interval:
+            return forecast
+        n_origins = FORECAST_SETTINGS.get('bootstrap_residual_days', 56)
+        return _with_residual_bootstrap_interval(
+            matrix_function.__name__, forecast, series,
+            lambda: _baseline_one_step_residuals(matrix_function, values, series.index, n_origins, **kwargs),
+            kwargs, forecast_horizon, level or FORECAST_SETTINGS.get('confidence_interval', 0.95), 7,
+        )
+    except Exception as e:
+        st.error(f"ベースライン予測でエラーが発生しました: {e}")
+        forecast = pd.Series(dtype=float)
+        return make_forecast_result(forecast, fallback=True) if return_interval else forecast
+
+
+def seasonal_naive_forecast(series, forecast_horizon=365, return_interval=False, level=None):
+    """季節ナイーブ（曜日・祝日プロファイル）による予測（return_interval=True なら予測区間も返す）"""
+    return _baseline_series_forecast(seasonal_naive_profile_matrix, series, forecast_horizon, return_interval, level)
+
+
+def weighted_moving_average_forecast(series, window=28, forecast_horizon=365, return_interval=False, level=None):
+    """曜日係数付き加重移動平均による予測（return_interval=True なら予測区間も返す）"""
+    return _baseline_series_forecast(
+        weighted_moving_average_dow_matrix, series, forecast_horizon, return_interval, level, window=window
+    )
+
+
+def yoy_scaled_forecast(series, forecast_horizon=365, return_interval=False, level=None):
+    """前年同期比による予測（return_interval=True なら予測区間も返す）"""
+    return _baseline_series_forecast(yoy_scaled_matrix, series, forecast_horizon, return_interval, level)
+
+
+def _holt_winters_params(fit):
+    """Holt-Winters の学習結果から保存するパラメータを取り出す"""
+    params = fit.params
+    return {
+        'smoothing_level': params['smoothing_level'],
+        'smoothing_trend': params['smoothing_trend'],
+        'smoothing_seasonal': params['smoothing_seasonal'],
+        'initial_level': params['initial_level'],
+        'initial_trend': params['initial_trend'],
+        'initial_seasons': np.asarray(params['initial_seasons'], dtype=float),
+    }
+
+
+def _fit_holt_winters(adjusted_series, seasonal_periods, trend, seasonal, refit, stored_params):
+    """Holt-Winters の学習（全推定・保存値からの再最適化・状態の更新）"""
+    if refit == REFIT_UPDATE:
+        # 保存したパラメータと初期状態のまま系列をなめるだけ（最適化なし）
+        model = ExponentialSmoothing(
+            adjusted_series,
+            seasonal_periods=seasonal_periods,
+            trend=trend,
+            seasonal=seasonal,
+            initialization_method="known",
+            initial_level=stored_params['initial_level'],
+            initial_trend=stored_params['initial_trend'] if trend else None,
+            initial_seasonal=stored_params['initial_seasons'] if seasonal else None,
+        )
+        return model.fit(
+            smoothing_level=stored_params['smoothing_level'],
+            smoothing_trend=stored_params['smoothing_trend'] if trend else None,
+            smoothing_seasonal=stored_params['smoothing_seasonal'] if seasonal else None,
+            optimized=False,
+            remove_bias=True,
+        )
+
+    model = ExponentialSmoothing(
+        adjusted_series,
+        seasonal_periods=seasonal_periods,
+        trend=trend,
+        seasonal=seasonal,
+        initialization_method="estimated"
+    )
+    if refit == REFIT_FULL:
+        return model.fit(optimized=True, remove_bias=True)
+
+    # 保存したパラメータを初期値にして再最適化（グリッド探索なし）
+    # 並び順は [alpha, beta, gamma, initial_level, initial_trend, 季節成分...]
+    start_params = [stored_params['smoothing_level']]
+    if trend:
+        start_params.append(stored_params['smoothing_trend'])
+    if seasonal:
+        start_params.append(stored_params['smoothing_seasonal'])
+    start_params.append(stored_params['initial_level'])
+    if trend:
+        start_params.append(stored_params['initial_trend'])
+    if seasonal:
+        start_params.extend(stored_params['initial_seasons'])
+    return model.fit(optimized=True, remove_bias=True, start_params=np.asarray(start_params, dtype=float), use_brute=False)
+
+
+def _holt_winters_bootstrap_deviations(fit, series, model_config, forecast_horizon, level):
+    """
+    Holt-Winters の予測区間（予測値からの下側・上側の幅）を残差ブートストラップで求める
+
+    学習時の残差を再標本化した将来の経路から、予測日ごとの分位点を平均経路からの幅として求める。
+    同じ系列・設定・予測日数・信頼水準の結果はキャッシュし、再計算しない。
+    """
+    repetitions = FORECAST_SETTINGS.get('bootstrap_repetitions', 500)
+    cache_key = (
+        'holt_winters', values_hash(series.to_numpy()), repr(sorted(model_config.items())),
+        forecast_horizon, level, repetitions,
+    )
+
+    def simulate_deviations():
+        simulations = np.asarray(fit.simulate(
+            forecast_horizon, anchor='end', repetitions=repetitions,
+            error='add', random_errors='bootstrap', random_state=0,
+        ), dtype=np.float64).reshape(forecast_horizon, -1)
+        centered = simulations - simulations.mean(axis=1, keepdims=True)
+        tail = (1 - level) / 2
+        return np.quantile(centered, tail, axis=1), np.quantile(centered, 1 - tail, axis=1)
+
+    return _cached_interval_deviations(cache_key, simulate_deviations)
+
+
+def holt_winters_forecast(series, seasonal_periods=7, trend='add', seasonal='add', forecast_horizon=365, series_key=None,
+                          return_interval=False, level=None):
+    """
+    Holt-Winters法による予測
+
+    series_key（系列の識別子）を指定した場合は、学習済みパラメータをモデルストアに保存し、
+    次回は新しい日の分だけ状態を更新する（全推定は model_full_refit_days 日ごと）。
+    return_interval=True の場合は、予測値と残差ブートストラップの予測区間
+    （信頼水準 level、省略時は FORECAST_SETTINGS['confidence_interval']）を
+    make_forecast_result の辞書で返す。
+    """
+    interval_level = (level or FORECAST_SETTINGS.get('confidence_interval', 0.95)) if return_interval else None
+    result = holt_winters_forecast_result(
+        series, seasonal_periods, trend, seasonal, forecast_horizon, series_key, level=interval_level
+    )
+    return result if return_interval else result['forecast']
+
+
+def holt_winters_forecast_result(series, seasonal_periods=7, trend='add', seasonal='add', forecast_horizon=365,
+                                 series_key=None, level=None):
+    """
+    Holt-Winters法による予測を make_forecast_result の辞書で返す
+
+    level を指定した場合は予測区間も求める。単純予測に切り替えた場合は fallback が True になる。
+    """
     if not STATSMODELS_AVAILABLE:
         st.error("Holt-Winters予測にはstatsmodelsが必要です。")
-        return pd.Series(dtype=float)
+        return make_forecast_result(pd.Series(dtype=float), fallback=True)
     
     if series.empty or len(series) < seasonal_periods * 2:
         # データ不足時は最終値を使用
@@ -107,7 +543,7 @@ def holt_winters_forecast(series, seasonal_periods=7, trend='add', seasonal='add
             periods=forecast_horizon,
             freq='D'
         )
-        return pd.Series([last_value] * forecast_horizon, index=forecast_index)
+        return make_forecast_result(pd.Series([last_value] * forecast_horizon, index=forecast_index), fallback=True)
 
     try:
         # データの前処理
@@ -120,16 +556,25 @@ def holt_winters_forecast(series, seasonal_periods=7, trend='add', seasonal='add
             adjusted_series = series
             offset = 0
 
-        # Holt-Wintersモデルの作成と学習
-        model = ExponentialSmoothing(
-            adjusted_series,
-            seasonal_periods=seasonal_periods,
-            trend=trend,
-            seasonal=seasonal,
-            initialization_method="estimated"
-        )
-        
-        fit = model.fit(optimized=True, remove_bias=True)
+        # Holt-Wintersモデルの作成と学習（保存済みパラメータがあれば再利用）
+        use_store = series_key is not None and model_store_enabled()
+        model_config = {'seasonal_periods': seasonal_periods, 'trend': trend, 'seasonal': seasonal, 'offset': offset}
+        entry = load_model_entry('holt_winters', series_key) if use_store else None
+        refit = plan_refit(entry, series, model_config)
+
+        try:
+            fit = _fit_holt_winters(
+                adjusted_series, seasonal_periods, trend, seasonal, refit, entry['params'] if entry else None
+            )
+        except Exception:
+            if refit == REFIT_FULL:
+                raise
+            # 保存値からの推定に失敗した場合は全推定し直す
+            refit = REFIT_FULL
+            fit = _fit_holt_winters(adjusted_series, seasonal_periods, trend, seasonal, refit, None)
+        if use_store:
+            params = entry['params'] if refit == REFIT_UPDATE else _holt_winters_params(fit)
+            save_model_entry('holt_winters', series_key, make_model_entry(series_key, series, model_config, params, refit, entry))
         
         # 予測の実行
         forecast = fit.forecast(forecast_horizon)
@@ -140,7 +585,16 @@ def holt_winters_forecast(series, seasonal_periods=7, trend='add', seasonal='add
             # 負の値が出た場合は0にクリップ
             forecast = forecast.clip(lower=0)
         
-        return forecast
+        if level is None:
+            return make_forecast_result(forecast)
+
+        # 予測区間（残差ブートストラップ、キャッシュ済みなら再計算しない）
+        lower_deviation, upper_deviation = _holt_winters_bootstrap_deviations(
+            fit, series, model_config, forecast_horizon, level
+        )
+        lower = (forecast + lower_deviation).clip(lower=0)
+        upper = (forecast + upper_deviation).clip(lower=0)
+        return make_forecast_result(forecast, lower, upper, level, 'bootstrap')
 
     except Exception as e:
         st.error(f"Holt-Winters予測でエラーが発生しました: {e}")
@@ -153,15 +607,81 @@ def holt_winters_forecast(series, seasonal_periods=7, trend='add', seasonal='add
                 periods=forecast_horizon, 
                 freq='D'
             )
-            return pd.Series([avg_value] * forecast_horizon, index=forecast_index)
+            return make_forecast_result(pd.Series([avg_value] * forecast_horizon, index=forecast_index), fallback=True)
         else:
-            return pd.Series(dtype=float)
+            return make_forecast_result(pd.Series(dtype=float), fallback=True)
+
+def resolve_arima_search_limits(search_limits=None):
+    """
+    ARIMA の次数探索の設定（FORECAST_SETTINGS['arima_search_limits'] に search_limits を上書きしたもの）
+
+    探索の開始次数（start_p など）は上限（max_p など）を超えないように丸める。
+    """
+    resolved = dict(FORECAST_SETTINGS['arima_search_limits'])
+    resolved.update(search_limits or {})
+    for order_name, default_start in ARIMA_DEFAULT_START_ORDERS.items():
+        max_name = f"max_{order_name}"
+        if max_name in resolved:
+            resolved[f"start_{order_name}"] = min(resolved.get(f"start_{order_name}", default_start), resolved[max_name])
+    return resolved
+
+
+def _fit_arima(series, seasonal, m, refit, stored_params, search_limits):
+    """ARIMA の学習（次数探索・保存した次数とパラメータからの再最適化）"""
+    if refit == REFIT_FULL:
+        return pm.auto_arima(
+            series,
+            seasonal=seasonal,
+            m=m,  # 季節周期
+            stepwise=True,  # 高速化
+            suppress_warnings=True,
+            error_action='ignore',
+            trace=False,
+            information_criterion='aic',
+            **search_limits  # 計算量削減のため次数を制限
+        )
+
+    # 次数は固定し、保存したパラメータを初期値にして推定する
+    # （新しい日の追加だけなら反復回数を絞る）
+    model = pm.ARIMA(
+        order=stored_params['order'],
+        seasonal_order=stored_params['seasonal_order'],
+        with_intercept=stored_params['with_intercept'],
+        start_params=stored_params['params'],
+        maxiter=ARIMA_UPDATE_MAXITER if refit == REFIT_UPDATE else stored_params['maxiter'],
+        suppress_warnings=True,
+    )
+    return model.fit(series)
 
-def arima_forecast(series, forecast_horizon=365, seasonal=True, m=7):
-    """ARIMA/SARIMAモデルによる予測"""
+
+def arima_forecast(series, forecast_horizon=365, seasonal=True, m=7, series_key=None, search_limits=None,
+                   return_interval=False, level=None):
+    """
+    ARIMA/SARIMAモデルによる予測
+
+    series_key（系列の識別子）を指定した場合は、選ばれた次数とパラメータをモデルストアに保存し、
+    次回は次数探索を省いて保存値から推定する（次数探索は model_full_refit_days 日ごと）。
+    search_limits は次数探索の上限（max_p, max_q など）。FORECAST_SETTINGS['arima_search_limits'] の
+    指定した項目だけを上書きする（resolve_arima_search_limits）。
+    return_interval=True の場合は、予測値とモデルの解析的な予測区間
+    （信頼水準 level、省略時は FORECAST_SETTINGS['confidence_interval']）を
+    make_forecast_result の辞書で返す。
+    """
+    interval_level = (level or FORECAST_SETTINGS.get('confidence_interval', 0.95)) if return_interval else None
+    result = arima_forecast_result(series, forecast_horizon, seasonal, m, series_key, search_limits, level=interval_level)
+    return result if return_interval else result['forecast']
+
+
+def arima_forecast_result(series, forecast_horizon=365, seasonal=True, m=7, series_key=None, search_limits=None,
+                          level=None):
+    """
+    ARIMA/SARIMAモデルによる予測を make_forecast_result の辞書で返す
+
+    level を指定した場合は予測区間も返す。単純予測に切り替えた場合は fallback が True になる。
+    """
     if not PMDARIMA_AVAILABLE:
         st.error("ARIMA予測にはpmdarimaが必要です。")
-        return pd.Series(dtype=float)
+        return make_forecast_result(pd.Series(dtype=float), fallback=True)
     
     if series.empty or len(series) < m * 2:
         # データ不足時は最終値を使用
@@ -171,38 +691,56 @@ def arima_forecast(series, forecast_horizon=365, seasonal=True, m=7):
             periods=forecast_horizon,
             freq='D'
         )
-        return pd.Series([last_value] * forecast_horizon, index=forecast_index)
+        return make_forecast_result(pd.Series([last_value] * forecast_horizon, index=forecast_index), fallback=True)
 
     try:
-        # ARIMAモデルの自動選択と学習
-        model = pm.auto_arima(
-            series,
-            seasonal=seasonal,
-            m=m,  # 季節周期
-            stepwise=True,  # 高速化
-            suppress_warnings=True,
-            error_action='ignore',
-            max_order=3,  # 計算量削減のため次数を制限
-            max_p=2, max_d=1, max_q=2,
-            max_P=1, max_D=1, max_Q=1,
-            trace=False,
-            information_criterion='aic'
-        )
+        # ARIMAモデルの自動選択と学習（保存済みの次数があれば再利用）
+        use_store = series_key is not None and model_store_enabled()
+        search_limits = resolve_arima_search_limits(search_limits)
+        model_config = {'seasonal': seasonal, 'm': m, 'search_limits': dict(search_limits)}
+        entry = load_model_entry('arima', series_key) if use_store else None
+        refit = plan_refit(entry, series, model_config)
 
-        # 予測の実行
-        forecast, conf_int = model.predict(n_periods=forecast_horizon, return_conf_int=True)
+        try:
+            model = _fit_arima(series, seasonal, m, refit, entry['params'] if entry else None, search_limits)
+        except Exception:
+            if refit == REFIT_FULL:
+                raise
+            # 保存値からの推定に失敗した場合は次数探索からやり直す
+            refit = REFIT_FULL
+            model = _fit_arima(series, seasonal, m, refit, None, search_limits)
+        if use_store:
+            params = {
+                'order': model.order,
+                'seasonal_order': model.seasonal_order,
+                'with_intercept': model.with_intercept,
+                'params': np.asarray(model.params(), dtype=float),
+                # 状態だけの更新は反復回数を絞っているため、再最適化用の反復回数は前回の値を引き継ぐ
+                'maxiter': entry['params']['maxiter'] if refit == REFIT_UPDATE else model.maxiter,
+            }
+            save_model_entry('arima', series_key, make_model_entry(series_key, series, model_config, params, refit, entry))
+
+        # 予測の実行（予測区間はモデルの解析的な区間をそのまま使う）
+        alpha = 1 - (level or FORECAST_SETTINGS.get('confidence_interval', 0.95))
+        forecast, conf_int = model.predict(n_periods=forecast_horizon, return_conf_int=True, alpha=alpha)
 
         forecast_index = pd.date_range(
             start=series.index[-1] + timedelta(days=1), 
             periods=forecast_horizon, 
             freq='D'
         )
-        forecast_series = pd.Series(forecast, index=forecast_index)
+        forecast_series = pd.Series(np.asarray(forecast), index=forecast_index)
         
         # 負の値を0にクリップ
         forecast_series = forecast_series.clip(lower=0)
 
-        return forecast_series
+        if level is None:
+            return make_forecast_result(forecast_series)
+
+        conf_int = np.asarray(conf_int)
+        lower = pd.Series(conf_int[:, 0], index=forecast_index).clip(lower=0)
+        upper = pd.Series(conf_int[:, 1], index=forecast_index).clip(lower=0)
+        return make_forecast_result(forecast_series, lower, upper, level, 'analytic')
 
     except Exception as e:
         st.error(f"ARIMA予測でエラーが発生しました: {e}")
@@ -214,9 +752,9 @@ def arima_forecast(series, forecast_horizon=365, seasonal=True, m=7):
                 periods=forecast_horizon, 
                 freq='D'
             )
-            return pd.Series([last_value] * forecast_horizon, index=forecast_index)
+            return make_forecast_result(pd.Series([last_value] * forecast_horizon, index=forecast_index), fallback=True)
         else:
-            return pd.Series(dtype=float)
+            return make_forecast_result(pd.Series(dtype=float), fallback=True)
 
 def generate_annual_forecast_summary(actual_series, forecast_series, current_date, target_fiscal_year):
     """
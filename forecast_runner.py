@@ -0,0 +1,255 @@
+# forecast_runner.py - 診療科・病棟ごとの一括予測
+"""
+前処理済みデータから 集計単位（診療科・病棟）× 日 の在院患者数の行列を作り、
+集計単位ごとに予測モデルをプロセスプールで並列に学習・予測する。
+
+ワーカーには集計単位ごとの1次元の系列だけを渡し（データフレームは渡さない）、
+結果は 集計単位 × 予測日 の配列に書き込む。ワーカーは一定数のタスクごとに
+入れ替え、学習のたびに増えるメモリを解放する。
+閉形式のベースラインモデルはプロセスプールを使わず、行列のまま全集計単位を1回で予測する。
+"""
+import logging
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from config import EXCLUDED_WARDS, FORECAST_SETTINGS
+from forecast_models import (
+    BASELINE_MATRIX_FUNCTIONS, arima_forecast, arima_forecast_result, generate_annual_forecast_summary,
+    holt_winters_forecast, holt_winters_forecast_result, seasonal_naive_forecast, simple_moving_average_forecast, weighted_moving_average_forecast, yoy_scaled_forecast,
+)
+from period_calendar import get_fiscal_year_start
+from row_selection import NS_PER_DAY, get_row_selection_index
+
+logger = logging.getLogger(__name__)
+
+# モデル名 → 予測関数
+FORECAST_MODEL_FUNCTIONS = {
+    "単純移動平均": simple_moving_average_forecast,
+    "Holt-Winters": holt_winters_forecast,
+    "ARIMA": arima_forecast,
+    "季節ナイーブ（曜日・祝日）": seasonal_naive_forecast,
+    "加重移動平均（曜日係数）": weighted_moving_average_forecast,
+    "前年同期比": yoy_scaled_forecast,
+}
+# モデル名 → make_forecast_result の辞書を返す予測関数（単純予測への切り替えを判別できるモデル）
+FORECAST_RESULT_FUNCTIONS = {
+    "Holt-Winters": holt_winters_forecast_result,
+    "ARIMA": arima_forecast_result,
+}
+# 学習済みパラメータをモデルストアに保存できるモデル
+MODEL_STORE_MODELS = {"Holt-Winters", "ARIMA"}
+
+ANNUAL_SUMMARY_COLUMNS = ["実績総患者数", "予測総患者数", "年度総患者数（予測込）"]
+
+
+def build_unit_daily_matrix(df, unit_column, value_column='入院患者数（在院）', exclude_wards=None):
+    """
+    集計単位 × 日 の合計の行列を作成する（データのない日は0）
+
+    unit_column が None の場合は病院全体の1行だけの行列を作成する。
+
+    Returns:
+    --------
+    dict or None
+        units（集計単位、文字列順）, dates（データ期間の全日）,
+        values（集計単位 × 日）, first_positions（集計単位ごとの最初のデータ日の位置）。
+        データがない場合は None
+    """
+    if df is None or df.empty or value_column not in df.columns:
+        return None
+    if unit_column is not None and unit_column not in df.columns:
+        return None
+
+    index = get_row_selection_index(df)
+    positions = index.select(exclude_wards=exclude_wards)
+    if unit_column is None:
+        units = ['病院全体']
+        row_units = np.zeros(len(positions), dtype=np.int64)
+    else:
+        codes, uniques = index.column_codes(unit_column)
+        row_codes = codes[positions]
+        positions = positions[row_codes >= 0]
+        used_codes, row_units = np.unique(row_codes[row_codes >= 0], return_inverse=True)
+        order = np.argsort(np.array([str(value) for value in uniques[used_codes]], dtype=object), kind='stable')
+        row_units = np.argsort(order)[row_units]
+        units = list(uniques[used_codes[order]])
+    if len(positions) == 0:
+        return None
+
+    day_codes = index.day_codes[positions]
+    first_day = int(day_codes.min())
+    n_units = len(units)
+    n_days = int(day_codes.max()) - first_day + 1
+    cell_keys = row_units * n_days + (day_codes - first_day)
+
+    values = df[value_column].to_numpy()[positions]
+    if not (np.issubdtype(values.dtype, np.number) or np.issubdtype(values.dtype, np.bool_)):
+        values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy()
+    weights = np.nan_to_num(values.astype(np.float64))
+    matrix = np.bincount(cell_keys, weights=weights, minlength=n_units * n_days).reshape(n_units, n_days)
+    has_data = np.bincount(cell_keys, minlength=n_units * n_days).reshape(n_units, n_days) > 0
+
+    return {
+        'units': units,
+        'dates': pd.date_range(pd.Timestamp(first_day * NS_PER_DAY), periods=n_days, freq='D'),
+        'values': np.clip(matrix, 0, None),
+        'first_positions': has_data.argmax(axis=1),
+    }
+
+
+def _forecast_unit_worker(task):
+    """
+    ワーカー: 1つの集計単位の系列を予測し、年度集計も計算する
+
+    Returns:
+    --------
+    tuple
+        (行の位置, 予測値の配列（予測日の数）, 年度集計の辞書)。失敗時は予測値が None
+    """
+    position, unit, series_key, start_date, values, model_name, model_kwargs, horizon, fiscal_year = task
+    series = pd.Series(values, index=pd.date_range(start_date, periods=len(values), freq='D'))
+    try:
+        forecast_function = FORECAST_MODEL_FUNCTIONS[model_name]
+        kwargs = dict(model_kwargs)
+        if model_name in MODEL_STORE_MODELS:
+            kwargs['series_key'] = series_key
+        forecast_series = forecast_function(series, forecast_horizon=horizon, **kwargs)
+        if forecast_series is None or forecast_series.empty:
+            return position, None, None
+
+        forecast_values = np.asarray(forecast_series, dtype=np.float64)[:horizon]
+        forecast_series = pd.Series(forecast_values, index=series.index[-1] + pd.to_timedelta(np.arange(1, len(forecast_values) + 1), unit='D'))
+        annual_summary = generate_annual_forecast_summary(series, forecast_series, series.index[-1], fiscal_year)
+        return position, forecast_values, annual_summary
+    except Exception as e:
+        logger.warning(f"集計単位 '{unit}' の予測でエラーが発生しました ({model_name}): {e}")
+        return position, None, None
+
+
+def get_runner_worker_count(n_tasks, max_workers=None):
+    """一括予測のワーカー数（CPU数・設定上限・タスク数の小さい方）"""
+    if max_workers is None:
+        max_workers = FORECAST_SETTINGS.get('runner_max_workers', 4)
+    return max(1, min(max_workers, multiprocessing.cpu_count() - 1, n_tasks))
+
+
+def _run_unit_forecast_tasks(daily_matrix, unit_column, model_name, model_kwargs, horizon, fiscal_year,
+                             max_workers, progress_callback):
+    """集計単位ごとの学習・予測をプロセスプールで実行する（予測の配列と年度集計の行を返す）"""
+    units = daily_matrix['units']
+    dates = daily_matrix['dates']
+    tasks = [
+        (
+            position, unit, (unit_column, str(unit)), dates[first],
+            daily_matrix['values'][position, first:], model_name, model_kwargs, horizon, fiscal_year,
+        )
+        for position, (unit, first) in enumerate(zip(units, daily_matrix['first_positions']))
+    ]
+
+    forecast = np.full((len(units), horizon), np.nan)
+    annual_rows = [dict.fromkeys(ANNUAL_SUMMARY_COLUMNS, np.nan) for _ in units]
+
+    def collect(results):
+        for completed, (position, forecast_values, annual_summary) in enumerate(results, start=1):
+            if forecast_values is not None:
+                forecast[position, :len(forecast_values)] = forecast_values
+                annual_rows[position] = annual_summary
+            if progress_callback:
+                progress_callback(completed / len(tasks), f"予測中: {completed}/{len(tasks)} ({model_name})")
+
+    n_workers = get_runner_worker_count(len(tasks), max_workers)
+    if n_workers <= 1:
+        collect(map(_forecast_unit_worker, tasks))
+    else:
+        max_tasks_per_child = FORECAST_SETTINGS.get('runner_max_tasks_per_child', 8)
+        logger.info(f"一括予測: {len(tasks)}単位 ({unit_column}, {model_name}), ワーカー数 {n_workers}")
+        with multiprocessing.Pool(processes=n_workers, maxtasksperchild=max_tasks_per_child) as pool:
+            collect(pool.imap_unordered(_forecast_unit_worker, tasks))
+    return forecast, annual_rows
+
+
+def run_unit_forecasts(df, unit_column, model_name="Holt-Winters", model_kwargs=None,
+                       target_fiscal_year=None, max_workers=None, progress_callback=None):
+    """
+    診療科・病棟ごとの予測を一括で実行する
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        前処理済みデータ
+    unit_column : str
+        集計単位の列（'診療科名' または '病棟コード'。病棟の場合は除外病棟を除く）
+    model_name : str
+        FORECAST_MODEL_FUNCTIONS のモデル名
+    model_kwargs : dict or None
+        予測関数に渡す引数（window, seasonal_periods, m など）
+    target_fiscal_year : int or None
+        予測対象年度（省略時は最新データ日付の年度）
+    max_workers : int or None
+        ワーカー数（1 の場合はプロセスプールを使わない）
+    progress_callback : callable or None
+        progress_callback(進捗率, メッセージ)
+
+    Returns:
+    --------
+    dict or None
+        units, unit_column, model_name, target_fiscal_year, last_date,
+        dates（予測日）, forecast（集計単位 × 予測日、失敗した集計単位は NaN）,
+        annual_summary（集計単位ごとの年度集計の DataFrame）。データがない場合は None
+    """
+    if model_name not in FORECAST_MODEL_FUNCTIONS:
+        raise ValueError(f"未対応の予測モデルです: {model_name}")
+
+    exclude_wards = EXCLUDED_WARDS if unit_column == '病棟コード' else None
+    daily_matrix = build_unit_daily_matrix(df, unit_column, exclude_wards=exclude_wards)
+    if daily_matrix is None:
+        return None
+
+    dates = daily_matrix['dates']
+    last_date = dates[-1]
+    if target_fiscal_year is None:
+        target_fiscal_year = get_fiscal_year_start(last_date).year
+    fiscal_year_end = pd.Timestamp(year=target_fiscal_year + 1, month=3, day=31)
+    horizon = (fiscal_year_end - last_date).days
+    if horizon <= 0:
+        logger.info(f"{target_fiscal_year}年度末までの予測期間がありません")
+        return None
+
+    units = daily_matrix['units']
+    model_kwargs = model_kwargs or {}
+    forecast_dates = pd.date_range(last_date + pd.Timedelta(days=1), periods=horizon, freq='D')
+
+    if model_name in BASELINE_MATRIX_FUNCTIONS:
+        # 閉形式モデル: 最初のデータ日より前を欠損として、全集計単位をまとめて予測する
+        values = daily_matrix['values'].copy()
+        first_positions = daily_matrix['first_positions']
+        values[np.arange(len(dates))[None, :] < first_positions[:, None]] = np.nan
+        forecast = BASELINE_MATRIX_FUNCTIONS[model_name](values, dates, horizon, **model_kwargs)
+        annual_rows = [
+            generate_annual_forecast_summary(
+                pd.Series(values[position, first:], index=dates[first:]),
+                pd.Series(forecast[position], index=forecast_dates),
+                last_date, target_fiscal_year,
+            )
+            for position, first in enumerate(first_positions)
+        ]
+        if progress_callback:
+            progress_callback(1.0, f"予測完了: {len(units)}単位 ({model_name})")
+    else:
+        forecast, annual_rows = _run_unit_forecast_tasks(
+            daily_matrix, unit_column, model_name, model_kwargs, horizon, target_fiscal_year,
+            max_workers, progress_callback,
+        )
+
+    return {
+        'units': units,
+        'unit_column': unit_column,
+        'model_name': model_name,
+        'target_fiscal_year': target_fiscal_year,
+        'last_date': last_date,
+        'dates': forecast_dates,
+        'forecast': forecast,
+        'annual_summary': pd.DataFrame(annual_rows, index=pd.Index(units, name=unit_column), columns=ANNUAL_SUMMARY_COLUMNS),
+    }
@@ -12,6 +12,9 @@ from concurrent.futures import ThreadPoolExecutor
 import concurrent.futures
 import logging
 
+from utils import map_by_unique_values, arrow_strings_enabled, convert_columns_to_arrow_strings
+from config import DATA_TYPE_OPTIMIZATION
+
 # ロギング設定
 logging.basicConfig(
     level=logging.INFO,
@@ -21,7 +24,7 @@ logger = logging.getLogger(__name__)
 
 # --- ここから preprocess.py より移植する関数群 ---
 
-def add_patient_days_calculation(df):
+def add_patient_days_calculation(df, inplace=False):
     """
     延べ在院日数（人日）を計算してデータフレームに追加する
     
@@ -29,13 +32,15 @@ def add_patient_days_calculation(df):
     -----------
     df : pd.DataFrame
         病院データのデータフレーム
+    inplace : bool, default False
+        True の場合はコピーせず df に直接列を追加する
         
     Returns:
     --------
     pd.DataFrame
         延べ在院日数（人日）列が追加されたデータフレーム
     """
-    df_processed = df.copy()
+    df_processed = df if inplace else df.copy()
     
     required_cols = ['入院患者数（在院）', '退院患者数']
     available_cols = [col for col in required_cols if col in df_processed.columns]
@@ -52,8 +57,7 @@ def add_patient_days_calculation(df):
         logger.warning("延べ在院日数の計算に必要な「退院患者数」列が見つかりません。在院患者数のみで計算します。")
         df_processed['延べ在院日数（人日）'] = df_processed['入院患者数（在院）']
     
-    df_processed['延べ在院日数（人日）'] = df_processed['延べ在院日数（人日）'].clip(lower=0)
-    df_processed['延べ在院日数（人日）'] = df_processed['延べ在院日数（人日）'].astype(int)
+    df_processed['延べ在院日数（人日）'] = df_processed['延べ在院日数（人日）'].clip(lower=0).astype(int)
     
     return df_processed
 
@@ -151,9 +155,9 @@ def validate_general_data(df):
             mean = df[col].mean()
             std = df[col].std()
             if pd.notna(std) and std > 0:
-                outliers = df[np.abs(df[col] - mean) > 3 * std]
-                if not outliers.empty:
-                    validation_sub_results["warnings"].append(f"列 '{col}' に外れ値の可能性があるデータが {len(outliers)} 件あります（3標準偏差外）。")
+                outlier_count = int((np.abs(df[col] - mean) > 3 * std).sum())
+                if outlier_count > 0:
+                    validation_sub_results["warnings"].append(f"列 '{col}' に外れ値の可能性があるデータが {outlier_count} 件あります（3標準偏差外）。")
     
     return validation_sub_results
 
@@ -238,7 +242,9 @@ def efficient_duplicate_check(df_raw): # 既存の関数
             logger.warning(f"列 '{col}' の型変換エラー: {e}")
     try:
         mem_before = df_raw.memory_usage(deep=True).sum() / (1024 * 1024)
-        df_processed = df_raw.drop_duplicates()
+        duplicated_mask = df_raw.duplicated()
+        # 重複がなければ行の再構築（全列コピー）を行わずにそのまま返す
+        df_processed = df_raw[~duplicated_mask] if duplicated_mask.any() else df_raw
         mem_after = df_processed.memory_usage(deep=True).sum() / (1024 * 1024)
         rows_dropped = initial_rows - len(df_processed)
         del df_raw
@@ -260,43 +266,52 @@ def efficient_duplicate_check(df_raw): # 既存の関数
         logger.error(f"重複チェック処理エラー: {e}\n{error_detail}")
         return df_raw # Return original if error
 
-def add_weekday_flag(df): # 既存の関数
+def add_weekday_flag(df):
     """
     平日/休日の判定フラグを追加する
+    
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        フラグを追加するデータフレーム
+    
+    Returns:
+    --------
+    pd.DataFrame
+        フラグが追加されたデータフレーム
     """
     def is_holiday(date):
         return (
-            date.weekday() >= 5 or
-            jpholiday.is_holiday(date) or
-            (date.month == 12 and date.day >= 29) or
-            (date.month == 1 and date.day <= 3)
+            date.weekday() >= 5 or  # 土日
+            jpholiday.is_holiday(date) or  # 祝日
+            (date.month == 12 and date.day >= 29) or  # 年末
+            (date.month == 1 and date.day <= 3)  # 年始
         )
-    if '日付' not in df.columns:
-        logger.error("add_weekday_flag: '日付'列が見つかりません。")
-        return df # またはエラーを発生させる
+    
+    # 平日/休日フラグを追加（判定はユニークな日付ごとに一度だけ行う）
+    df["平日判定"] = map_by_unique_values(df["日付"], lambda x: "休日" if is_holiday(x) else "平日")
+    
+    return df
 
-    df_copy = df.copy() # 元のDataFrameを変更しないようにコピー
-    # Ensure '日付' is datetime
-    if not pd.api.types.is_datetime64_any_dtype(df_copy['日付']):
-        df_copy['日付'] = pd.to_datetime(df_copy['日付'], errors='coerce')
-        # Drop rows where date conversion failed
-        df_copy.dropna(subset=['日付'], inplace=True)
 
-    df_copy["平日判定"] = df_copy["日付"].apply(lambda x: "休日" if is_holiday(x) else "平日")
-    return df_copy
+# ===========================================
+# 前処理パイプライン
+# ===========================================
+# integrated_preprocess_data は以下のステージを順番に実行する。
+# 各ステージは (df, context) を受け取り、所有しているデータフレームを直接更新して返す。
+# 行の除外が必要なステージのみ新しいデータフレームを返し、以降はそれが所有フレームとなる。
+# ステージが None を返した場合は致命的エラーとしてパイプラインを中断する。
 
+PREPROCESS_EXPECTED_COLUMNS = [
+    "病棟コード", "診療科名", "日付", "在院患者数",
+    "入院患者数", "緊急入院患者数", "退院患者数", "死亡患者数"
+]
+PREPROCESS_NUMERIC_COLUMNS = [
+    "在院患者数", "入院患者数", "緊急入院患者数", "退院患者数", "死亡患者数"
+]
 
-# --- integrated_preprocess_data 関数の修正箇所 ---
-# @st.cache_data(ttl=3600, show_spinner=False) # キャッシュデコレータは維持
-def integrated_preprocess_data(df: pd.DataFrame, target_data_df: pd.DataFrame = None):
-    start_time = time.time()
-    validation_results = {
-        "is_valid": True,
-        "warnings": [],
-        "errors": [],
-        "info": [],
-        "summaries": {}
-    }
+def _resolve_major_departments(df, target_data_df, validation_results):
+    """目標設定ファイルから主要診療科リストを特定する"""
     major_departments_list = []
     if target_data_df is not None and not target_data_df.empty and '部門コード' in target_data_df.columns:
         potential_major_depts = target_data_df['部門コード'].astype(str).unique()
@@ -304,8 +319,8 @@ def integrated_preprocess_data(df: pd.DataFrame, target_data_df: pd.DataFrame =
             potential_major_depts_from_name = target_data_df['部門名'].astype(str).unique()
             potential_major_depts = np.union1d(potential_major_depts, potential_major_depts_from_name)
 
-        if '診療科名' in df.columns: # df can be None or empty here
-            actual_depts_in_df = df['診療科名'].astype(str).unique() if df is not None and not df.empty else []
+        if df is not None and '診療科名' in df.columns: # df can be None or empty here
+            actual_depts_in_df = df['診療科名'].astype(str).unique() if not df.empty else []
             major_departments_list = [dept for dept in actual_depts_in_df if dept in potential_major_depts]
         
         if not major_departments_list and len(potential_major_depts) > 0:
@@ -318,6 +333,281 @@ def integrated_preprocess_data(df: pd.DataFrame, target_data_df: pd.DataFrame =
              validation_results["warnings"].append("目標設定ファイルから主要診療科リストを特定できませんでした。")
     else:
         validation_results["warnings"].append("目標設定ファイルが提供されなかったか、'部門コード'列がありません。全ての診療科を「その他」として扱います。")
+    return major_departments_list
+
+def _stage_select_columns(df, context):
+    """必要列のみを選択（Copy-on-Write 下では列の参照のみで、データは複製されない）"""
+    available_cols = [col for col in df.columns if col in PREPROCESS_EXPECTED_COLUMNS]
+    return df[available_cols]
+
+def _stage_drop_invalid_rows(df, context):
+    """病棟コード欠損行・無効な日付行を1回の行選択でまとめて除外する"""
+    validation_results = context["validation_results"]
+    if '日付' not in df.columns:
+        validation_results["errors"].append("必須列「日付」が存在しません。")
+        return None
+
+    ward_valid = df['病棟コード'].notna().to_numpy()
+    rows_dropped_due_to_ward_nan = int((~ward_valid).sum())
+    if rows_dropped_due_to_ward_nan > 0:
+        validation_results["warnings"].append(
+            f"「病棟コード」が欠損している行が {rows_dropped_due_to_ward_nan} 件ありました。これらの行は除外されました。"
+        )
+
+    if not pd.api.types.is_datetime64_any_dtype(df['日付']):
+        df['日付'] = pd.to_datetime(df['日付'], errors='coerce')
+    date_valid = df['日付'].notna().to_numpy()
+    rows_dropped_due_to_date_nan = int((ward_valid & ~date_valid).sum())
+    if rows_dropped_due_to_date_nan > 0:
+         validation_results["warnings"].append(
+            f"無効な日付または日付が欠損している行が {rows_dropped_due_to_date_nan} 件ありました。これらの行は除外されました。"
+        )
+
+    keep_mask = ward_valid & date_valid
+    if not keep_mask.all():
+        df = df[keep_mask]
+
+    if df.empty:
+        validation_results["errors"].append("必須の「病棟コード」または「日付」の処理後にデータが空になりました。")
+        return None
+    return df
+
+def _stage_normalize_codes(df, context):
+    """病棟コードの文字列化と、診療科名の主要診療科／その他への集約"""
+    validation_results = context["validation_results"]
+    df["病棟コード"] = map_by_unique_values(df["病棟コード"], str)
+
+    if '診療科名' in df.columns:
+        # ユニークな診療科名ごとに一度だけ判定し、コード配列経由で全行に展開する
+        major_departments_list = context["major_departments"]
+        major_departments_set = set(major_departments_list)
+        df['診療科名'] = map_by_unique_values(
+            df['診療科名'],
+            lambda x: str(x) if str(x) in major_departments_set else 'その他',
+            na_value="空白診療科"
+        )
+        validation_results["info"].append(
+            f"診療科名を主要診療科（{len(major_departments_list)}件）と「その他」に集約しました。「空白」も「その他」に含まれます。"
+        )
+    else:
+        validation_results["warnings"].append("「診療科名」列が存在しないため、診療科集約をスキップしました。")
+    return df
+
+def _stage_drop_duplicates(df, context):
+    """重複行の除外（重複がなければデータフレームはそのまま）"""
+    initial_rows = len(df)
+    df = efficient_duplicate_check(df)
+    rows_dropped_due_to_duplicates = initial_rows - len(df)
+    if rows_dropped_due_to_duplicates > 0:
+        context["validation_results"]["info"].append(
+            f"重複データ {rows_dropped_due_to_duplicates} 行を削除しました"
+        )
+    return df
+
+def _stage_coerce_numeric(df, context):
+    """数値列の型変換と欠損値の0補完（変換・補完が必要な列のみ置き換える）"""
+    validation_results = context["validation_results"]
+    for col in PREPROCESS_NUMERIC_COLUMNS:
+        if col in df.columns:
+            if not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+            na_vals_before_fill = int(df[col].isna().sum())
+            if na_vals_before_fill > 0:
+                df[col] = df[col].fillna(0)
+                validation_results["info"].append(f"数値列'{col}'の欠損値 {na_vals_before_fill} 件を0で補完しました。")
+        else:
+            df[col] = 0
+            validation_results["warnings"].append(f"数値列'{col}'が存在しなかったため、0で補完された列を作成しました。")
+    return df
+
+def _stage_derive_patient_counts(df, context):
+    """在院・総入院・総退院・新入院の派生列を追加（同値の列は参照として共有する）"""
+    validation_results = context["validation_results"]
+    if "在院患者数" in df.columns:
+        # Copy-on-Write 下では同じデータを参照する列として追加され、複製は発生しない
+        df["入院患者数（在院）"] = df["在院患者数"]
+        validation_results["info"].append("「在院患者数」列を「入院患者数（在院）」列として参照追加しました。")
+    elif "入院患者数（在院）" not in df.columns:
+        df["入院患者数（在院）"] = 0
+        validation_results["errors"].append("「在院患者数」または「入院患者数（在院）」列が存在しません。「入院患者数（在院）」を0で作成します。")
+
+    if "入院患者数" in df.columns and "緊急入院患者数" in df.columns:
+        df["総入院患者数"] = df["入院患者数"] + df["緊急入院患者数"]
+    elif "入院患者数" in df.columns:
+         df["総入院患者数"] = df["入院患者数"]
+         validation_results["info"].append("「緊急入院患者数」列がないため、「総入院患者数」は「入院患者数」と同じ値になります。")
+    else:
+        validation_results["warnings"].append("「入院患者数」列がないため、「総入院患者数」は計算できませんでした。0で作成します。")
+        df["総入院患者数"] = 0
+
+    if "退院患者数" in df.columns and "死亡患者数" in df.columns:
+        df["総退院患者数"] = df["退院患者数"] + df["死亡患者数"]
+    elif "退院患者数" in df.columns:
+        df["総退院患者数"] = df["退院患者数"]
+        validation_results["info"].append("「死亡患者数」列がないため、「総退院患者数」は「退院患者数」と同じ値になります。")
+    else:
+        validation_results["warnings"].append("「退院患者数」列がないため、「総退院患者数」は計算できませんでした。0で作成します。")
+        df["総退院患者数"] = 0
+
+    df["新入院患者数"] = df["総入院患者数"]
+    return df
+
+def _stage_patient_days(df, context):
+    """延べ在院日数（人日）の計算"""
+    add_patient_days_calculation(df, inplace=True)
+    context["validation_results"]["info"].append("延べ在院日数（人日）を計算しました。")
+    return df
+
+def _stage_weekday_flag(df, context):
+    """平日/休日フラグの追加"""
+    add_weekday_flag(df)
+    context["validation_results"]["info"].append("平日/休日フラグを追加しました。")
+    return df
+
+def _stage_arrow_strings(df, context):
+    """（オプトイン）病棟コード・診療科名などのコード列を string[pyarrow] 型へ変換する"""
+    if not context.get("arrow_strings", False):
+        return df
+    columns = DATA_TYPE_OPTIMIZATION.get('arrow_string_columns', [])
+    df = convert_columns_to_arrow_strings(df, columns)
+    context["validation_results"]["info"].append(
+        f"コード列を string[pyarrow] 型で保持します: {', '.join(col for col in columns if col in df.columns)}"
+    )
+    return df
+
+def _stage_validate(df, context):
+    """一般的なデータ検証と延べ在院日数の検証（データは変更しない）"""
+    validation_results = context["validation_results"]
+    general_validation_res = validate_general_data(df)
+    validation_results["warnings"].extend(general_validation_res.get("warnings", []))
+    validation_results["errors"].extend(general_validation_res.get("errors", []))
+    
+    patient_days_validation_res = validate_patient_days_data(df)
+    validation_results["warnings"].extend(patient_days_validation_res.get("warnings", []))
+    validation_results["errors"].extend(patient_days_validation_res.get("errors", []))
+    if "summary" in patient_days_validation_res:
+        validation_results["summaries"]["patient_days_summary"] = patient_days_validation_res["summary"]
+    return df
+
+# ステージ定義（実行順）。provides はそのステージ完了後に存在が保証される列
+PREPROCESS_STAGES = [
+    {'name': 'select_columns', 'label': '必要列の選択', 'func': _stage_select_columns, 'provides': []},
+    {'name': 'drop_invalid_rows', 'label': '欠損キー行の除外', 'func': _stage_drop_invalid_rows, 'provides': ['病棟コード', '日付']},
+    {'name': 'normalize_codes', 'label': '病棟・診療科の正規化', 'func': _stage_normalize_codes, 'provides': ['病棟コード']},
+    {'name': 'drop_duplicates', 'label': '重複行の除外', 'func': _stage_drop_duplicates, 'provides': []},
+    {'name': 'coerce_numeric', 'label': '数値列の変換', 'func': _stage_coerce_numeric, 'provides': PREPROCESS_NUMERIC_COLUMNS},
+    {'name': 'derive_patient_counts', 'label': '派生患者数の計算', 'func': _stage_derive_patient_counts,
+     'provides': ['入院患者数（在院）', '総入院患者数', '総退院患者数', '新入院患者数']},
+    {'name': 'patient_days', 'label': '延べ在院日数の計算', 'func': _stage_patient_days, 'provides': ['延べ在院日数（人日）']},
+    {'name': 'weekday_flag', 'label': '平日/休日判定', 'func': _stage_weekday_flag, 'provides': ['平日判定']},
+    {'name': 'arrow_strings', 'label': 'Arrow文字列型への変換', 'func': _stage_arrow_strings, 'provides': []},
+    {'name': 'validate', 'label': 'データ検証', 'func': _stage_validate, 'provides': []},
+]
+
+def _get_process_memory_mb():
+    """現在のプロセスのメモリ使用量（MB）を取得（取得できない場合は None）"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+def _column_buffer(series):
+    """列のデータを保持する numpy 配列（カテゴリ型はコード配列。Arrow 型など変更できない配列は None）"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy()
+    if isinstance(series.dtype, np.dtype):
+        return series.to_numpy()
+    return None
+
+def _detach_from_input(df, input_buffers):
+    """
+    入力データとデータを共有したままの列だけを複製する
+
+    同じデータを参照する列（入院患者数（在院）と在院患者数など）は、複製後も1つの配列を共有させる。
+    """
+    copied = []
+    for col in df.columns:
+        buffer = _column_buffer(df[col])
+        if buffer is None or not any(np.may_share_memory(buffer, source) for source in input_buffers):
+            continue
+        detached = next((series for source, series in copied if source.__array_interface__ == buffer.__array_interface__), None)
+        if detached is None:
+            detached = df[col].copy()
+            copied.append((buffer, detached))
+        df[col] = detached
+    return df
+
+def run_preprocess_pipeline(df, context, stages=None):
+    """
+    前処理ステージを順番に実行し、ステージごとの処理時間とメモリを記録する
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        入力データ（このデータ自体は変更されず、戻り値とデータを共有しない）
+    context : dict
+        ステージ間で共有する情報（validation_results, major_departments など）
+    stages : list or None
+        実行するステージ定義（None の場合は PREPROCESS_STAGES）
+
+    Returns:
+    --------
+    tuple(pd.DataFrame or None, list)
+        前処理後のデータフレーム（中断時は None）と、ステージごとの計測結果
+    """
+    stages = PREPROCESS_STAGES if stages is None else stages
+    stage_metrics = []
+
+    # ステージの間は Copy-on-Write を有効にし、列の選択などを参照で済ませる。
+    # 書き込みが発生した列だけが複製されるため、途中で入力データを丸ごとコピーしない。
+    with pd.option_context("mode.copy_on_write", True):
+        input_buffers = [buffer for buffer in (_column_buffer(df[col]) for col in df.columns) if buffer is not None]
+        for stage in stages:
+            stage_start = time.time()
+            mem_before = _get_process_memory_mb()
+
+            df = stage['func'](df, context)
+
+            mem_after = _get_process_memory_mb()
+            metric = {
+                'stage': stage['name'],
+                'label': stage['label'],
+                'duration_sec': round(time.time() - stage_start, 4),
+                'rows': len(df) if df is not None else 0,
+                'memory_mb': round(mem_after, 1) if mem_after is not None else None,
+                'memory_delta_mb': round(mem_after - mem_before, 1) if mem_after is not None and mem_before is not None else None,
+            }
+            stage_metrics.append(metric)
+            logger.debug(f"前処理ステージ完了: {stage['label']} - 時間: {metric['duration_sec']:.2f}s, 行数: {metric['rows']:,}")
+
+            if df is None:
+                logger.warning(f"前処理ステージ「{stage['label']}」で処理が中断されました。")
+                return None, stage_metrics
+
+            missing_provided = [col for col in stage['provides'] if col not in df.columns]
+            if missing_provided:
+                logger.warning(f"前処理ステージ「{stage['label']}」の後に列が不足しています: {missing_provided}")
+
+        # Copy-on-Write の範囲外でも入力データに書き込まれないよう、
+        # 入力データとデータを共有したままの列（どのステージでも書き換えなかった列）だけを複製する
+        df = _detach_from_input(df, input_buffers)
+
+    return df, stage_metrics
+
+
+# --- integrated_preprocess_data 関数の修正箇所 ---
+# @st.cache_data(ttl=3600, show_spinner=False) # キャッシュデコレータは維持
+def integrated_preprocess_data(df: pd.DataFrame, target_data_df: pd.DataFrame = None):
+    start_time = time.time()
+    validation_results = {
+        "is_valid": True,
+        "warnings": [],
+        "errors": [],
+        "info": [],
+        "summaries": {}
+    }
+    major_departments_list = _resolve_major_departments(df, target_data_df, validation_results)
 
     try:
         if df is None or df.empty:
@@ -325,128 +615,21 @@ def integrated_preprocess_data(df: pd.DataFrame, target_data_df: pd.DataFrame =
             validation_results["errors"].append("入力データが空です。")
             return None, validation_results
 
-        expected_cols = ["病棟コード", "診療科名", "日付", "在院患者数",
-                         "入院患者数", "緊急入院患者数", "退院患者数", "死亡患者数"]
-        available_cols = [col for col in df.columns if col in expected_cols]
-        df_processed = df[available_cols].copy()
-
-        initial_rows = len(df_processed)
-        df_processed.dropna(subset=['病棟コード'], inplace=True) # Ensure '病棟コード' exists
-        rows_dropped_due_to_ward_nan = initial_rows - len(df_processed)
-        if rows_dropped_due_to_ward_nan > 0:
-            validation_results["warnings"].append(
-                f"「病棟コード」が欠損している行が {rows_dropped_due_to_ward_nan} 件ありました。これらの行は除外されました。"
-            )
-        
-        if '日付' not in df_processed.columns:
-            validation_results["is_valid"] = False
-            validation_results["errors"].append("必須列「日付」が存在しません。")
-            return None, validation_results
-            
-        # Ensure '日付' column is datetime before operating on it
-        df_processed['日付'] = pd.to_datetime(df_processed['日付'], errors='coerce')
-        initial_rows = len(df_processed)
-        df_processed.dropna(subset=['日付'], inplace=True)
-        rows_dropped_due_to_date_nan = initial_rows - len(df_processed)
-        if rows_dropped_due_to_date_nan > 0:
-             validation_results["warnings"].append(
-                f"無効な日付または日付が欠損している行が {rows_dropped_due_to_date_nan} 件ありました。これらの行は除外されました。"
-            )
+        context = {
+            "validation_results": validation_results,
+            "major_departments": major_departments_list,
+            "arrow_strings": arrow_strings_enabled(),
+        }
+        df_processed, stage_metrics = run_preprocess_pipeline(df, context)
+        validation_results["summaries"]["stage_metrics"] = stage_metrics
+        if 'st' in globals() and hasattr(st, 'session_state'): # Streamlitコンテキストでのみ実行
+            if 'performance_metrics' not in st.session_state:
+                st.session_state.performance_metrics = {}
+            st.session_state.performance_metrics['preprocess_stages'] = stage_metrics
 
-        if df_processed.empty:
+        if df_processed is None:
             validation_results["is_valid"] = False
-            validation_results["errors"].append("必須の「病棟コード」または「日付」の処理後にデータが空になりました。")
             return None, validation_results
-            
-        df_processed["病棟コード"] = df_processed["病棟コード"].astype(str)
-    
-        if '診療科名' in df_processed.columns:
-            if pd.api.types.is_categorical_dtype(df_processed['診療科名']):
-                df_processed['診療科名'] = df_processed['診療科名'].astype(str).fillna("空白診療科")
-            else:
-                df_processed['診療科名'] = df_processed['診療科名'].fillna("空白診療科").astype(str)
-            
-            df_processed['診療科名'] = df_processed['診療科名'].apply(
-                lambda x: x if x in major_departments_list else 'その他'
-            )
-            validation_results["info"].append(
-                f"診療科名を主要診療科（{len(major_departments_list)}件）と「その他」に集約しました。「空白」も「その他」に含まれます。"
-            )
-        else:
-            validation_results["warnings"].append("「診療科名」列が存在しないため、診療科集約をスキップしました。")
-        
-        initial_rows = len(df_processed)
-        df_processed = efficient_duplicate_check(df_processed)
-        rows_dropped_due_to_duplicates = initial_rows - len(df_processed)
-        
-        if rows_dropped_due_to_duplicates > 0:
-            validation_results["info"].append(
-                f"重複データ {rows_dropped_due_to_duplicates} 行を削除しました"
-            )
-
-        numeric_cols_to_process = [
-            "在院患者数", "入院患者数", "緊急入院患者数", "退院患者数", "死亡患者数"
-        ]
-        for col in numeric_cols_to_process:
-            if col in df_processed.columns:
-                df_processed[col] = pd.to_numeric(df_processed[col], errors='coerce')
-                na_vals_before_fill = df_processed[col].isna().sum()
-                if na_vals_before_fill > 0:
-                    df_processed[col] = df_processed[col].fillna(0)
-                    validation_results["info"].append(f"数値列'{col}'の欠損値 {na_vals_before_fill} 件を0で補完しました。")
-            else:
-                df_processed[col] = 0
-                validation_results["warnings"].append(f"数値列'{col}'が存在しなかったため、0で補完された列を作成しました。")
-
-        if "在院患者数" in df_processed.columns:
-            df_processed["入院患者数（在院）"] = df_processed["在院患者数"].copy()
-            validation_results["info"].append("「在院患者数」列を「入院患者数（在院）」列にコピーしました。")
-        elif "入院患者数（在院）" not in df_processed.columns:
-            df_processed["入院患者数（在院）"] = 0
-            validation_results["errors"].append("「在院患者数」または「入院患者数（在院）」列が存在しません。「入院患者数（在院）」を0で作成します。")
-
-        if "入院患者数" in df_processed.columns and "緊急入院患者数" in df_processed.columns:
-            df_processed["総入院患者数"] = df_processed["入院患者数"] + df_processed["緊急入院患者数"]
-        elif "入院患者数" in df_processed.columns:
-             df_processed["総入院患者数"] = df_processed["入院患者数"]
-             validation_results["info"].append("「緊急入院患者数」列がないため、「総入院患者数」は「入院患者数」と同じ値になります。")
-        else:
-            validation_results["warnings"].append("「入院患者数」列がないため、「総入院患者数」は計算できませんでした。0で作成します。")
-            df_processed["総入院患者数"] = 0
-
-        if "退院患者数" in df_processed.columns and "死亡患者数" in df_processed.columns:
-            df_processed["総退院患者数"] = df_processed["退院患者数"] + df_processed["死亡患者数"]
-        elif "退院患者数" in df_processed.columns:
-            df_processed["総退院患者数"] = df_processed["退院患者数"]
-            validation_results["info"].append("「死亡患者数」列がないため、「総退院患者数」は「退院患者数」と同じ値になります。")
-        else:
-            validation_results["warnings"].append("「退院患者数」列がないため、「総退院患者数」は計算できませんでした。0で作成します。")
-            df_processed["総退院患者数"] = 0
-            
-        if "総入院患者数" in df_processed.columns:
-            df_processed["新入院患者数"] = df_processed["総入院患者数"]
-        else:
-            df_processed["新入院患者数"] = 0
-        
-        # **移植した add_patient_days_calculation を呼び出す**
-        df_processed = add_patient_days_calculation(df_processed) #
-        validation_results["info"].append("延べ在院日数（人日）を計算しました。")
-
-        if '日付' in df_processed.columns: # '日付'列の存在を再確認
-            df_processed = add_weekday_flag(df_processed) #
-            validation_results["info"].append("平日/休日フラグを追加しました。")
-        else:
-            validation_results["errors"].append("「日付」列がないため、平日/休日フラグを追加できません。")
-
-        general_validation_res = validate_general_data(df_processed) #
-        validation_results["warnings"].extend(general_validation_res.get("warnings", []))
-        validation_results["errors"].extend(general_validation_res.get("errors", []))
-        
-        patient_days_validation_res = validate_patient_days_data(df_processed) #
-        validation_results["warnings"].extend(patient_days_validation_res.get("warnings", []))
-        validation_results["errors"].extend(patient_days_validation_res.get("errors", []))
-        if "summary" in patient_days_validation_res:
-            validation_results["summaries"]["patient_days_summary"] = patient_days_validation_res["summary"]
 
         if validation_results["errors"]:
             validation_results["is_valid"] = False
@@ -477,33 +660,6 @@ def integrated_preprocess_data(df: pd.DataFrame, target_data_df: pd.DataFrame =
         validation_results["errors"].append(f"データの前処理中に予期せぬエラーが発生しました: {str(e)}")
         logger.error(f"前処理エラー: {error_detail}")
         return None, validation_results
-
-def add_weekday_flag(df):
-    """
-    平日/休日の判定フラグを追加する
-    
-    Parameters:
-    -----------
-    df : pd.DataFrame
-        フラグを追加するデータフレーム
-    
-    Returns:
-    --------
-    pd.DataFrame
-        フラグが追加されたデータフレーム
-    """
-    def is_holiday(date):
-        return (
-            date.weekday() >= 5 or  # 土日
-            jpholiday.is_holiday(date) or  # 祝日
-            (date.month == 12 and date.day >= 29) or  # 年末
-            (date.month == 1 and date.day <= 3)  # 年始
-        )
-    
-    # 平日/休日フラグを追加
-    df["平日判定"] = df["日付"].apply(lambda x: "休日" if is_holiday(x) else "平日")
-    
-    return df  # この行がインデントされていることを確認
     
 def calculate_file_hash(file_content_bytes):
     """
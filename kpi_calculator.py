@@ -3,6 +3,42 @@ import numpy as np
 import streamlit as st
 import time
 import gc
+import threading
+import weakref
+from collections import OrderedDict
+
+from row_selection import get_row_selection_index, sum_by_day
+from chart_cache import aggregate_version
+
+# 日次集計の列（集計後の列名: 元データの列名）
+DAILY_AGGREGATE_COLUMNS = {
+    '日在院患者数合計': '入院患者数（在院）',
+    '日入院患者数': '入院患者数',
+    '日緊急入院患者数': '緊急入院患者数',
+    '日総入院患者数': '総入院患者数',
+    '日退院患者数': '退院患者数',
+    '日死亡患者数': '死亡患者数',
+    '日総退院患者数': '総退院患者数'
+}
+# 保持する日次集計の数（データ・部門条件の組み合わせごと）
+DAILY_AGGREGATE_CACHE_SIZE = 16
+
+_daily_aggregate_cache = OrderedDict()
+_daily_aggregate_cache_lock = threading.Lock()
+
+# 部門別サマリーで合計する列（サマリーの列名: 元データの列名）
+UNIT_SUMMARY_SUM_COLUMNS = {
+    '延べ在院患者数': '入院患者数（在院）',
+    '総入院患者数': '総入院患者数',
+    '総退院患者数': '総退院患者数',
+    '緊急入院患者数': '緊急入院患者数',
+    '死亡患者数': '死亡患者数',
+}
+# 保持する部門別サマリーの数（データ・フィルター・集計単位の組み合わせごと）
+UNIT_SUMMARY_CACHE_SIZE = 16
+
+_unit_summary_cache = OrderedDict()
+_unit_summary_cache_lock = threading.Lock()
 
 @st.cache_data(ttl=3600, show_spinner=False)
 def calculate_kpis(df, start_date, end_date, total_beds=None):
@@ -31,10 +67,11 @@ def calculate_kpis(df, start_date, end_date, total_beds=None):
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
     
-    # 指定期間のデータをフィルタリング
-    df_filtered = df[(df['日付'] >= start_date) & (df['日付'] <= end_date)].copy()
+    # 指定期間の行位置を取得（中間データフレームは作らない）
+    index = get_row_selection_index(df)
+    positions = index.select(start_date, end_date)
     
-    if df_filtered.empty:
+    if len(positions) == 0:
         # データがない場合は空の結果を返す
         return {
             "error": "指定された期間にデータがありません。"
@@ -43,16 +80,8 @@ def calculate_kpis(df, start_date, end_date, total_beds=None):
     # 日数の計算
     days_count = (end_date - start_date).days + 1
     
-    # 日次の集計
-    daily_stats = df_filtered.groupby('日付').agg(
-        日在院患者数合計=('入院患者数（在院）', 'sum'),
-        日入院患者数=('入院患者数', 'sum'),
-        日緊急入院患者数=('緊急入院患者数', 'sum'),
-        日総入院患者数=('総入院患者数', 'sum'),
-        日退院患者数=('退院患者数', 'sum'),
-        日死亡患者数=('死亡患者数', 'sum'),
-        日総退院患者数=('総退院患者数', 'sum')
-    ).reset_index()
+    # 日次の集計（選択行を日付ごとに直接合計）
+    daily_stats = _sum_daily_columns(df, positions, index)
     
     # 期間合計の計算
     total_patient_days = daily_stats['日在院患者数合計'].sum()  # 期間延べ在院患者数
@@ -83,31 +112,33 @@ def calculate_kpis(df, start_date, end_date, total_beds=None):
     mortality_rate = (total_deaths / total_discharges * 100) if total_discharges > 0 else 0
     
     # 病棟数と診療科数
-    ward_count = df_filtered['病棟コード'].nunique()
-    dept_count = df_filtered['診療科名'].nunique()
-    
-    # 月次集計
-    df_filtered['年月'] = df_filtered['日付'].dt.to_period('M')
-    monthly_stats = df_filtered.groupby('年月').agg(
-        延べ在院患者数=('入院患者数（在院）', 'sum'),
-        総入院患者数=('総入院患者数', 'sum'),
-        総退院患者数=('総退院患者数', 'sum'),
+    ward_count = index.distinct_count('病棟コード', positions)
+    dept_count = index.distinct_count('診療科名', positions)
+    
+    # 月次集計（日次集計から算出）
+    daily_months = daily_stats['日付'].dt.to_period('M').rename('年月')
+    monthly_stats = daily_stats.groupby(daily_months).agg(
+        延べ在院患者数=('日在院患者数合計', 'sum'),
+        総入院患者数=('日総入院患者数', 'sum'),
+        総退院患者数=('日総退院患者数', 'sum'),
         日付数=('日付', 'nunique')
     ).reset_index()
     
     monthly_stats['月'] = monthly_stats['年月'].astype(str)
     
     # 月別の平均在院日数
-    monthly_stats['平均在院日数'] = monthly_stats.apply(
-        lambda row: row['延べ在院患者数'] / ((row['総入院患者数'] + row['総退院患者数']) / 2)
-        if (row['総入院患者数'] + row['総退院患者数']) > 0 else 0,
-        axis=1
+    monthly_alos_denominator = (monthly_stats['総入院患者数'] + monthly_stats['総退院患者数']) / 2
+    monthly_stats['平均在院日数'] = np.where(
+        monthly_alos_denominator > 0,
+        monthly_stats['延べ在院患者数'] / monthly_alos_denominator.where(monthly_alos_denominator > 0, 1),
+        0
     )
     
     # 月別の日平均在院患者数
-    monthly_stats['日平均在院患者数'] = monthly_stats.apply(
-        lambda row: row['延べ在院患者数'] / row['日付数'] if row['日付数'] > 0 else 0,
-        axis=1
+    monthly_stats['日平均在院患者数'] = np.where(
+        monthly_stats['日付数'] > 0,
+        monthly_stats['延べ在院患者数'] / monthly_stats['日付数'].where(monthly_stats['日付数'] > 0, 1),
+        0
     )
     
     # 前月比変化率の計算
@@ -119,30 +150,24 @@ def calculate_kpis(df, start_date, end_date, total_beds=None):
         prev_alos = monthly_stats['平均在院日数'].iloc[-2]
         alos_mom_change = ((current_alos - prev_alos) / prev_alos * 100) if prev_alos != 0 else 0
     
-    # 曜日別集計
-    weekday_data = df_filtered[df_filtered['平日判定'] == '平日']
-    holiday_data = df_filtered[df_filtered['平日判定'] == '休日']
-    
-    weekday_stats = weekday_data.groupby('日付').agg(
-        日在院患者数合計=('入院患者数（在院）', 'sum'),
-        日総入院患者数=('総入院患者数', 'sum'),
-        日総退院患者数=('総退院患者数', 'sum')
-    ).reset_index()
-    
-    holiday_stats = holiday_data.groupby('日付').agg(
-        日在院患者数合計=('入院患者数（在院）', 'sum'),
-        日総入院患者数=('総入院患者数', 'sum'),
-        日総退院患者数=('総退院患者数', 'sum')
-    ).reset_index()
+    # 曜日別集計（平日判定のビットマップで選択行を分割）
+    if '平日判定' in df.columns:
+        weekday_positions = positions[index.value_mask('平日判定', ['平日'])[positions]]
+        holiday_positions = positions[index.value_mask('平日判定', ['休日'])[positions]]
+    else:
+        weekday_positions = holiday_positions = positions[:0]
+    census_column = ['入院患者数（在院）']
+    weekday_stats = sum_by_day(df, weekday_positions, census_column, index=index)
+    holiday_stats = sum_by_day(df, holiday_positions, census_column, index=index)
     
-    weekday_avg_census = weekday_stats['日在院患者数合計'].mean() if not weekday_stats.empty else 0
-    holiday_avg_census = holiday_stats['日在院患者数合計'].mean() if not holiday_stats.empty else 0
+    weekday_avg_census = weekday_stats['入院患者数（在院）'].mean() if not weekday_stats.empty else 0
+    holiday_avg_census = holiday_stats['入院患者数（在院）'].mean() if not holiday_stats.empty else 0
     
     # 週次集計（入退院バランス用）
-    df_filtered['週'] = df_filtered['日付'].dt.to_period('W').astype(str)
-    weekly_stats = df_filtered.groupby('週').agg(
-        週入院患者数=('総入院患者数', 'sum'),
-        週退院患者数=('総退院患者数', 'sum')
+    daily_weeks = daily_stats['日付'].dt.to_period('W').astype(str).rename('週')
+    weekly_stats = daily_stats.groupby(daily_weeks).agg(
+        週入院患者数=('日総入院患者数', 'sum'),
+        週退院患者数=('日総退院患者数', 'sum')
     ).reset_index()
     
     weekly_stats['入退院差'] = weekly_stats['週入院患者数'] - weekly_stats['週退院患者数']
@@ -183,12 +208,299 @@ def calculate_kpis(df, start_date, end_date, total_beds=None):
         "alos_mom_change": alos_mom_change,
         
         # その他
-        "latest_date": df_filtered['日付'].max(),
+        "latest_date": daily_stats['日付'].max(),
         "start_date": start_date,
         "end_date": end_date,
         "processing_time": processing_time
     }
 
+def _sum_daily_columns(df, positions, index):
+    """選択行の日次集計（DAILY_AGGREGATE_COLUMNS の列名で返す）"""
+    daily_sums = sum_by_day(df, positions, list(dict.fromkeys(DAILY_AGGREGATE_COLUMNS.values())), index=index)
+    return pd.DataFrame(
+        {'日付': daily_sums['日付'], **{name: daily_sums[col] for name, col in DAILY_AGGREGATE_COLUMNS.items()}}
+    )
+
+def get_daily_aggregate(df, wards=None, depts=None, exclude_wards=None):
+    """
+    部門条件を適用した全期間の日次集計を取得する（データ・条件ごとにキャッシュ）
+    
+    期間を変えたKPI計算や前年同期比較は、この日次集計を日付で切り出すだけで行える。
+    キャッシュキーは行選択インデックスの aggregate_key（保存データ由来ならバージョン・行の内容）のため、
+    同じフィルター条件で抽出し直したデータフレームでも再計算しない。
+    
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        元のデータフレーム
+    wards, depts : list or None
+        対象の病棟コード・診療科名（None は全て）
+    exclude_wards : list or None
+        除外する病棟コード
+        
+    Returns:
+    --------
+    pd.DataFrame
+        '日付' 列と DAILY_AGGREGATE_COLUMNS の各列（データのある日のみ、日付昇順）。
+        キャッシュを共有するため呼び出し側で変更しないこと。
+    """
+    index = get_row_selection_index(df)
+    aggregate_key = index.aggregate_key()
+    cache_key = (
+        aggregate_key,
+        tuple(sorted(map(str, wards))) if wards is not None else None,
+        tuple(sorted(map(str, depts))) if depts is not None else None,
+        tuple(sorted(map(str, exclude_wards))) if exclude_wards else None,
+    )
+    with _daily_aggregate_cache_lock:
+        entry = _daily_aggregate_cache.get(cache_key)
+        if entry is not None and (aggregate_key[0] == 'version' or entry['index_ref']() is index):
+            _daily_aggregate_cache.move_to_end(cache_key)
+            return entry['daily']
+    
+    positions = index.select(wards=wards, depts=depts, exclude_wards=exclude_wards)
+    daily = _sum_daily_columns(df, positions, index)
+    
+    with _daily_aggregate_cache_lock:
+        _daily_aggregate_cache[cache_key] = {'index_ref': weakref.ref(index), 'daily': daily}
+        _daily_aggregate_cache.move_to_end(cache_key)
+        while len(_daily_aggregate_cache) > DAILY_AGGREGATE_CACHE_SIZE:
+            _daily_aggregate_cache.popitem(last=False)
+    return daily
+
+def summarize_daily_aggregate(daily, start_date, end_date, total_beds=None):
+    """
+    日次集計から指定期間の基本KPIを計算する（日数に比例するコスト）
+    
+    Returns:
+    --------
+    dict
+        calculate_kpis の基本KPI・数量情報と同じキー、および
+        total_new_admissions（入院患者数の期間合計）
+    """
+    start_date = pd.to_datetime(start_date).normalize()
+    end_date = pd.to_datetime(end_date)
+    
+    day_values = daily['日付'].to_numpy()
+    lo = np.searchsorted(day_values, start_date.to_datetime64(), side='left')
+    hi = np.searchsorted(day_values, end_date.to_datetime64(), side='right')
+    if hi <= lo:
+        return {
+            "error": "指定された期間にデータがありません。"
+        }
+    period = daily.iloc[lo:hi]
+    
+    days_count = (end_date.normalize() - start_date).days + 1
+    total_patient_days = period['日在院患者数合計'].sum()
+    total_admissions = period['日総入院患者数'].sum()
+    total_discharges = period['日総退院患者数'].sum()
+    total_emergency_admissions = period['日緊急入院患者数'].sum()
+    total_deaths = period['日死亡患者数'].sum()
+    
+    avg_daily_census = total_patient_days / days_count if days_count > 0 else 0
+    denominator_alos = (total_admissions + total_discharges) / 2
+    
+    bed_occupancy_rate = None
+    if total_beds is not None and total_beds > 0:
+        bed_occupancy_rate = (avg_daily_census / total_beds) * 100
+    
+    return {
+        "avg_daily_census": avg_daily_census,
+        "avg_daily_admissions": total_admissions / days_count if days_count > 0 else 0,
+        "avg_daily_discharges": total_discharges / days_count if days_count > 0 else 0,
+        "alos": total_patient_days / denominator_alos if denominator_alos > 0 else 0,
+        "turnover_rate": total_discharges / avg_daily_census if avg_daily_census > 0 else 0,
+        "bed_occupancy_rate": bed_occupancy_rate,
+        "emergency_admission_rate": (total_emergency_admissions / total_admissions * 100) if total_admissions > 0 else 0,
+        "mortality_rate": (total_deaths / total_discharges * 100) if total_discharges > 0 else 0,
+        "days_count": days_count,
+        "total_patient_days": total_patient_days,
+        "total_admissions": total_admissions,
+        "total_discharges": total_discharges,
+        "total_new_admissions": period['日入院患者数'].sum(),
+        "latest_date": period['日付'].iloc[-1],
+        "start_date": start_date,
+        "end_date": end_date,
+    }
+
+def get_previous_year_period(current_end_date):
+    """
+    前年度同期間（前年度4月1日 ～ 前年の同月日）を返す
+    
+    Returns:
+    --------
+    tuple
+        (開始日, 終了日, 期間説明文)
+    """
+    current_end_date = pd.Timestamp(current_end_date)
+    current_fiscal_year = current_end_date.year if current_end_date.month >= 4 else current_end_date.year - 1
+    prev_start = pd.Timestamp(year=current_fiscal_year - 1, month=4, day=1)
+    try:
+        prev_end = pd.Timestamp(year=current_end_date.year - 1, month=current_end_date.month, day=current_end_date.day)
+    except ValueError:
+        # 2月29日などの特殊ケース対応
+        prev_end = pd.Timestamp(year=current_end_date.year - 1, month=current_end_date.month, day=28)
+    
+    period_days = (prev_end - prev_start).days + 1
+    description = f"{prev_start.strftime('%Y年%m月%d日')} ～ {prev_end.strftime('%Y年%m月%d日')} ({period_days}日間)"
+    return prev_start, prev_end, description
+
+def calculate_yoy_kpis(daily, start_date, end_date, total_beds=None, prior_daily=None):
+    """
+    当期と前年度同期間のKPIを日次集計から1回で計算する
+    
+    Parameters:
+    -----------
+    daily : pd.DataFrame
+        当期の日次集計（get_daily_aggregate の結果）
+    start_date, end_date : str or pd.Timestamp
+        当期の期間
+    total_beds : int or None
+        総病床数
+    prior_daily : pd.DataFrame or None
+        前年度側の日次集計（None の場合は daily を使う）
+        
+    Returns:
+    --------
+    dict
+        current（当期KPI）, previous（前年度同期間KPI、データなしは None）,
+        previous_start, previous_end, previous_period_description
+    """
+    if prior_daily is None:
+        prior_daily = daily
+    
+    current = summarize_daily_aggregate(daily, start_date, end_date, total_beds)
+    prev_start, prev_end, prev_description = get_previous_year_period(end_date)
+    previous = summarize_daily_aggregate(prior_daily, prev_start, prev_end, total_beds)
+    
+    return {
+        "current": current,
+        "previous": None if previous.get("error") else previous,
+        "previous_start": prev_start,
+        "previous_end": prev_end,
+        "previous_period_description": prev_description,
+    }
+
+def _build_unit_summary(df, index, unit_column, exclude_wards):
+    """集計単位ごとの合計・期間日数と派生指標を計算する"""
+    if exclude_wards and '病棟コード' in df.columns:
+        positions = np.flatnonzero(~index.value_mask('病棟コード', exclude_wards))
+    else:
+        positions = np.arange(len(df))
+
+    codes, uniques = index.column_codes(unit_column)
+    row_units = codes[positions]
+    has_unit = row_units >= 0
+    positions = positions[has_unit]
+    row_units = row_units[has_unit]
+
+    # 集計単位の並びは groupby と同じ（カテゴリ型はカテゴリ順、それ以外は値の昇順）
+    used_units = np.unique(row_units)
+    unit_order = used_units[pd.Index(uniques).take(used_units).argsort()]
+    slot_of_unit = np.empty(len(uniques), dtype=np.int64)
+    slot_of_unit[unit_order] = np.arange(len(unit_order))
+    row_slots = slot_of_unit[row_units]
+    n_units = len(unit_order)
+
+    summary = pd.DataFrame({unit_column: pd.Index(uniques).take(unit_order)})
+
+    # 期間日数（集計単位ごとのデータのある日数）
+    valid_dates = index.date_valid[positions]
+    day_codes = index.day_codes[positions][valid_dates]
+    if len(day_codes):
+        first_day = day_codes.min()
+        n_days = int(day_codes.max() - first_day) + 1
+        unit_day_keys = row_slots[valid_dates] * n_days + (day_codes - first_day)
+        has_data = np.bincount(unit_day_keys, minlength=n_units * n_days).reshape(n_units, n_days) > 0
+        summary['期間日数'] = has_data.sum(axis=1).astype(np.int64)
+    else:
+        summary['期間日数'] = np.zeros(n_units, dtype=np.int64)
+
+    for summary_column, source_column in UNIT_SUMMARY_SUM_COLUMNS.items():
+        if source_column not in df.columns:
+            summary[summary_column] = np.zeros(n_units, dtype=np.int64)
+            continue
+        values = df[source_column].to_numpy()[positions]
+        if np.issubdtype(values.dtype, np.integer) or np.issubdtype(values.dtype, np.bool_):
+            sums = np.bincount(row_slots, weights=values.astype(np.float64), minlength=n_units)
+            summary[summary_column] = np.rint(sums).astype(np.int64)
+        else:
+            values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)
+            summary[summary_column] = np.bincount(row_slots, weights=np.nan_to_num(values), minlength=n_units)
+
+    def ratio(numerator, denominator, scale=1.0):
+        numerator = np.asarray(numerator, dtype=np.float64)
+        denominator = np.asarray(denominator, dtype=np.float64)
+        result = np.zeros(len(numerator))
+        np.divide(numerator * scale, denominator, out=result, where=denominator > 0)
+        return result
+
+    patient_days = summary['延べ在院患者数'].to_numpy()
+    admissions = summary['総入院患者数'].to_numpy()
+    discharges = summary['総退院患者数'].to_numpy()
+    summary['平均在院患者数'] = ratio(patient_days, summary['期間日数'].to_numpy())
+    summary['平均在院日数'] = ratio(patient_days, (admissions + discharges) / 2)
+    summary['病床回転率'] = ratio(discharges, summary['平均在院患者数'].to_numpy())
+    summary['緊急入院率'] = ratio(summary['緊急入院患者数'].to_numpy(), admissions, 100)
+    summary['死亡率'] = ratio(summary['死亡患者数'].to_numpy(), discharges, 100)
+
+    start_date, end_date = index.date_bounds()
+    summary.attrs = {
+        'unit_column': unit_column,
+        'start_date': start_date,
+        'end_date': end_date,
+        'summary_version': None,
+    }
+    return summary
+
+def get_unit_summary(df, unit_column, exclude_wards=None):
+    """
+    病棟・診療科ごとのサマリー（合計・期間日数・派生指標）を取得する（データ・フィルターごとにキャッシュ）
+    
+    キャッシュキーは行選択インデックスの aggregate_key（保存データ由来ならバージョン・行の内容）のため、
+    同じフィルター条件での再実行では、抽出し直したデータフレームでも再計算しない。
+    
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        集計対象のデータフレーム（フィルター適用後）
+    unit_column : str
+        集計単位の列名 ('病棟コード', '診療科名')
+    exclude_wards : list or None
+        除外する病棟コード
+        
+    Returns:
+    --------
+    pd.DataFrame
+        集計単位の列, '期間日数', UNIT_SUMMARY_SUM_COLUMNS の各列,
+        '平均在院患者数', '平均在院日数', '病床回転率', '緊急入院率', '死亡率'。
+        分母が 0 の派生指標は 0。attrs に 'unit_column', 'start_date', 'end_date'
+        （データの日付範囲）と 'summary_version'（グラフキャッシュ用の版）を持つ。
+        キャッシュを共有するため呼び出し側で変更しないこと。
+    """
+    index = get_row_selection_index(df)
+    aggregate_key = index.aggregate_key()
+    cache_key = (
+        aggregate_key,
+        unit_column,
+        tuple(sorted(map(str, exclude_wards))) if exclude_wards else None,
+    )
+    with _unit_summary_cache_lock:
+        entry = _unit_summary_cache.get(cache_key)
+        if entry is not None and (aggregate_key[0] == 'version' or entry['index_ref']() is index):
+            _unit_summary_cache.move_to_end(cache_key)
+            return entry['summary']
+    
+    summary = _build_unit_summary(df, index, unit_column, exclude_wards)
+    summary.attrs['summary_version'] = aggregate_version(summary)
+    
+    with _unit_summary_cache_lock:
+        _unit_summary_cache[cache_key] = {'index_ref': weakref.ref(index), 'summary': summary}
+        _unit_summary_cache.move_to_end(cache_key)
+        while len(_unit_summary_cache) > UNIT_SUMMARY_CACHE_SIZE:
+            _unit_summary_cache.popitem(last=False)
+    return summary
+
 def get_kpi_status(value, good_threshold, warning_threshold, reverse=False):
     """
     KPIの状態（良好・注意・警告）を判定する
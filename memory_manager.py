@@ -126,6 +126,8 @@ class MemoryManager:
             
         if 'forecast_model_results' in st.session_state:
             st.session_state.forecast_model_results = None
+        if 'forecast_model_intervals' in st.session_state:
+            st.session_state.forecast_model_intervals = None
             
         # その他の不要な大きなデータを削除
         # テンポラリディレクトリのクリーンアップ
@@ -0,0 +1,170 @@
+# model_store.py - 予測モデルの学習済みパラメータの保存
+"""
+系列（病院全体・診療科・病棟）ごとに、予測モデルの学習済みパラメータを保存する。
+
+新しい日のデータが追加されただけの場合は、保存したパラメータのまま状態を更新し
+（REFIT_UPDATE）、過去のデータが変わった場合は保存したパラメータを初期値にして
+再最適化する（REFIT_WARM）。次数探索・全パラメータの推定（REFIT_FULL）は、
+前回の推定から FORECAST_SETTINGS['model_full_refit_days'] 日分のデータが増えたときだけ行う。
+
+保存先はメモリ上のキャッシュと saved_data/models/ 以下のファイル（モデル・系列ごとに1ファイル）。
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from config import FORECAST_SETTINGS
+from data_persistence import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+MODEL_STORE_DIR = os.path.join(DATA_DIR, "models")
+# メモリ上に保持するモデル数
+MODEL_STORE_CACHE_SIZE = 64
+
+# 再学習の種類
+REFIT_FULL = 'full'      # 次数探索・全パラメータの推定
+REFIT_WARM = 'warm'      # 保存したパラメータを初期値にした再最適化
+REFIT_UPDATE = 'update'  # 保存したパラメータのまま状態だけ更新
+
+_model_cache = OrderedDict()
+_model_cache_lock = threading.Lock()
+
+
+def model_store_enabled():
+    """モデルストアを使うかどうか"""
+    return FORECAST_SETTINGS.get('model_store_enabled', True)
+
+
+def values_hash(values):
+    """系列の値のハッシュ"""
+    return hashlib.sha1(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()
+
+
+def _entry_path(model_name, series_key):
+    """モデル・系列に対応する保存ファイルのパス"""
+    key_hash = hashlib.sha1(repr(series_key).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(MODEL_STORE_DIR, f"{model_name}_{key_hash}.pkl")
+
+
+def load_model_entry(model_name, series_key):
+    """保存済みのモデル（なければ None）"""
+    cache_key = (model_name, repr(series_key))
+    with _model_cache_lock:
+        entry = _model_cache.get(cache_key)
+        if entry is not None:
+            _model_cache.move_to_end(cache_key)
+            return entry
+
+    path = _entry_path(model_name, series_key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+    except Exception as e:
+        logger.warning(f"保存済みモデルの読み込みに失敗しました ({model_name}, {series_key}): {e}")
+        return None
+    if entry.get('series_key') != series_key:
+        return None
+
+    with _model_cache_lock:
+        _model_cache[cache_key] = entry
+        _model_cache.move_to_end(cache_key)
+        while len(_model_cache) > MODEL_STORE_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+    return entry
+
+
+def save_model_entry(model_name, series_key, entry):
+    """モデルをメモリとファイルに保存する（ファイルの書き込みに失敗してもメモリには残す）"""
+    cache_key = (model_name, repr(series_key))
+    with _model_cache_lock:
+        _model_cache[cache_key] = entry
+        _model_cache.move_to_end(cache_key)
+        while len(_model_cache) > MODEL_STORE_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+
+    path = _entry_path(model_name, series_key)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(MODEL_STORE_DIR, exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except Exception as e:
+        logger.warning(f"モデルの保存に失敗しました ({model_name}, {series_key}): {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def clear_model_store(remove_files=False):
+    """メモリ上のモデルを破棄する（remove_files=True の場合は保存ファイルも削除）"""
+    with _model_cache_lock:
+        _model_cache.clear()
+    if remove_files and os.path.isdir(MODEL_STORE_DIR):
+        for filename in os.listdir(MODEL_STORE_DIR):
+            if filename.endswith('.pkl'):
+                os.remove(os.path.join(MODEL_STORE_DIR, filename))
+
+
+def plan_refit(entry, series, model_config, full_refit_days=None):
+    """
+    保存済みのモデルと新しい系列から再学習の種類を決める
+
+    Parameters:
+    -----------
+    entry : dict or None
+        load_model_entry の結果
+    series : pd.Series
+        日付インデックスの系列
+    model_config : dict
+        モデルの設定（季節周期など。保存時と異なる場合は全推定）
+    full_refit_days : int or None
+        全推定の間隔（データの日数）
+
+    Returns:
+    --------
+    str
+        REFIT_FULL, REFIT_WARM, REFIT_UPDATE のいずれか
+    """
+    if entry is None or entry.get('model_config') != model_config:
+        return REFIT_FULL
+    if full_refit_days is None:
+        full_refit_days = FORECAST_SETTINGS.get('model_full_refit_days', 7)
+
+    stored_length = entry['series_length']
+    if len(series) < stored_length or series.index[0] != entry['series_start']:
+        return REFIT_FULL
+    if (series.index[-1] - entry['full_fit_end']).days >= full_refit_days:
+        return REFIT_FULL
+    if values_hash(series.to_numpy()[:stored_length]) == entry['data_hash']:
+        return REFIT_UPDATE
+    return REFIT_WARM
+
+
+def make_model_entry(series_key, series, model_config, params, refit, previous_entry=None):
+    """保存するモデルの辞書を作成（全推定でなければ前回の全推定日を引き継ぐ）"""
+    if refit == REFIT_FULL or previous_entry is None:
+        full_fit_end = series.index[-1]
+    else:
+        full_fit_end = previous_entry['full_fit_end']
+    return {
+        'series_key': series_key,
+        'model_config': model_config,
+        'params': params,
+        'series_start': series.index[0],
+        'series_end': series.index[-1],
+        'series_length': len(series),
+        'data_hash': values_hash(series.to_numpy()),
+        'full_fit_end': pd.Timestamp(full_fit_end),
+        'refit': refit,
+        'fitted_at': time.time(),
+    }
@@ -10,6 +10,9 @@ import gc
 import numpy as np
 import logging
 from config import EXCLUDED_WARDS
+from utils import as_str_series
+from period_calendar import build_period_calendar
+from row_selection import get_row_selection_index, build_unit_daily_cumulative
 
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4, landscape
@@ -481,7 +484,8 @@ def create_pdf(
     target_data=None, filter_code="全体", graph_days=None,
     alos_chart_buffers=None,
     patient_chart_buffers=None,
-    dual_axis_chart_buffers=None
+    dual_axis_chart_buffers=None,
+    department_table_cumulatives=None
 ):
     """PDF生成（最適化版）"""
     pdf_start_time = time.time()
@@ -664,7 +668,8 @@ def create_pdf(
         if chart_data is not None and not chart_data.empty:
             try:
                 ward_table_data, dept_table_data, period_labels = create_department_tables(
-                    chart_data, current_latest_date, target_data, filter_code, None
+                    chart_data, current_latest_date, target_data, filter_code, None,
+                    unit_cumulatives=department_table_cumulatives
                 )
                 
                 # テーブルスタイルの最適化
@@ -741,7 +746,8 @@ def create_landscape_pdf(
     target_data=None, filter_code="全体", graph_days=None,
     alos_chart_buffers=None,
     patient_chart_buffers=None,
-    dual_axis_chart_buffers=None
+    dual_axis_chart_buffers=None,
+    department_table_cumulatives=None
 ):
     """横向きPDF生成（最適化版）"""
     pdf_start_time = time.time()
@@ -972,7 +978,8 @@ def create_landscape_pdf(
         if chart_data is not None and not chart_data.empty:
             try:
                 ward_table_data, dept_table_data, period_labels = create_department_tables(
-                    chart_data, current_latest_date, target_data, filter_code, para_style_normal_center_land
+                    chart_data, current_latest_date, target_data, filter_code, para_style_normal_center_land,
+                    unit_cumulatives=department_table_cumulatives
                 )
                 
                 dept_ward_style_land = [
@@ -1069,51 +1076,86 @@ def create_landscape_pdf(
 # ===========================================
 # 部門別テーブル生成関数（最適化版）
 # ===========================================
-def create_department_tables(chart_data, latest_date, target_data=None, filter_code=None, para_style=None):
-    """部門別テーブル生成（最適化版）"""
+def build_department_table_cumulatives(chart_data, mask=None):
+    """
+    部門別テーブル用の 病棟・診療科 × 日 の累積和を作成する（除外病棟を除く）
+
+    一括PDF生成ではメインプロセスでタスクごとに1回だけ作成し、ワーカーへ渡す。
+
+    Parameters:
+    -----------
+    chart_data : pd.DataFrame
+        集計元のデータ
+    mask : np.ndarray or None
+        対象行のビットマップ（診療科・病棟別PDFの絞り込み条件）
+
+    Returns:
+    --------
+    dict
+        'ward'（病棟コードの文字列表記ごと）・'dept'（診療科名ごと）の UnitDailyCumulative
+        （列がない場合は None）
+    """
+    index = get_row_selection_index(chart_data)
+    exclude_wards = EXCLUDED_WARDS if '病棟コード' in chart_data.columns else None
+    positions = index.select(exclude_wards=exclude_wards, mask=mask)
+    columns = ['入院患者数（在院）']
+    return {
+        'ward': build_unit_daily_cumulative(chart_data, positions, '病棟コード', columns, index=index, by_string=True)
+                if '病棟コード' in chart_data.columns else None,
+        'dept': build_unit_daily_cumulative(chart_data, positions, '診療科名', columns, index=index)
+                if '診療科名' in chart_data.columns else None,
+    }
+
+
+def _period_unit_census(unit_cumulative, period_definitions):
+    """期間ごとの 集計単位 → 平均在院患者数（期間内の延べ在院患者数 / 期間内のデータ日数）"""
+    metrics = {unit: {} for unit in unit_cumulative.units}
+    for period_label, (start_dt_period, end_dt_period) in period_definitions.items():
+        if start_dt_period > end_dt_period:
+            continue
+        num_days_in_period_calc = unit_cumulative.period_total_days(start_dt_period, end_dt_period)
+        if num_days_in_period_calc == 0:
+            continue
+        unit_days = unit_cumulative.period_unit_days(start_dt_period, end_dt_period)
+        if '入院患者数（在院）' in unit_cumulative.columns:
+            patient_days = unit_cumulative.period_sums('入院患者数（在院）', start_dt_period, end_dt_period)
+            averages = np.where(unit_days > 0, patient_days / num_days_in_period_calc, np.nan)
+        else:
+            averages = np.full(len(unit_cumulative.units), np.nan)
+        for unit, average in zip(unit_cumulative.units, averages):
+            metrics[unit][period_label] = average
+    return metrics
+
+
+def create_department_tables(chart_data, latest_date, target_data=None, filter_code=None, para_style=None,
+                             unit_cumulatives=None):
+    """
+    部門別テーブル生成（最適化版）
+
+    各期間の値は 病棟・診療科 × 日 の累積和の差分で求める。unit_cumulatives
+    （build_department_table_cumulatives の結果）を渡した場合はそれを使い、
+    省略した場合は chart_data から作成する。
+    """
     dept_tbl_start_time = time.time()
     
     if chart_data is None or chart_data.empty or latest_date is None:
         return [], [], []
 
-    # データコピーを作成して除外病棟をフィルタリング
-    chart_data_filtered = chart_data.copy()
-    if '病棟コード' in chart_data_filtered.columns and EXCLUDED_WARDS:
-        original_count = len(chart_data_filtered)
-        chart_data_filtered = chart_data_filtered[~chart_data_filtered['病棟コード'].isin(EXCLUDED_WARDS)]
-        removed_count = original_count - len(chart_data_filtered)
-        if removed_count > 0:
-            logger.debug(f"部門別テーブル: 除外病棟フィルタリングで{removed_count}件のレコードを除外")
-    
-    # 日付処理の最適化
-    if not pd.api.types.is_datetime64_any_dtype(chart_data_filtered['日付']):
-        try: 
-            chart_data_filtered['日付'] = pd.to_datetime(chart_data_filtered['日付'])
-        except Exception: 
-            return [], [], []
+    if unit_cumulatives is None:
+        unit_cumulatives = build_department_table_cumulatives(chart_data)
     
     if not isinstance(latest_date, pd.Timestamp): 
         latest_date = pd.Timestamp(latest_date)
 
-    # 期間定義の最適化
-    current_year_start_month = 4
-    if latest_date.month < current_year_start_month:
-        current_fiscal_year_start = pd.Timestamp(year=latest_date.year - 1, month=current_year_start_month, day=1)
-    else:
-        current_fiscal_year_start = pd.Timestamp(year=latest_date.year, month=current_year_start_month, day=1)
-    
-    current_fiscal_year_end_for_data = latest_date
-    previous_fiscal_year_start = current_fiscal_year_start - pd.DateOffset(years=1)
-    previous_fiscal_year_end = current_fiscal_year_start - pd.Timedelta(days=1)
-
+    # 期間定義（期間カレンダーから取得）
+    calendar_periods = build_period_calendar(latest_date.normalize())
     period_definitions = {
-        "直近7日": (latest_date - pd.Timedelta(days=6), latest_date),
-        "直近14日": (latest_date - pd.Timedelta(days=13), latest_date),
-        "直近30日": (latest_date - pd.Timedelta(days=29), latest_date),
-        "直近60日": (latest_date - pd.Timedelta(days=59), latest_date),
-        f"{current_fiscal_year_start.year}年度": (current_fiscal_year_start, current_fiscal_year_end_for_data),
-        f"{previous_fiscal_year_start.year}年度": (previous_fiscal_year_start, previous_fiscal_year_end),
+        label: (calendar_periods[label]['start'], calendar_periods[label]['end'])
+        for label in ("直近7日", "直近14日", "直近30日", "直近60日")
     }
+    for fiscal_label in ("今年度", "昨年度"):
+        fiscal_period = calendar_periods[fiscal_label]
+        period_definitions[f"{fiscal_period['fiscal_year']}年度"] = (fiscal_period['start'], fiscal_period['end'])
     
     period_labels_for_data = list(period_definitions.keys())
     period_name_for_achievement = "直近30日"
@@ -1138,25 +1180,29 @@ def create_department_tables(chart_data, latest_date, target_data=None, filter_c
         period_labels_for_header.append(Paragraph(formatted_label, para_style))
 
     # ユニークな病棟・診療科の取得（除外病棟適用済み）
+    ward_cumulative = unit_cumulatives.get('ward')
+    dept_cumulative = unit_cumulatives.get('dept')
     ward_codes_unique = []
-    if "病棟コード" in chart_data_filtered.columns:
-        ward_codes_unique = sorted(chart_data_filtered["病棟コード"].astype(str).unique())
+    if ward_cumulative is not None:
+        ward_codes_unique = sorted(ward_cumulative.units)
         # 除外病棟を再度フィルタリング（念のため）
         if EXCLUDED_WARDS:
             ward_codes_unique = [ward for ward in ward_codes_unique if ward not in EXCLUDED_WARDS]
     
-    dept_names_to_process = []
-    if "診療科名" in chart_data_filtered.columns:
-        dept_names_to_process = sorted(chart_data_filtered["診療科名"].unique())
+    dept_names_to_process = sorted(dept_cumulative.units) if dept_cumulative is not None else []
     
-    # 表示名マッピングの最適化
+    # 表示名マッピング（目標値データの部門コードごとの最初の行の部門名）
     ward_display_names = {}
+    has_target_names = target_data is not None and not target_data.empty and '部門コード' in target_data.columns and '部門名' in target_data.columns
+    target_names_by_code = {}
+    if has_target_names:
+        target_names = pd.Series(target_data['部門名'].to_numpy(), index=as_str_series(target_data['部門コード']).to_numpy())
+        target_names_by_code = target_names[~target_names.index.duplicated(keep='first')].to_dict()
     for ward_code in ward_codes_unique:
-        if target_data is not None and not target_data.empty and '部門コード' in target_data.columns and '部門名' in target_data.columns:
-            target_row = target_data[target_data['部門コード'].astype(str) == ward_code]
-            if not target_row.empty and pd.notna(target_row['部門名'].iloc[0]):
-                ward_display_names[ward_code] = target_row['部門名'].iloc[0]
-                continue
+        target_name = target_names_by_code.get(ward_code)
+        if target_name is not None and pd.notna(target_name):
+            ward_display_names[ward_code] = target_name
+            continue
         
         # デフォルトの表示名生成
         match = re.match(r'0*(\d+)([A-Za-z]*)', ward_code)
@@ -1165,82 +1211,45 @@ def create_department_tables(chart_data, latest_date, target_data=None, filter_c
         else:
             ward_display_names[ward_code] = ward_code
 
-    # メトリクス計算の最適化
+    # メトリクス計算（累積和の差分で全部門・全期間を計算）
     ward_metrics = {ward_code: {} for ward_code in ward_codes_unique}
     dept_metrics = {dept_name: {} for dept_name in dept_names_to_process}
-
-    for period_label, (start_dt_period, end_dt_period) in period_definitions.items():
-        if start_dt_period > end_dt_period:
-            continue
-            
-        period_data_df = chart_data_filtered[
-            (chart_data_filtered["日付"] >= start_dt_period) & 
-            (chart_data_filtered["日付"] <= end_dt_period)
-        ]
-        
-        if period_data_df.empty:
-            continue
-            
-        num_days_in_period_calc = period_data_df['日付'].nunique()
-        if num_days_in_period_calc == 0:
-            continue
-            
-        # 病棟別メトリクス計算
-        for ward_code in ward_codes_unique:
-            ward_data_df = period_data_df[period_data_df["病棟コード"].astype(str) == ward_code]
-            if not ward_data_df.empty and '入院患者数（在院）' in ward_data_df.columns:
-                total_patient_days_val = ward_data_df.groupby('日付')['入院患者数（在院）'].sum().sum()
-                avg_daily_census_val = total_patient_days_val / num_days_in_period_calc if num_days_in_period_calc > 0 else np.nan
-                ward_metrics[ward_code][period_label] = avg_daily_census_val
-            else:
-                ward_metrics[ward_code][period_label] = np.nan
-
-        # 診療科別メトリクス計算
-        for dept_name in dept_names_to_process:
-            dept_data_df = period_data_df[period_data_df["診療科名"] == dept_name]
-            if not dept_data_df.empty and '入院患者数（在院）' in dept_data_df.columns:
-                total_patient_days_val = dept_data_df.groupby('日付')['入院患者数（在院）'].sum().sum()
-                avg_daily_census_val = total_patient_days_val / num_days_in_period_calc if num_days_in_period_calc > 0 else np.nan
-                dept_metrics[dept_name][period_label] = avg_daily_census_val
-            else:
-                dept_metrics[dept_name][period_label] = np.nan
+    if ward_cumulative is not None:
+        ward_metrics.update({
+            ward_code: values for ward_code, values in _period_unit_census(ward_cumulative, period_definitions).items()
+            if ward_code in ward_metrics
+        })
+    if dept_cumulative is not None:
+        dept_metrics.update(_period_unit_census(dept_cumulative, period_definitions))
     
-    # 目標値・達成率計算の最適化
-    target_dict_cache_local = {}
+    # 目標値・達成率計算（共有の目標値データは変更しない）
+    all_targets_map_local = {}
+    if target_data is not None and not target_data.empty and \
+            all(col in target_data.columns for col in ['部門コード', '区分', '目標値']):
+        all_day_rows = (target_data['区分'] == '全日').to_numpy() & target_data['目標値'].notna().to_numpy()
+        target_codes_str = as_str_series(target_data['部門コード']).to_numpy(dtype=object)
+        all_targets_map_local = dict(zip(
+            target_codes_str[all_day_rows],
+            target_data['目標値'].to_numpy()[all_day_rows].astype(float)
+        ))
     
-    def get_targets_achievements(items, metrics_dict, target_data_df, achievement_period=period_name_for_achievement):
+    def get_targets_achievements(items, metrics_dict, achievement_period=period_name_for_achievement):
         targets = {}
         achievements = {}
-        
-        if target_data_df is not None and not target_data_df.empty:
-            required_cols = ['部門コード', '区分', '目標値']
-            if all(col in target_data_df.columns for col in required_cols):
-                target_data_df['部門コード'] = target_data_df['部門コード'].astype(str)
-                
-                if 'all_targets' not in target_dict_cache_local:
-                    all_targets_map_local = {}
-                    for _, row in target_data_df[target_data_df['区分'] == '全日'].iterrows():
-                        if pd.notna(row.get('部門コード')) and pd.notna(row.get('目標値')):
-                            all_targets_map_local[str(row['部門コード'])] = float(row['目標値'])
-                    target_dict_cache_local['all_targets'] = all_targets_map_local
-                
-                all_targets_map_local = target_dict_cache_local.get('all_targets', {})
+        for item_id_val in items:
+            target_value_val = all_targets_map_local.get(str(item_id_val))
+            
+            if target_value_val is not None:
+                targets[item_id_val] = target_value_val
+                actual_value_val = metrics_dict.get(item_id_val, {}).get(achievement_period)
                 
-                for item_id_val in items:
-                    item_id_str_val = str(item_id_val)
-                    target_value_val = all_targets_map_local.get(item_id_str_val)
-                    
-                    if target_value_val is not None:
-                        targets[item_id_val] = target_value_val
-                        actual_value_val = metrics_dict.get(item_id_val, {}).get(achievement_period)
-                        
-                        if actual_value_val is not None and pd.notna(actual_value_val) and target_value_val > 0:
-                            achievements[item_id_val] = (actual_value_val / target_value_val) * 100
+                if actual_value_val is not None and pd.notna(actual_value_val) and target_value_val > 0:
+                    achievements[item_id_val] = (actual_value_val / target_value_val) * 100
         
         return targets, achievements
 
-    ward_targets, ward_achievements = get_targets_achievements(ward_codes_unique, ward_metrics, target_data)
-    dept_targets, dept_achievements = get_targets_achievements(dept_names_to_process, dept_metrics, target_data)
+    ward_targets, ward_achievements = get_targets_achievements(ward_codes_unique, ward_metrics)
+    dept_targets, dept_achievements = get_targets_achievements(dept_names_to_process, dept_metrics)
     
     # ソート関数の最適化
     def sort_entities(entities_list, achievements_ref_dict, targets_ref_dict):
@@ -0,0 +1,271 @@
+# period_calendar.py - 期間プリセット（カレンダー）サービス
+"""
+直近N週・先月・今年度・昨年度・直近N日などの集計期間を、基準日（最新データ日付）ごとに
+1回だけ計算して共有する。各期間には暦日数と平日・休日の日数を含める。
+
+休日判定は前処理の '平日判定' と同じ定義（土日・祝日・年末年始）をベクトル化したもの。
+"""
+import logging
+
+import jpholiday
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from data_persistence import get_manifest_for_df
+from row_selection import get_row_selection_index
+
+logger = logging.getLogger(__name__)
+
+# 年度の開始月
+FISCAL_YEAR_START_MONTH = 4
+
+# 直近N日の期間（ラベル: 日数）
+RECENT_DAY_WINDOWS = {
+    "直近7日": 7,
+    "直近14日": 14,
+    "直近30日": 30,
+    "直近60日": 60,
+}
+# 直近N週の期間（ラベル: (週数, 説明文の接頭辞)）
+RECENT_WEEK_WINDOWS = {
+    "直近4週間": (4, "直近4週間"),
+    "直近8週": (8, "直近8週間"),
+    "直近12週": (12, "直近12週間"),
+}
+# 統一フィルターのプリセット（ラベル: 日数）
+FILTER_PRESET_WINDOWS = {
+    "直近1ヶ月": 30,
+    "直近3ヶ月": 90,
+    "直近6ヶ月": 180,
+    "直近12ヶ月": 365,
+}
+
+
+def get_fiscal_year_start(reference_date):
+    """指定日の属する年度の開始日（4月1日）"""
+    year = reference_date.year if reference_date.month >= FISCAL_YEAR_START_MONTH else reference_date.year - 1
+    return pd.Timestamp(year=year, month=FISCAL_YEAR_START_MONTH, day=1)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _japanese_holidays(year):
+    """指定年の祝日（datetime64[D] 配列）"""
+    return np.array([d for d, _ in jpholiday.year_holidays(year)], dtype='datetime64[D]')
+
+
+def holiday_flags(dates):
+    """
+    日付ごとの休日フラグ（土日・祝日・年末年始）をまとめて判定する
+
+    Parameters:
+    -----------
+    dates : array-like of datetime
+        判定する日付
+
+    Returns:
+    --------
+    np.ndarray
+        休日なら True の bool 配列
+    """
+    dates = pd.DatetimeIndex(dates).normalize()
+    if len(dates) == 0:
+        return np.zeros(0, dtype=bool)
+
+    day_values = dates.values.astype('datetime64[D]')
+    flags = dates.dayofweek.values >= 5
+    month = dates.month.values
+    day = dates.day.values
+    flags |= (month == 12) & (day >= 29)
+    flags |= (month == 1) & (day <= 3)
+
+    years = range(int(dates.year.min()), int(dates.year.max()) + 1)
+    holidays = np.concatenate([_japanese_holidays(year) for year in years])
+    flags |= np.isin(day_values, holidays)
+    return flags
+
+
+def _make_window(label, start, end, min_date, description, holiday_counts, calendar_start):
+    """期間の辞書を作成（暦日数・平日数・休日数、データ範囲に収めた開始・終了日を含む）"""
+    start = pd.Timestamp(start).normalize()
+    end = pd.Timestamp(end).normalize()
+    days = (end - start).days + 1
+    first = (start - calendar_start).days
+    holiday_days = int(holiday_counts[first + days] - holiday_counts[first]) if days > 0 else 0
+    return {
+        'label': label,
+        'start': start,
+        'end': end,
+        'data_start': max(start, min_date) if min_date is not None else start,
+        'data_end': end,
+        'days': days,
+        'weekday_days': days - holiday_days,
+        'holiday_days': holiday_days,
+        'description': description,
+    }
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_period_calendar(max_date, min_date=None):
+    """
+    基準日（最新データ日付）から全ての期間プリセットを計算する（基準日ごとに1回）
+
+    Parameters:
+    -----------
+    max_date : pd.Timestamp
+        基準日（最新データ日付）
+    min_date : pd.Timestamp or None
+        データの最小日付（data_start をこの日付以降に収める）
+
+    Returns:
+    --------
+    dict
+        ラベル → 期間の辞書（start, end, data_start, data_end, days,
+        weekday_days, holiday_days, description）。
+        '今年度'・'昨年度' は 'fiscal_year'（年度）も持つ
+    """
+    max_date = pd.Timestamp(max_date).normalize()
+    min_date = pd.Timestamp(min_date).normalize() if min_date is not None else None
+
+    fiscal_start = get_fiscal_year_start(max_date)
+    prev_fiscal_start = fiscal_start - pd.DateOffset(years=1)
+    prev_fiscal_end = fiscal_start - pd.Timedelta(days=1)
+    last_month_end = max_date.replace(day=1) - pd.Timedelta(days=1)
+    last_month_start = last_month_end.replace(day=1)
+
+    # 期間全体の休日数の累積和（各期間の平日・休日数を O(1) で求める）
+    calendar_start = min(prev_fiscal_start, max_date - pd.Timedelta(days=max(FILTER_PRESET_WINDOWS.values())))
+    if min_date is not None:
+        calendar_start = min(calendar_start, min_date)
+    calendar_days = pd.date_range(calendar_start, fiscal_start + pd.DateOffset(years=1), freq='D')
+    holiday_counts = np.concatenate([[0], np.cumsum(holiday_flags(calendar_days))])
+
+    def window(label, start, end, description):
+        return _make_window(label, start, end, min_date, description, holiday_counts, calendar_start)
+
+    def clip(timestamp):
+        return max(timestamp, min_date) if min_date is not None else timestamp
+
+    periods = {}
+    for label, n_days in RECENT_DAY_WINDOWS.items():
+        start = max_date - pd.Timedelta(days=n_days - 1)
+        periods[label] = window(label, start, max_date, f"{label} ({start.strftime('%m/%d')}～{max_date.strftime('%m/%d')})")
+
+    for label, (n_weeks, desc_prefix) in RECENT_WEEK_WINDOWS.items():
+        start = max_date - pd.Timedelta(days=n_weeks * 7 - 1)
+        periods[label] = window(label, start, max_date, f"{desc_prefix} ({start.strftime('%m/%d')}～{max_date.strftime('%m/%d')})")
+
+    for label, n_days in FILTER_PRESET_WINDOWS.items():
+        start = max_date - pd.Timedelta(days=n_days - 1)
+        periods[label] = window(label, start, max_date, f"{label} ({start.strftime('%Y/%m/%d')}～{max_date.strftime('%Y/%m/%d')})")
+
+    # 先月（最新データの前月、データ範囲内に収める）
+    last_month_data_end = min(last_month_end, max_date)
+    periods["先月"] = window(
+        "先月", last_month_start, last_month_end,
+        f"{last_month_start.year}年{last_month_start.month}月 "
+        f"({clip(last_month_start).strftime('%m/%d')}～{last_month_data_end.strftime('%m/%d')})"
+    )
+
+    # 今年度（4月1日 ～ 最新データ日付）
+    periods["今年度"] = window(
+        "今年度", fiscal_start, max_date,
+        f"今年度 ({fiscal_start.strftime('%Y/%m/%d')}～{max_date.strftime('%m/%d')})"
+    )
+    periods["今年度"]['fiscal_year'] = fiscal_start.year
+
+    # 昨年度（前年度4月1日 ～ 3月31日）
+    periods["昨年度"] = window(
+        "昨年度", prev_fiscal_start, prev_fiscal_end,
+        f"{prev_fiscal_start.year}年度 ({clip(prev_fiscal_start).strftime('%Y/%m/%d')}～{prev_fiscal_end.strftime('%Y/%m/%d')})"
+    )
+    periods["昨年度"]['fiscal_year'] = prev_fiscal_start.year
+
+    if min_date is not None:
+        periods["全期間"] = window(
+            "全期間", min_date, max_date,
+            f"全期間 ({min_date.strftime('%Y/%m/%d')}～{max_date.strftime('%Y/%m/%d')})"
+        )
+
+    logger.debug(f"期間カレンダーを作成しました: 基準日 {max_date.date()}, {len(periods)}期間")
+    return periods
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_forecast_horizon(reference_date):
+    """
+    基準日（最新データ日付）の翌日から年度末までの予測期間を計算する（基準日ごとに1回）
+
+    年度は基準日から求めるため、年度が替わっても日付を書き換える必要はない。
+
+    Parameters:
+    -----------
+    reference_date : pd.Timestamp
+        基準日（最新データ日付）
+
+    Returns:
+    --------
+    dict
+        fiscal_year（年度）, fiscal_start, fiscal_end, forecast_start,
+        elapsed_days（年度初めから基準日までの日数）, total_days（年度の日数）,
+        remaining_days, remaining_weekdays, remaining_holidays（予測期間の日数・平日数・休日数）
+    """
+    reference_date = pd.Timestamp(reference_date).normalize()
+    fiscal_start = get_fiscal_year_start(reference_date)
+    fiscal_end = fiscal_start + pd.DateOffset(years=1) - pd.Timedelta(days=1)
+    forecast_start = reference_date + pd.Timedelta(days=1)
+
+    remaining_holidays = int(holiday_flags(pd.date_range(forecast_start, fiscal_end, freq='D')).sum())
+    remaining_days = max((fiscal_end - reference_date).days, 0)
+    return {
+        'fiscal_year': fiscal_start.year,
+        'fiscal_start': fiscal_start,
+        'fiscal_end': fiscal_end,
+        'forecast_start': forecast_start,
+        'elapsed_days': (reference_date - fiscal_start).days + 1,
+        'total_days': (fiscal_end - fiscal_start).days + 1,
+        'remaining_days': remaining_days,
+        'remaining_weekdays': remaining_days - remaining_holidays,
+        'remaining_holidays': remaining_holidays,
+    }
+
+
+def get_data_date_bounds(df):
+    """
+    データの最小・最大日付（保存データならマニフェスト、それ以外は行選択インデックスから取得）
+
+    Returns:
+    --------
+    tuple
+        (最小日付, 最大日付)。日付がない場合は (None, None)
+    """
+    if df is None or df.empty or '日付' not in df.columns:
+        return None, None
+
+    manifest = get_manifest_for_df(df)
+    date_range = manifest.get('date_range', {}) if manifest else {}
+    if date_range.get('min_date') and date_range.get('max_date'):
+        return pd.Timestamp(date_range['min_date']), pd.Timestamp(date_range['max_date'])
+
+    return get_row_selection_index(df).date_bounds()
+
+
+def get_period_calendar(df):
+    """データの日付範囲に対応する期間カレンダー（データバージョンごとに1回だけ計算）"""
+    min_date, max_date = get_data_date_bounds(df)
+    if max_date is None:
+        return {}
+    return build_period_calendar(max_date.normalize(), min_date.normalize())
+
+
+def get_fiscal_year_periods(latest_date):
+    """
+    基準日の今年度（4月1日 ～ 基準日）と前年度（4月1日 ～ 3月31日）の期間
+
+    Returns:
+    --------
+    tuple
+        (今年度の期間, 前年度の期間)
+    """
+    periods = build_period_calendar(pd.Timestamp(latest_date).normalize())
+    return periods["今年度"], periods["昨年度"]
@@ -0,0 +1,296 @@
+# row_selection.py - 行選択インデックスと集計カーネル
+"""
+病棟・診療科・日付ごとの行位置を事前計算し、フィルター条件をビット演算で組み合わせる。
+
+フィルターのたびに中間データフレームを作らず、行位置（選択）だけを受け渡し、
+集計は (データフレーム, 選択) を受け取るカーネルで直接行う。
+"""
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+NS_PER_DAY = 86_400_000_000_000
+# 保持するインデックス数（データバージョン・データフレームごと）
+ROW_SELECTION_INDEX_CACHE_SIZE = 8
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+class RowSelectionIndex:
+    """行選択インデックス（列ごとのコード配列と日付値を保持）"""
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+        self._df_ref = weakref.ref(df)
+        self._column_codes = {}
+        self._unit_positions = {}
+        self._aggregate_key = None
+
+        dates = df['日付'] if '日付' in df.columns else pd.Series(pd.NaT, index=df.index)
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, errors='coerce')
+        date_values = dates.to_numpy(dtype='datetime64[ns]')
+        self.date_valid = ~np.isnat(date_values)
+        self.date_ns = date_values.view('int64')
+        # 日単位のコード（1970-01-01 からの日数）
+        self.day_codes = np.floor_divide(self.date_ns, NS_PER_DAY)
+
+    def aggregate_key(self):
+        """
+        集計結果のキャッシュキー
+
+        保存データ（attrs['data_version'] あり）から抽出したデータフレームは、バージョン・行ラベル・日付・列から
+        キーを作るため、再実行ごとに抽出し直したデータフレームでも同じ行なら同じキーになる。
+        それ以外はインデックス単位のキー（('object', id)。キャッシュ側でインデックスの同一性も確認する）。
+        """
+        if self._aggregate_key is None:
+            df = self._df_ref()
+            data_version = df.attrs.get('data_version') if df is not None else None
+            if data_version:
+                digest = hashlib.sha1(pd.util.hash_pandas_object(df.index, index=False).to_numpy().tobytes())
+                digest.update(self.date_ns.tobytes())
+                digest.update(repr(tuple(df.columns)).encode('utf-8'))
+                self._aggregate_key = ('version', data_version, self.n_rows, digest.hexdigest())
+            else:
+                self._aggregate_key = ('object', id(self))
+        return self._aggregate_key
+
+    def date_bounds(self):
+        """有効な日付の最小・最大値（日付がない場合は (None, None)）"""
+        if not hasattr(self, '_date_bounds'):
+            valid_ns = self.date_ns[self.date_valid]
+            if len(valid_ns) == 0:
+                self._date_bounds = (None, None)
+            else:
+                self._date_bounds = (pd.Timestamp(int(valid_ns.min())), pd.Timestamp(int(valid_ns.max())))
+        return self._date_bounds
+
+    def _codes(self, column):
+        """列の値を factorize したコード配列と一意値（列ごとに1回だけ計算）"""
+        if column not in self._column_codes:
+            df = self._df_ref()
+            if df is None:
+                raise RuntimeError("RowSelectionIndex: 元のデータフレームが解放されています")
+            codes, uniques = pd.factorize(df[column])
+            self._column_codes[column] = (codes, pd.Index(uniques))
+        return self._column_codes[column]
+
+    def column_codes(self, column):
+        """列のコード配列（欠損値は -1）と一意値"""
+        return self._codes(column)
+
+    def date_mask(self, start_date=None, end_date=None):
+        """日付範囲のビットマップ（開始日・終了日を含む）"""
+        mask = self.date_valid.copy()
+        if start_date is not None:
+            mask &= self.date_ns >= pd.Timestamp(start_date).value
+        if end_date is not None:
+            mask &= self.date_ns <= pd.Timestamp(end_date).value
+        return mask
+
+    def value_mask(self, column, values):
+        """指定列が values のいずれかに一致する行のビットマップ（isin と同じ判定）"""
+        codes, uniques = self._codes(column)
+        selected = np.zeros(len(uniques) + 1, dtype=bool)  # 末尾は欠損値（コード -1）用
+        indexer = uniques.get_indexer(pd.Index(list(values)))
+        selected[indexer[indexer >= 0]] = True
+        return selected[codes]
+
+    def unit_positions(self, column, value):
+        """指定列の値ごとの行位置（昇順）"""
+        key = (column, value)
+        if key not in self._unit_positions:
+            codes, uniques = self._codes(column)
+            loc = uniques.get_indexer([value])[0]
+            self._unit_positions[key] = np.flatnonzero(codes == loc) if loc >= 0 else np.empty(0, dtype=np.int64)
+        return self._unit_positions[key]
+
+    def distinct_count(self, column, positions):
+        """選択行に含まれる一意値の数（欠損値を除く）"""
+        codes, uniques = self._codes(column)
+        present = np.bincount(codes[positions] + 1, minlength=len(uniques) + 1)[1:]
+        return int(np.count_nonzero(present))
+
+    def select(self, start_date=None, end_date=None, wards=None, depts=None, exclude_wards=None, mask=None):
+        """条件をビット演算で組み合わせて行位置を返す"""
+        combined = self.date_mask(start_date, end_date)
+        if wards is not None:
+            combined &= self.value_mask('病棟コード', wards)
+        if depts is not None:
+            combined &= self.value_mask('診療科名', depts)
+        if exclude_wards:
+            combined &= ~self.value_mask('病棟コード', exclude_wards)
+        if mask is not None:
+            combined &= mask
+        return np.flatnonzero(combined)
+
+
+def _date_buffer_address(df):
+    """日付列のデータバッファのアドレス（浅いコピー同士は同じ値になる）"""
+    if '日付' not in df.columns:
+        return None
+    return df['日付'].to_numpy().__array_interface__['data'][0]
+
+
+def get_row_selection_index(df):
+    """データフレームに対応する行選択インデックスを取得（なければ作成）
+
+    保存データ（df.attrs['data_version'] あり）はバージョン単位で全セッションが共有し、
+    それ以外はデータフレームのオブジェクト単位でキャッシュする。
+    attrs は抽出後のデータフレームにも引き継がれるため、バージョン単位のキーには
+    日付列のバッファも含め、同じ行数の別の抽出結果と取り違えないようにする
+    （日付列がない場合はオブジェクト単位）。
+    """
+    data_version = df.attrs.get('data_version') if hasattr(df, 'attrs') else None
+    date_buffer = _date_buffer_address(df) if data_version else None
+    if date_buffer is not None:
+        cache_key = ('version', data_version, len(df), date_buffer)
+    else:
+        data_version = None
+        cache_key = ('object', id(df), len(df))
+
+    with _index_cache_lock:
+        index = _index_cache.get(cache_key)
+        if index is not None and index._df_ref() is not None and (data_version or index._df_ref() is df):
+            _index_cache.move_to_end(cache_key)
+            return index
+
+    index = RowSelectionIndex(df)
+    with _index_cache_lock:
+        _index_cache[cache_key] = index
+        _index_cache.move_to_end(cache_key)
+        while len(_index_cache) > ROW_SELECTION_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def sum_by_day(df, positions, columns, index=None):
+    """選択行を日付ごとに合計する（中間データフレームを作らない）
+
+    Returns:
+        pd.DataFrame: '日付' 列と各列の日別合計（データのある日のみ、日付昇順）
+    """
+    if index is None:
+        index = get_row_selection_index(df)
+    positions = np.asarray(positions, dtype=np.int64)
+    positions = positions[index.date_valid[positions]]
+
+    day_codes = index.day_codes[positions]
+    unique_days, inverse = np.unique(day_codes, return_inverse=True)
+    result = {'日付': pd.to_datetime(unique_days.astype('datetime64[D]')).astype('datetime64[ns]')}
+    for column in columns:
+        values = df[column].to_numpy()
+        selected_values = values[positions]
+        if np.issubdtype(values.dtype, np.integer) or np.issubdtype(values.dtype, np.bool_):
+            sums = np.bincount(inverse, weights=selected_values.astype(np.float64), minlength=len(unique_days))
+            result[column] = np.rint(sums).astype(np.int64)
+        else:
+            selected_values = pd.to_numeric(pd.Series(selected_values), errors='coerce').to_numpy(dtype=np.float64)
+            sums = np.bincount(inverse, weights=np.nan_to_num(selected_values), minlength=len(unique_days))
+            result[column] = sums
+    return pd.DataFrame(result)
+
+
+class UnitDailyCumulative:
+    """集計単位 × 日 の累積和（任意の期間の合計・データ日数を集計単位ごとに O(1) で求める）"""
+
+    def __init__(self, units, first_day, n_days, cumulative_sums, unit_day_counts, total_day_counts):
+        self.units = units
+        self.columns = list(cumulative_sums)
+        self.first_day = first_day
+        self.n_days = n_days
+        self._cumulative_sums = cumulative_sums
+        self._unit_day_counts = unit_day_counts
+        self._total_day_counts = total_day_counts
+
+    def _window(self, start_date, end_date):
+        """期間（両端を含む）を日のオフセットの半開区間 [lo, hi) に変換"""
+        lo = 0 if start_date is None else pd.Timestamp(start_date).value // NS_PER_DAY - self.first_day
+        hi = self.n_days if end_date is None else pd.Timestamp(end_date).value // NS_PER_DAY - self.first_day + 1
+        lo = min(max(lo, 0), self.n_days)
+        hi = min(max(hi, lo), self.n_days)
+        return lo, hi
+
+    def period_sums(self, column, start_date=None, end_date=None):
+        """期間内の列の合計（集計単位ごとの配列）"""
+        lo, hi = self._window(start_date, end_date)
+        cumulative = self._cumulative_sums[column]
+        return cumulative[:, hi] - cumulative[:, lo]
+
+    def period_unit_days(self, start_date=None, end_date=None):
+        """期間内で集計単位ごとにデータのある日数"""
+        lo, hi = self._window(start_date, end_date)
+        return self._unit_day_counts[:, hi] - self._unit_day_counts[:, lo]
+
+    def period_total_days(self, start_date=None, end_date=None):
+        """期間内でいずれかの集計単位にデータのある日数"""
+        lo, hi = self._window(start_date, end_date)
+        return int(self._total_day_counts[hi] - self._total_day_counts[lo])
+
+
+def build_unit_daily_cumulative(df, positions, unit_column, columns, index=None, by_string=False):
+    """選択行から 集計単位 × 日 の累積和を作成する
+
+    日次・集計単位ごとの合計を1回だけ計算し、日付方向の累積和として保持する。
+    集計単位は選択行に現れる値（欠損値を除く）で、by_string=True の場合は
+    文字列表記が同じ値を1つの集計単位にまとめる。
+
+    Returns:
+        UnitDailyCumulative: units（集計単位の値）と期間集計のメソッドを持つ
+    """
+    if index is None:
+        index = get_row_selection_index(df)
+    positions = np.asarray(positions, dtype=np.int64)
+    positions = positions[index.date_valid[positions]]
+
+    codes, uniques = index.column_codes(unit_column)
+    if by_string:
+        label_codes, unit_values = pd.factorize(np.array([str(value) for value in uniques], dtype=object))
+        row_units = np.where(codes[positions] >= 0, label_codes[codes[positions]], -1)
+    else:
+        unit_values = np.asarray(uniques, dtype=object)
+        row_units = codes[positions]
+    has_unit = row_units >= 0
+    positions = positions[has_unit]
+    used_units, row_units = np.unique(row_units[has_unit], return_inverse=True)
+
+    n_units = len(used_units)
+    day_codes = index.day_codes[positions]
+    first_day = int(day_codes.min()) if len(day_codes) else 0
+    n_days = int(day_codes.max()) - first_day + 1 if len(day_codes) else 0
+    cell_keys = row_units * n_days + (day_codes - first_day)
+    n_cells = n_units * n_days
+
+    def cumulate(unit_day_values):
+        cumulative = np.zeros((unit_day_values.shape[0], n_days + 1))
+        np.cumsum(unit_day_values, axis=1, out=cumulative[:, 1:])
+        return cumulative
+
+    has_data = np.bincount(cell_keys, minlength=n_cells).reshape(n_units, n_days) > 0
+    cumulative_sums = {}
+    for column in columns:
+        if column not in df.columns:
+            continue
+        values = df[column].to_numpy()[positions]
+        if not (np.issubdtype(values.dtype, np.number) or np.issubdtype(values.dtype, np.bool_)):
+            values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy()
+        weights = np.nan_to_num(values.astype(np.float64))
+        daily = np.bincount(cell_keys, weights=weights, minlength=n_cells).reshape(n_units, n_days)
+        cumulative_sums[column] = cumulate(daily)
+
+    return UnitDailyCumulative(
+        units=list(unit_values[used_units]),
+        first_day=first_day,
+        n_days=n_days,
+        cumulative_sums=cumulative_sums,
+        unit_day_counts=cumulate(has_data.astype(np.float64)),
+        total_day_counts=cumulate(has_data.any(axis=0, keepdims=True).astype(np.float64))[0],
+    )
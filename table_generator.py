@@ -2,26 +2,60 @@
 import pandas as pd
 import numpy as np
 import streamlit as st
-from datetime import datetime, timedelta
+from datetime import datetime
 import time
 import re # 病棟コードのパターンマッチング用
 from config import EXCLUDED_WARDS
+from utils import as_str_series
+from row_selection import get_row_selection_index, build_unit_daily_cumulative
+from period_calendar import build_period_calendar, get_fiscal_year_periods
 
 def get_fiscal_year_info(date_val: pd.Timestamp):
     """
     指定された日付に基づいて、現在の会計年度の開始日・終了日(実績データに基づく)、
     および前年度の開始日・終了日を返す。
-    日本の会計年度 (4月1日始まり、翌年3月31日終わり) を想定。
+    日本の会計年度 (4月1日始まり、翌年3月31日終わり) を想定。期間は期間カレンダーから取得する。
     """
-    current_year_start_month = 4
-    if date_val.month < current_year_start_month:
-        current_fiscal_year_start = pd.Timestamp(year=date_val.year - 1, month=current_year_start_month, day=1)
+    current_fy, previous_fy = get_fiscal_year_periods(date_val)
+    return current_fy['start'], pd.Timestamp(date_val), previous_fy['start'], previous_fy['end']
+
+def _get_patient_count_targets(target_data_df):
+    """
+    目標値データから部門コード（文字列）ごとの患者数目標値を取得する
+
+    区分='全日' の最初の行の目標値を使い、なければ部門の最初の行の目標値
+    （区分が ALOS・利用率のものを除く）を使う。
+    """
+    if target_data_df is None or target_data_df.empty or '部門コード' not in target_data_df.columns \
+            or '目標値' not in target_data_df.columns:
+        return {}
+
+    target_codes_str = as_str_series(target_data_df['部門コード']).to_numpy(dtype=object) # 文字列化は1回のみ
+    target_values = target_data_df['目標値'].to_numpy()
+    if '区分' in target_data_df.columns:
+        kubun_values = target_data_df['区分']
+        kubun_str = kubun_values.astype(str).str.strip().to_numpy(dtype=object)
+        kubun_for_fallback = kubun_values.where(kubun_values.notna(), "").astype(str).to_numpy(dtype=object)
     else:
-        current_fiscal_year_start = pd.Timestamp(year=date_val.year, month=current_year_start_month, day=1)
-    current_fiscal_year_end_for_data = date_val
-    previous_fiscal_year_start = current_fiscal_year_start - pd.DateOffset(years=1)
-    previous_fiscal_year_end = current_fiscal_year_start - timedelta(days=1)
-    return current_fiscal_year_start, current_fiscal_year_end_for_data, previous_fiscal_year_start, previous_fiscal_year_end
+        kubun_str = np.full(len(target_data_df), "", dtype=object)
+        kubun_for_fallback = kubun_str
+
+    all_day_targets = {}
+    first_rows = {}
+    for code, value, kubun, fallback_kubun in zip(target_codes_str, target_values, kubun_str, kubun_for_fallback):
+        if kubun == '全日' and code not in all_day_targets:
+            all_day_targets[code] = value
+        if code not in first_rows:
+            first_rows[code] = (value, fallback_kubun)
+
+    targets = {}
+    for code, (first_value, first_kubun) in first_rows.items():
+        all_day_value = all_day_targets.get(code, np.nan)
+        if pd.notna(all_day_value):
+            targets[code] = all_day_value
+        elif pd.notna(first_value) and "ALOS" not in first_kubun.upper() and "利用率" not in first_kubun:
+            targets[code] = first_value
+    return targets
 
 @st.cache_data(ttl=3600, show_spinner=False)
 def generate_department_table(
@@ -39,27 +73,30 @@ def generate_department_table(
     if df is None or df.empty:
         return pd.DataFrame()
 
-    df_filtered_for_analysis_period = df[
-        (df['日付'] >= pd.to_datetime(start_date)) &
-        (df['日付'] <= pd.to_datetime(end_date))
-    ].copy()
-    
-    # 除外病棟をフィルタリング（病棟タイプの場合のみ）
-    if department_type == 'ward' and '病棟コード' in df_filtered_for_analysis_period.columns and EXCLUDED_WARDS:
-        original_count = len(df_filtered_for_analysis_period)
-        df_filtered_for_analysis_period = df_filtered_for_analysis_period[~df_filtered_for_analysis_period['病棟コード'].isin(EXCLUDED_WARDS)]
-        removed_count = original_count - len(df_filtered_for_analysis_period)
+    # 分析期間・除外病棟（病棟タイプの場合のみ）の条件をまとめて1回で抽出
+    index = get_row_selection_index(df)
+    period_positions = index.select(pd.to_datetime(start_date), pd.to_datetime(end_date))
+    if department_type == 'ward' and '病棟コード' in df.columns and EXCLUDED_WARDS:
+        analysis_positions = index.select(pd.to_datetime(start_date), pd.to_datetime(end_date), exclude_wards=EXCLUDED_WARDS)
+        removed_count = len(period_positions) - len(analysis_positions)
         if removed_count > 0:
             print(f"テーブル生成: 除外病棟フィルタリングで{removed_count}件のレコードを除外")
+    else:
+        analysis_positions = period_positions
 
-    if df_filtered_for_analysis_period.empty:
+    if len(analysis_positions) == 0:
         st.info(f"指定された分析期間 ({pd.to_datetime(start_date).strftime('%Y-%m-%d')} ~ {pd.to_datetime(end_date).strftime('%Y-%m-%d')}) にデータがありません。")
         return pd.DataFrame()
 
     group_col = '病棟コード' if department_type == 'ward' else '診療科名'
+
+    # 部門 × 日 の累積和（各期間の在院患者数・在院日数はこの累積和の差分で求める）
+    unit_cumulative = build_unit_daily_cumulative(
+        df, analysis_positions, group_col, ['入院患者数（在院）', '総入院患者数', '総退院患者数'], index=index
+    )
     
     # --- 表示対象部門の絞り込み ---
-    unique_depts_from_actual_data = sorted(df_filtered_for_analysis_period[group_col].unique())
+    unique_depts_from_actual_data = sorted(unit_cumulative.units)
     
     # 病棟の場合、除外病棟をフィルタリング
     if department_type == 'ward' and EXCLUDED_WARDS:
@@ -108,91 +145,63 @@ def generate_department_table(
         st.info("表示対象の部門データが見つかりません。")
         return pd.DataFrame()
 
-    # --- 以降の集計期間の定義、指標計算、DataFrame整形、ソートのロジックは前回提案の通り ---
-    latest_data_date_in_df = df_filtered_for_analysis_period['日付'].max()
-    current_fy_start, current_fy_end_for_data, prev_fy_start, prev_fy_end = get_fiscal_year_info(latest_data_date_in_df)
-
+    # --- 集計期間の定義（期間カレンダーから取得、分析期間のデータ範囲に収める） ---
+    valid_analysis_dates = index.date_ns[analysis_positions]
+    earliest_data_date_in_df = pd.Timestamp(int(valid_analysis_dates.min()))
+    latest_data_date_in_df = pd.Timestamp(int(valid_analysis_dates.max()))
+    calendar_periods = build_period_calendar(latest_data_date_in_df.normalize())
+    period_sources = {
+        "直近7日": "直近7日", "直近14日": "直近14日", "直近30日": "直近30日", "直近60日": "直近60日",
+        "今年度平均": "今年度", "前年度平均": "昨年度",
+    }
     periods = {
-        "直近7日": (latest_data_date_in_df - timedelta(days=6), latest_data_date_in_df),
-        "直近14日": (latest_data_date_in_df - timedelta(days=13), latest_data_date_in_df),
-        "直近30日": (latest_data_date_in_df - timedelta(days=29), latest_data_date_in_df),
-        "直近60日": (latest_data_date_in_df - timedelta(days=59), latest_data_date_in_df),
-        "今年度平均": (current_fy_start, current_fy_end_for_data),
-        "前年度平均": (prev_fy_start, prev_fy_end),
+        label: (calendar_periods[source]['start'], calendar_periods[source]['end'])
+        for label, source in period_sources.items()
     }
     period_names_ordered_detailed = ["直近7日", "直近14日", "直近30日", "直近60日", "今年度平均", "前年度平均"]
     period_name_for_basic_and_achievement = "直近30日" 
 
-    all_dept_metrics_list = []
-
-    for dept_code_value in unique_depts_codes: # 絞り込まれた部門リストでループ
-        dept_df_for_calc = df_filtered_for_analysis_period[df_filtered_for_analysis_period[group_col] == dept_code_value]
-        if dept_df_for_calc.empty: continue
-
-        current_dept_metrics = {'部門コード': dept_code_value}
-        dept_patient_count_target = np.nan 
-
-        if target_data_df is not None and not target_data_df.empty:
-            target_row_df = target_data_df[target_data_df['部門コード'].astype(str) == str(dept_code_value)]
-            if not target_row_df.empty:
-                # 「患者数目標値」の取得: 区分='全日' の '目標値' を使用
-                target_row_all_day = target_row_df[target_row_df['区分'].astype(str).str.strip() == '全日']
-                if not target_row_all_day.empty and '目標値' in target_row_all_day.columns and pd.notna(target_row_all_day['目標値'].iloc[0]):
-                    dept_patient_count_target = target_row_all_day['目標値'].iloc[0]
-                # もし '全日' がない場合のフォールバック (区分を問わず最初の行の目標値)
-                elif '目標値' in target_row_df.columns and pd.notna(target_row_df['目標値'].iloc[0]):
-                    # 区分がALOSや利用率専用でないことを確認するようなロジックがより良い
-                    first_target_kubun = str(target_row_df['区分'].iloc[0]) if '区分' in target_row_df.columns and pd.notna(target_row_df['区分'].iloc[0]) else ""
-                    if "ALOS" not in first_target_kubun.upper() and "利用率" not in first_target_kubun:
-                         dept_patient_count_target = target_row_df['目標値'].iloc[0]
-
+    # --- 部門 × 期間 の指標（累積和の差分で全部門を一度に計算） ---
+    unit_rows = {unit: row for row, unit in enumerate(unit_cumulative.units)}
+    rows_to_show = [unit_rows[dept] for dept in unique_depts_codes if dept in unit_rows]
+    if not rows_to_show:
+        return pd.DataFrame()
 
+    result_columns = {'部門コード': [unit_cumulative.units[row] for row in rows_to_show]}
+    if '入院患者数（在院）' in df.columns:
         for period_label, (p_start, p_end) in periods.items():
-            actual_p_start = max(pd.to_datetime(p_start), df_filtered_for_analysis_period['日付'].min())
+            actual_p_start = max(pd.to_datetime(p_start), earliest_data_date_in_df)
             actual_p_end = min(pd.to_datetime(p_end), latest_data_date_in_df)
 
-            if actual_p_start > actual_p_end:
-                current_dept_metrics[f'平均在院患者数 ({period_label})'] = np.nan
-                current_dept_metrics[f'平均在院日数 ({period_label})'] = np.nan
-                continue
-
-            period_data = dept_df_for_calc[
-                (dept_df_for_calc['日付'] >= actual_p_start) &
-                (dept_df_for_calc['日付'] <= actual_p_end)
-            ]
-
-            if period_data.empty:
-                current_dept_metrics[f'平均在院患者数 ({period_label})'] = np.nan
-                current_dept_metrics[f'平均在院日数 ({period_label})'] = np.nan
-                continue
-
-            num_days_in_actual_period = period_data['日付'].nunique()
-            if '入院患者数（在院）' not in period_data.columns: continue 
-
-            total_patient_days_p = period_data['入院患者数（在院）'].sum()
-            total_admissions_p = period_data['総入院患者数'].sum() if '総入院患者数' in period_data else 0
-            total_discharges_p = period_data['総退院患者数'].sum() if '総退院患者数' in period_data else 0
-            
-            avg_daily_census_p = total_patient_days_p / num_days_in_actual_period if num_days_in_actual_period > 0 else np.nan
-            current_dept_metrics[f'平均在院患者数 ({period_label})'] = avg_daily_census_p
-            
-            alos_denominator_p = (total_admissions_p + total_discharges_p) / 2
-            alos_p = total_patient_days_p / alos_denominator_p if alos_denominator_p > 0 else np.nan
-            current_dept_metrics[f'平均在院日数 ({period_label})'] = alos_p
-        
-        avg_inpatients_for_achievement = current_dept_metrics.get(f'平均在院患者数 ({period_name_for_basic_and_achievement})', np.nan)
-        current_dept_metrics['患者数目標値'] = dept_patient_count_target if pd.notna(dept_patient_count_target) else np.nan
-        if pd.notna(avg_inpatients_for_achievement) and pd.notna(dept_patient_count_target) and dept_patient_count_target > 0:
-            current_dept_metrics['患者数達成率(%)'] = (avg_inpatients_for_achievement / dept_patient_count_target) * 100
-        else:
-            current_dept_metrics['患者数達成率(%)'] = np.nan
-            
-        all_dept_metrics_list.append(current_dept_metrics)
-
-    if not all_dept_metrics_list:
-        return pd.DataFrame()
-
-    result_df = pd.DataFrame(all_dept_metrics_list)
+            # 開始日が終了日より後の期間は日数 0（= 欠損値）になる
+            days_p = unit_cumulative.period_unit_days(actual_p_start, actual_p_end)[rows_to_show]
+            total_patient_days_p = unit_cumulative.period_sums('入院患者数（在院）', actual_p_start, actual_p_end)[rows_to_show]
+            alos_denominator_p = np.zeros(len(rows_to_show))
+            for count_col in ('総入院患者数', '総退院患者数'):
+                if count_col in df.columns:
+                    alos_denominator_p += unit_cumulative.period_sums(count_col, actual_p_start, actual_p_end)[rows_to_show]
+            alos_denominator_p /= 2
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result_columns[f'平均在院患者数 ({period_label})'] = np.where(days_p > 0, total_patient_days_p / days_p, np.nan)
+                result_columns[f'平均在院日数 ({period_label})'] = np.where(
+                    (days_p > 0) & (alos_denominator_p > 0), total_patient_days_p / alos_denominator_p, np.nan
+                )
+
+    result_df = pd.DataFrame(result_columns)
+
+    # --- 患者数目標値と達成率 ---
+    patient_count_targets = _get_patient_count_targets(target_data_df)
+    result_df['患者数目標値'] = [patient_count_targets.get(str(code), np.nan) for code in result_df['部門コード']]
+    achievement_basis_col = f'平均在院患者数 ({period_name_for_basic_and_achievement})'
+    if achievement_basis_col in result_df.columns:
+        targets = result_df['患者数目標値'].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result_df['患者数達成率(%)'] = np.where(
+                targets > 0, result_df[achievement_basis_col].to_numpy(dtype=np.float64) / targets * 100, np.nan
+            )
+    else:
+        result_df['患者数達成率(%)'] = np.nan
     
     if target_data_df is not None and not target_data_df.empty and \
        all(col in target_data_df.columns for col in ['部門コード', '部門名']):
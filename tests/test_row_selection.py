@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from row_selection import get_row_selection_index
+
+
+def _versioned_frame():
+    df = pd.DataFrame({
+        '日付': pd.date_range('2025-04-01', periods=6, freq='D'),
+        '病棟コード': ['02A', '02B', '03A', '02A', '03B', '04A'],
+        '診療科名': ['内科', '外科', '内科', '整形外科', '外科', '内科'],
+    })
+    df.attrs['data_version'] = 'test-version'
+    return df
+
+
+def test_same_length_slices_of_versioned_frame_get_different_indexes():
+    df = _versioned_frame()
+    first, second = df.iloc[:3], df.iloc[3:]
+    assert first.attrs['data_version'] == second.attrs['data_version']
+
+    first_index = get_row_selection_index(first)
+    second_index = get_row_selection_index(second)
+
+    assert first_index is not second_index
+    np.testing.assert_array_equal(first_index.date_ns, first['日付'].to_numpy().view('int64'))
+    np.testing.assert_array_equal(second_index.date_ns, second['日付'].to_numpy().view('int64'))
+    assert set(second_index.column_codes('病棟コード')[1]) == {'02A', '03B', '04A'}
+
+
+def test_shallow_copy_of_versioned_frame_shares_index():
+    df = _versioned_frame()
+    assert get_row_selection_index(df.copy(deep=False)) is get_row_selection_index(df)
+
+
+def test_aggregate_key_is_stable_across_reextracted_frames():
+    df = _versioned_frame()
+    first = df.take([0, 2, 4])
+    again = df.take([0, 2, 4])
+    other = df.take([1, 3, 5])
+
+    assert get_row_selection_index(first) is not get_row_selection_index(again)
+    assert get_row_selection_index(first).aggregate_key() == get_row_selection_index(again).aggregate_key()
+    assert get_row_selection_index(first).aggregate_key() != get_row_selection_index(other).aggregate_key()
@@ -1,12 +1,20 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import logging
+import weakref
 from config import EXCLUDED_WARDS
+from data_persistence import get_manifest_for_df
+from row_selection import get_row_selection_index
+from period_calendar import get_data_date_bounds, get_period_calendar, get_fiscal_year_start
 
 # utilsから必要な関数をインポート
 from utils import (
-    safe_date_filter,
+    date_filter_mask,
+    take_rows,
+    as_str_series,
     create_ward_display_options,
     create_dept_display_options,
     get_ward_display_name,
@@ -15,6 +23,9 @@ from utils import (
 
 logger = logging.getLogger(__name__)
 
+# メモ化するフィルター選択（行位置）の数（セッションごと）
+FILTER_SELECTION_CACHE_SIZE = 4
+
 class UnifiedFilterManager:
     """統一フィルター管理クラス（排他選択版）"""
 
@@ -22,6 +33,17 @@ class UnifiedFilterManager:
         self.session_prefix = "unified_filter_"
         self.config_key = f"{self.session_prefix}config"
 
+    def _get_date_bounds(self, df):
+        """データの最小・最大日付（保存データならマニフェスト、それ以外は行選択インデックスから取得）"""
+        return get_data_date_bounds(df)
+
+    def _get_available_values(self, df, column, manifest_key):
+        """フィルター選択肢（保存データそのものならマニフェストの一覧を使用）"""
+        manifest = get_manifest_for_df(df)
+        if manifest and manifest.get(manifest_key):
+            return list(manifest[manifest_key])
+        return sorted(as_str_series(df[column]).unique())
+
     def initialize_default_filters(self, df):
         """デフォルトフィルター値の初期化"""
         if df is None or df.empty or '日付' not in df.columns:
@@ -29,13 +51,14 @@ class UnifiedFilterManager:
             return
 
         try:
-            valid_dates = df['日付'].dropna()
-            if valid_dates.empty:
-                logger.warning("initialize_default_filters: 有効な日付データがありません")
+            # 初期化済みの場合は日付範囲の計算自体を省略
+            if st.session_state.get(f"{self.session_prefix}initialized", False):
                 return
 
-            max_date = valid_dates.max()
-            min_date = valid_dates.min()
+            min_date, max_date = self._get_date_bounds(df)
+            if max_date is None:
+                logger.warning("initialize_default_filters: 有効な日付データがありません")
+                return
 
             default_start = max_date - pd.Timedelta(days=90) # 直近3ヶ月の開始日
             default_start = max(default_start, min_date)
@@ -119,8 +142,9 @@ class UnifiedFilterManager:
                     st.warning("プリセット期間の計算に失敗しました。")
 
             else: # カスタム期間
-                data_min_dt = df['日付'].min().date()
-                data_max_dt = df['日付'].max().date()
+                data_min_ts, data_max_ts = self._get_date_bounds(df)
+                data_min_dt = data_min_ts.date()
+                data_max_dt = data_max_ts.date()
 
                 # セッションから日付を取得、なければデフォルト計算
                 session_start_date_val = st.session_state.get(f"{self.session_prefix}start_date")
@@ -187,7 +211,7 @@ class UnifiedFilterManager:
 
             if filter_mode == "特定診療科":
                 if '診療科名' in df.columns:
-                    available_depts_actual = sorted(df['診療科名'].astype(str).unique())
+                    available_depts_actual = self._get_available_values(df, '診療科名', 'departments')
                     dept_mapping_session = st.session_state.get('dept_mapping', {})
                     dept_options_display, dept_display_to_code_map = create_dept_display_options(available_depts_actual, dept_mapping_session)
 
@@ -217,7 +241,7 @@ class UnifiedFilterManager:
 
             elif filter_mode == "特定病棟":
                 if '病棟コード' in df.columns:
-                    available_wards_actual = sorted(df['病棟コード'].astype(str).unique())
+                    available_wards_actual = self._get_available_values(df, '病棟コード', 'wards')
                     # 除外病棟をフィルタリング  
                     available_wards_actual = [ward for ward in available_wards_actual if ward not in EXCLUDED_WARDS]
                     ward_mapping_session = st.session_state.get('ward_mapping', {})
@@ -299,52 +323,21 @@ class UnifiedFilterManager:
         """
         try:
             # 4月1日以降なら同年の4月1日、3月31日以前なら前年の4月1日
-            if reference_date.month >= 4:
-                fiscal_year_start = pd.Timestamp(year=reference_date.year, month=4, day=1)
-            else:
-                fiscal_year_start = pd.Timestamp(year=reference_date.year - 1, month=4, day=1)
-            
-            return fiscal_year_start.normalize()
+            return get_fiscal_year_start(reference_date).normalize()
         except Exception as e:
             logger.error(f"年度開始日の計算でエラー: {e}", exc_info=True)
             return None
 
     def _get_preset_dates(self, df, preset):
-        """プリセット期間に基づく開始日・終了日の計算"""
+        """プリセット期間に基づく開始日・終了日（期間カレンダーから取得）"""
         try:
-            valid_dates = df['日付'].dropna()
-            if valid_dates.empty: 
+            periods = get_period_calendar(df)
+            if not periods:
                 return None, None # 修正: データがない場合はNoneを返す
-            max_date = valid_dates.max()
-            min_date = valid_dates.min()
-
-            if preset == "直近1ヶ月": 
-                start_date = max_date - pd.Timedelta(days=29) # 30日間なので29を引く
-            elif preset == "直近3ヶ月": 
-                start_date = max_date - pd.Timedelta(days=89) # 90日間なので89を引く
-            elif preset == "直近6ヶ月": 
-                start_date = max_date - pd.Timedelta(days=179) # 180日間
-            elif preset == "直近12ヶ月": 
-                start_date = max_date - pd.Timedelta(days=364) # 365日間
-            elif preset == "今年度":
-                # 今年度：直近データの年度の4月1日～直近データまで
-                fiscal_start = self._get_fiscal_year_start_date(max_date)
-                if fiscal_start is None:
-                    logger.error("今年度の開始日計算に失敗しました")
-                    start_date = min_date # フォールバック
-                else:
-                    start_date = fiscal_start
-                    # データ範囲外の場合は調整
-                    if start_date < min_date:
-                        start_date = min_date
-                        logger.info(f"今年度開始日がデータ範囲外のため調整: {start_date.date()}")
-            elif preset == "全期間": 
-                start_date = min_date
-            else: 
-                start_date = min_date # 不明なプリセットの場合は全期間
-
-            start_date = max(start_date, min_date) # データ開始日より前にはしない
-            return start_date.normalize(), max_date.normalize()
+
+            # 不明なプリセットの場合は全期間
+            period = periods.get(preset) or periods["全期間"]
+            return period['data_start'], period['data_end']
         except Exception as e:
             logger.error(f"_get_preset_dates でエラー: {e}", exc_info=True)
             return None, None # エラー時もNoneを返す
@@ -364,8 +357,61 @@ class UnifiedFilterManager:
         except Exception as e:
             logger.error(f"フィルターリセット中にエラー: {e}", exc_info=True)
 
+    def _normalize_filter_config(self, config):
+        """行の絞り込みに影響する項目だけを正規化したキー（プリセット名などは含めない）"""
+        start_date_ts = pd.Timestamp(config['start_date']).normalize() if config.get('start_date') else None
+        end_date_ts = pd.Timestamp(config['end_date']).normalize() if config.get('end_date') else None
+        filter_mode = config.get('filter_mode', '全体')
+        selected_depts = tuple(sorted(str(d) for d in config.get('selected_depts') or [])) if filter_mode == "特定診療科" else ()
+        selected_wards = tuple(sorted(str(w) for w in config.get('selected_wards') or [])) if filter_mode == "特定病棟" else ()
+        return (start_date_ts, end_date_ts, filter_mode, selected_depts, selected_wards)
+
+    def _compute_filter_positions(self, df_original, config):
+        """フィルター条件に該当する行位置と、判定に使った日付列を返す"""
+        start_date_ts = pd.Timestamp(config['start_date']) if config.get('start_date') else None
+        end_date_ts = pd.Timestamp(config['end_date']) if config.get('end_date') else None
+        filter_mode = config.get('filter_mode', '全体')
+
+        if pd.api.types.is_datetime64_any_dtype(df_original['日付']):
+            # 事前計算済みの行選択インデックス上でビット演算のみで絞り込む
+            index = get_row_selection_index(df_original)
+            wards = config['selected_wards'] if filter_mode == "特定病棟" and config.get('selected_wards') and '病棟コード' in df_original.columns else None
+            depts = config['selected_depts'] if filter_mode == "特定診療科" and config.get('selected_depts') and '診療科名' in df_original.columns else None
+            return index.select(
+                start_date_ts.normalize() if start_date_ts is not None else None,
+                end_date_ts.normalize() if end_date_ts is not None else None,
+                wards=wards, depts=depts
+            ), df_original['日付']
+
+        # 期間フィルター
+        mask, dates = date_filter_mask(df_original, start_date_ts, end_date_ts)
+
+        # 統合部門フィルター（排他選択）
+        if filter_mode == "特定診療科" and config.get('selected_depts'):
+            if '診療科名' in df_original.columns:
+                mask &= df_original['診療科名'].isin(config['selected_depts']).to_numpy()
+
+        elif filter_mode == "特定病棟" and config.get('selected_wards'):
+            if '病棟コード' in df_original.columns:
+                mask &= df_original['病棟コード'].isin(config['selected_wards']).to_numpy()
+
+        return np.flatnonzero(mask), dates
+
+    def _get_selection_cache(self):
+        cache_key = f"{self.session_prefix}selection_cache"
+        if cache_key not in st.session_state:
+            st.session_state[cache_key] = OrderedDict()
+        return st.session_state[cache_key]
+
     def apply_filters(self, df_original):
-        """フィルターをデータフレームに適用（排他選択版）"""
+        """フィルターをデータフレームに適用（排他選択版）
+
+        選択した行位置を (データバージョン, 正規化したフィルター設定) ごとにセッション内でメモ化し、
+        フィルターに関係しないウィジェット操作による再実行では条件の判定も行の抽出もやり直さず、
+        前回と同じデータフレームを返す（下流の行選択インデックス・集計キャッシュがそのまま使える）。
+        抽出結果を保持するのは直近に使ったフィルター条件のみで、それ以前の条件は行位置だけを保持する。
+        返すデータフレームは再実行間で共有するため、呼び出し側で変更しないこと（変更する場合は copy する）。
+        """
         config = st.session_state.get(self.config_key)
         if not config:
             logger.warning("フィルター設定が見つかりません。元のデータフレームを返します。")
@@ -377,25 +423,46 @@ class UnifiedFilterManager:
                 logger.warning("apply_filters: 元のデータフレームが空です。")
                 return df_original
 
-            # 期間フィルター
-            # configの日付がTimestampであることを確認
-            start_date_ts = pd.Timestamp(config['start_date']) if config.get('start_date') else None
-            end_date_ts = pd.Timestamp(config['end_date']) if config.get('end_date') else None
-
-            filtered_df = safe_date_filter(df_original, start_date_ts, end_date_ts)
-
-            # 統合部門フィルター（排他選択）
-            filter_mode = config.get('filter_mode', '全体')
-            
-            if filter_mode == "特定診療科" and config.get('selected_depts'):
-                if '診療科名' in filtered_df.columns:
-                    filtered_df = filtered_df[filtered_df['診療科名'].isin(config['selected_depts'])]
-
-            elif filter_mode == "特定病棟" and config.get('selected_wards'):
-                if '病棟コード' in filtered_df.columns:
-                    filtered_df = filtered_df[filtered_df['病棟コード'].isin(config['selected_wards'])]
-
-            return filtered_df
+            if '日付' not in df_original.columns:
+                logger.warning("safe_date_filter: '日付'列がデータフレームに存在しません。")
+                return df_original.copy()
+
+            data_version = df_original.attrs.get('data_version') or f"session:{id(df_original)}"
+            cache_key = (data_version, len(df_original), self._normalize_filter_config(config))
+            selection_cache = self._get_selection_cache()
+
+            # 参照先が解放された（別のデータフレームに置き換わった）エントリは破棄
+            for stale_key in [k for k, entry in selection_cache.items() if entry['df_ref']() is None]:
+                del selection_cache[stale_key]
+
+            entry = selection_cache.get(cache_key)
+            columns = tuple(df_original.columns)
+            if entry is not None and entry['df_ref']() is df_original and entry['columns'] == columns:
+                selection_cache.move_to_end(cache_key)
+                result = entry.get('result')
+                if result is not None and tuple(result.columns) == columns:
+                    return result
+                row_positions = entry['row_positions']
+                dates = df_original['日付']
+                if not pd.api.types.is_datetime64_any_dtype(dates):
+                    dates = pd.to_datetime(dates, errors='coerce')
+            else:
+                row_positions, dates = self._compute_filter_positions(df_original, config)
+                entry = {
+                    'df_ref': weakref.ref(df_original),
+                    'columns': columns,
+                    'row_positions': row_positions,
+                }
+                selection_cache[cache_key] = entry
+                selection_cache.move_to_end(cache_key)
+                while len(selection_cache) > FILTER_SELECTION_CACHE_SIZE:
+                    selection_cache.popitem(last=False)
+
+            # 抽出結果は直近の条件の分だけ保持する（セッションごとのメモリを抽出結果1つ分に抑える）
+            for other in selection_cache.values():
+                other.pop('result', None)
+            entry['result'] = take_rows(df_original, row_positions, dates)
+            return entry['result']
 
         except Exception as e:
             logger.error(f"フィルター適用中にエラー: {e}", exc_info=True)
@@ -403,6 +470,14 @@ class UnifiedFilterManager:
                 st.sidebar.error(f"フィルター適用エラー: {e}")
             return df_original
 
+    def get_selected_row_positions(self, df_original):
+        """現在のフィルター設定で選択される行位置（メモ化済みの場合は再計算しない）"""
+        self.apply_filters(df_original)
+        for entry in reversed(self._get_selection_cache().values()):
+            if entry['df_ref']() is df_original:
+                return entry['row_positions']
+        return None
+
     def get_filter_summary(self):
         """フィルター設定のサマリー文字列を取得（排他選択版）"""
         config = st.session_state.get(self.config_key)
@@ -1,12 +1,113 @@
 # utils.py - 共通ユーティリティ関数
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 import re # 病棟コードのパターンマッチング用
 import logging # ロギング用に追加
+from config import DATA_TYPE_OPTIMIZATION
 
 logger = logging.getLogger(__name__) # ロガーのセットアップ
 
+# --- ユニーク値ベースの変換ユーティリティ ---
+def map_by_unique_values(series, mapper, na_value=None):
+    """
+    ユニーク値ごとに一度だけ変換関数を適用し、コード配列経由で全行へ展開する
+
+    行ごとの apply と異なり、変換コストはユニーク値の数にのみ比例する。
+
+    Parameters:
+    -----------
+    series : pd.Series
+        変換対象の列
+    mapper : callable
+        ユニーク値1つを受け取り変換後の値を返す関数
+    na_value : any, default None
+        欠損値の代わりに mapper へ渡す値（None の場合、欠損値は欠損値のまま）
+
+    Returns:
+    --------
+    pd.Series
+        変換後の列（object型、元の index を保持）
+    """
+    if series is None or len(series) == 0:
+        return pd.Series([], index=getattr(series, 'index', None), dtype=object)
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    mapped_uniques = [mapper(value) for value in uniques]
+
+    # 末尾に欠損値用のスロットを追加し、コード -1 がそこを参照するようにする
+    na_result = mapper(na_value) if na_value is not None else np.nan
+    lookup = np.empty(len(mapped_uniques) + 1, dtype=object)
+    lookup[:len(mapped_uniques)] = mapped_uniques
+    lookup[-1] = na_result
+
+    return pd.Series(lookup.take(codes), index=series.index, name=series.name)
+
+# --- 文字列列（Arrow）ユーティリティ ---
+ARROW_STRING_DTYPE = pd.StringDtype("pyarrow")
+
+def arrow_strings_enabled():
+    """string[pyarrow] 型での列保持（オプトイン設定）が有効かどうか"""
+    return bool(DATA_TYPE_OPTIMIZATION.get('arrow_strings_enabled', False))
+
+def is_arrow_string_series(series):
+    """列が Arrow ベースの文字列型（string[pyarrow] / ArrowDtype(string)）かどうか"""
+    dtype = getattr(series, 'dtype', None)
+    if isinstance(dtype, pd.StringDtype):
+        return dtype.storage in ('pyarrow', 'pyarrow_numpy')
+    if isinstance(dtype, pd.ArrowDtype):
+        import pyarrow as pa
+        return pa.types.is_string(dtype.pyarrow_dtype) or pa.types.is_large_string(dtype.pyarrow_dtype)
+    return False
+
+def as_str_series(series):
+    """
+    列を文字列として比較できる形で返す
+
+    Arrow 文字列型の列はそのまま返し（比較・isin は Arrow の計算カーネルで実行される）、
+    それ以外の列のみ astype(str) で変換する。
+    """
+    if is_arrow_string_series(series):
+        return series
+    return series.astype(str)
+
+def convert_columns_to_arrow_strings(df, columns):
+    """
+    指定列を string[pyarrow] 型へ変換したデータフレームを返す（渡したデータフレームは変更しない）
+
+    変換する列がない場合は渡したデータフレームをそのまま返し、変換する場合も他の列は複製しない。
+    欠損値は astype(str) と同じく 'nan' 文字列として保持し、比較結果に NA が混ざらないようにする。
+    """
+    if df is None or df.empty:
+        return df
+    converted = {}
+    for col in columns:
+        if col in df.columns and not is_arrow_string_series(df[col]):
+            try:
+                converted[col] = df[col].astype(str).astype(ARROW_STRING_DTYPE)
+            except Exception as e:
+                logger.warning(f"列 '{col}' の string[pyarrow] 変換に失敗しました: {e}")
+    if not converted:
+        return df
+    # 浅いコピーの列を置き換える（共有・キャッシュされている元のデータフレームの型は変えない）
+    result = df.copy(deep=False)
+    for col, values in converted.items():
+        result[col] = values
+    return result
+
+def apply_arrow_string_mode(df, target_data_df=None):
+    """
+    オプトイン設定が有効な場合、実績データと目標値データのコード列を string[pyarrow] 型に揃える
+
+    変換後のデータフレームを返す（渡したデータフレームは変更しないため、呼び出し側で置き換える）。
+    """
+    if not arrow_strings_enabled():
+        return df, target_data_df
+    df = convert_columns_to_arrow_strings(df, DATA_TYPE_OPTIMIZATION.get('arrow_string_columns', []))
+    target_data_df = convert_columns_to_arrow_strings(target_data_df, DATA_TYPE_OPTIMIZATION.get('arrow_target_columns', []))
+    return df, target_data_df
+
 # --- 診療科マッピング関連関数 ---
 def create_dept_mapping_table(target_data_df=None):
     """
@@ -23,12 +124,11 @@ def create_dept_mapping_table(target_data_df=None):
         logger.warning("診療科マッピング: 目標値データが見つからないか、必要な列（部門コード, 部門名）がありません。")
         # 目標値ファイルがなくても特別なマッピングは適用する可能性があるため、処理を続ける
     else:
-        # マッピングテーブルを作成
-        for _, row in target_data_df.iterrows():
-            code = str(row.get('部門コード', '')).strip()
-            name = str(row.get('部門名', '')).strip()
-            if code and name:  # コードと名前が両方存在する場合のみマッピング
-                dept_mapping[code] = name
+        # マッピングテーブルを作成（列単位で変換し、行ループを避ける）
+        codes = target_data_df['部門コード'].astype(str).str.strip()
+        names = target_data_df['部門名'].astype(str).str.strip()
+        valid = (codes != '') & (names != '')  # コードと名前が両方存在する場合のみマッピング
+        dept_mapping = dict(zip(codes[valid], names[valid]))
 
     # --- 特別なマッピングの読み込みと適用 ---
     # st.session_state.common_config から SPECIAL_DEPT_MAPPINGS を取得
@@ -93,7 +193,25 @@ def create_dept_display_options(dept_codes, dept_mapping=None):
 
     return options, option_to_code
 
+def map_dept_display_names(dept_codes):
+    """
+    診療科コード列を表示名列へ変換（ユニークな診療科ごとに一度だけ解決）
+    """
+    return map_by_unique_values(dept_codes, lambda code: get_display_name_for_dept(code, default_name=code))
+
 # --- 病棟マッピング関連関数 ---
+def _generate_ward_display_name(code_str):
+    """病棟コードからルールベースで病棟名を生成（例: '05A' → '5階A病棟'）"""
+    if len(code_str) >= 3:
+        try:
+            floor_part = code_str[:2]
+            floor_num = str(int(floor_part)) # 先頭の0を除去
+            ward_letter = code_str[2:]
+            return f"{floor_num}階{ward_letter}病棟"
+        except (ValueError, IndexError):
+            return code_str # 変換できない場合はそのまま使用
+    return code_str # 3文字未満はそのまま
+
 def create_ward_name_mapping(df_actual_data, target_data_df=None):
     """
     病棟コードから病棟名へのマッピング辞書を作成
@@ -106,11 +224,10 @@ def create_ward_name_mapping(df_actual_data, target_data_df=None):
        all(col in target_data_df.columns for col in ['部門コード', '部門名', '部門種別']):
         # 「部門種別」が「病棟」である行をフィルタリング
         ward_rows_from_target = target_data_df[target_data_df['部門種別'].astype(str).str.strip() == '病棟']
-        for _, row in ward_rows_from_target.iterrows():
-            code = str(row.get('部門コード', '')).strip()
-            name = str(row.get('部門名', '')).strip()
-            if code and name:
-                ward_mapping[code] = name
+        codes = ward_rows_from_target['部門コード'].astype(str).str.strip()
+        names = ward_rows_from_target['部門名'].astype(str).str.strip()
+        valid = (codes != '') & (names != '')
+        ward_mapping.update(zip(codes[valid], names[valid]))
         logger.info(f"目標値ファイルから {len(ward_mapping)} 件の病棟マッピングを登録しました。")
 
     # 2. 実績データから病棟コードを取得し、マッピングが存在しない場合はルールベースで生成
@@ -121,29 +238,16 @@ def create_ward_name_mapping(df_actual_data, target_data_df=None):
         st.session_state.ward_mapping_initialized = True
         return ward_mapping
 
-    unique_ward_codes = df_actual_data['病棟コード'].unique()
-
+    # ユニークな病棟コードのみを対象に表示名を生成（行数ではなく病棟数に比例）
+    unique_ward_codes = pd.unique(df_actual_data['病棟コード'].dropna())
     for code in unique_ward_codes:
-        if pd.isna(code):
-            continue
         code_str = str(code).strip()
 
         # 既に目標値ファイルからマッピングされていればスキップ
         if code_str in ward_mapping:
             continue
 
-        # ルールベースでの病棟名生成
-        if len(code_str) >= 3:
-            try:
-                floor_part = code_str[:2]
-                floor_num = str(int(floor_part)) # 先頭の0を除去
-                ward_letter = code_str[2:]
-                generated_name = f"{floor_num}階{ward_letter}病棟"
-                ward_mapping[code_str] = generated_name
-            except (ValueError, IndexError):
-                ward_mapping[code_str] = code_str # 変換できない場合はそのまま使用
-        else:
-            ward_mapping[code_str] = code_str # 3文字未満はそのまま
+        ward_mapping[code_str] = _generate_ward_display_name(code_str)
 
     logger.info(f"病棟マッピングテーブル作成完了: 合計 {len(ward_mapping)}件のマッピング")
     st.session_state.ward_mapping = ward_mapping
@@ -172,6 +276,12 @@ def get_ward_display_name(ward_code, ward_mapping=None):
     # マッピングから病棟名を取得、なければコード自体を返す
     return ward_mapping.get(ward_code_str, ward_code_str)
 
+def map_ward_display_names(ward_codes, ward_mapping=None):
+    """
+    病棟コード列を表示名列へ変換（ユニークな病棟コードごとに一度だけ解決）
+    """
+    return map_by_unique_values(ward_codes, lambda code: get_ward_display_name(code, ward_mapping=ward_mapping))
+
 def create_ward_display_options(ward_codes, ward_mapping=None):
     """
     病棟選択用の表示オプションを作成
@@ -240,40 +350,57 @@ def get_mapping_status():
     }
 
 # --- 日付関連ユーティリティ関数 ---
+def date_filter_mask(df, start_date=None, end_date=None):
+    """日付範囲に該当する行のブールマスクと、判定に使った日付列を返す"""
+    dates = df['日付']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce')
+        nat_count = dates.isna().sum()
+        if nat_count > 0:
+            logger.warning(f"safe_date_filter: '日付'列の変換でNaTが {nat_count} 件発生しました。")
+
+    mask = dates.notna().to_numpy()
+
+    if start_date is not None:
+        try:
+            start_date_pd = pd.Timestamp(start_date).normalize()
+            mask &= (dates >= start_date_pd).to_numpy()
+        except Exception as e_start:
+            logger.error(f"safe_date_filter: 開始日の処理エラー: {e_start}")
+
+    if end_date is not None:
+        try:
+            end_date_pd = pd.Timestamp(end_date).normalize()
+            mask &= (dates <= end_date_pd).to_numpy()
+        except Exception as e_end:
+            logger.error(f"safe_date_filter: 終了日の処理エラー: {e_end}")
+
+    return mask, dates
+
+def take_rows(df, row_positions, dates=None):
+    """行位置で抽出（日付列を変換済みの場合は変換後の値で置き換える）"""
+    # take は独立したデータフレームを返すため、呼び出し側で列を追加・変更しても元データに影響しない
+    df_result = df.take(row_positions)
+    if dates is not None and dates is not df['日付']:
+        df_result['日付'] = dates.take(row_positions)
+    return df_result
+
 def safe_date_filter(df, start_date=None, end_date=None):
-    """安全な日付フィルタリング"""
+    """安全な日付フィルタリング（開始日・終了日の条件をまとめ、行の抽出は1回のみ行う）"""
     try:
         if df is None or df.empty:
             return pd.DataFrame()
 
-        df_result = df.copy()
-
-        if '日付' not in df_result.columns:
+        if '日付' not in df.columns:
             logger.warning("safe_date_filter: '日付'列がデータフレームに存在しません。")
-            return df_result
-
-        if not pd.api.types.is_datetime64_any_dtype(df_result['日付']):
-            df_result['日付'] = pd.to_datetime(df_result['日付'], errors='coerce')
-            nat_count = df_result['日付'].isna().sum()
-            if nat_count > 0:
-                logger.warning(f"safe_date_filter: '日付'列の変換でNaTが {nat_count} 件発生しました。")
-                df_result = df_result.dropna(subset=['日付']) # NaT行を除外
+            return df.copy()
 
-        if start_date is not None:
-            try:
-                start_date_pd = pd.Timestamp(start_date).normalize()
-                df_result = df_result[df_result['日付'] >= start_date_pd]
-            except Exception as e_start:
-                logger.error(f"safe_date_filter: 開始日の処理エラー: {e_start}")
-
-        if end_date is not None:
-            try:
-                end_date_pd = pd.Timestamp(end_date).normalize()
-                df_result = df_result[df_result['日付'] <= end_date_pd]
-            except Exception as e_end:
-                logger.error(f"safe_date_filter: 終了日の処理エラー: {e_end}")
+        if start_date is None and end_date is None and pd.api.types.is_datetime64_any_dtype(df['日付']):
+            # 期間の指定がなければ絞り込まない（日付が欠損した行も残す）
+            return df.copy()
 
-        return df_result
+        mask, dates = date_filter_mask(df, start_date, end_date)
+        return take_rows(df, np.flatnonzero(mask), dates)
 
     except Exception as e:
         logger.error(f"日付フィルタリング処理全体でエラー: {e}", exc_info=True)
@@ -2,8 +2,8 @@ import streamlit as st
 import pandas as pd
 import logging
 from datetime import datetime
-import calendar
 from config import EXCLUDED_WARDS
+from period_calendar import get_period_calendar
 
 logger = logging.getLogger(__name__)
 
@@ -17,82 +17,15 @@ except ImportError as e:
 
 def get_period_dates(df, period_type):
     """
-    期間タイプに基づいて開始日と終了日を計算
+    期間タイプに基づいて開始日と終了日を取得（期間カレンダーから読み出す）
     """
-    if df is None or df.empty or '日付' not in df.columns:
+    periods = get_period_calendar(df)
+    if not periods:
         return None, None, "データなし"
     
-    max_date = df['日付'].max()
-    min_date = df['日付'].min()
-    
-    if period_type == "直近4週間":
-        start_date = max_date - pd.Timedelta(days=27)
-        desc = f"直近4週間 ({start_date.strftime('%m/%d')}～{max_date.strftime('%m/%d')})"
-    
-    elif period_type == "直近8週":
-        start_date = max_date - pd.Timedelta(days=55)
-        desc = f"直近8週間 ({start_date.strftime('%m/%d')}～{max_date.strftime('%m/%d')})"
-    
-    elif period_type == "直近12週":
-        start_date = max_date - pd.Timedelta(days=83)
-        desc = f"直近12週間 ({start_date.strftime('%m/%d')}～{max_date.strftime('%m/%d')})"
-    
-    elif period_type == "今年度":
-        # 4月始まりの年度
-        year = max_date.year if max_date.month >= 4 else max_date.year - 1
-        start_date = pd.Timestamp(year=year, month=4, day=1)
-        # 年度末または最新データまで
-        end_of_fiscal = pd.Timestamp(year=year+1, month=3, day=31)
-        end_date = min(end_of_fiscal, max_date)
-        desc = f"今年度 ({start_date.strftime('%Y/%m/%d')}～{end_date.strftime('%m/%d')})"
-        return max(start_date, min_date), end_date, desc
-    
-    elif period_type == "先月":
-        # 最新データの前月
-        if max_date.month == 1:
-            year = max_date.year - 1
-            month = 12
-        else:
-            year = max_date.year
-            month = max_date.month - 1
-        
-        start_date = pd.Timestamp(year=year, month=month, day=1)
-        last_day = calendar.monthrange(year, month)[1]
-        end_date = pd.Timestamp(year=year, month=month, day=last_day)
-        
-        # データ範囲内に収める
-        if end_date > max_date:
-            end_date = max_date
-        if start_date < min_date:
-            start_date = min_date
-            
-        desc = f"{year}年{month}月 ({start_date.strftime('%m/%d')}～{end_date.strftime('%m/%d')})"
-        return start_date, end_date, desc
-    
-    elif period_type == "昨年度":
-        # 前年度（4月～3月）
-        current_year = max_date.year if max_date.month >= 4 else max_date.year - 1
-        prev_year = current_year - 1
-        start_date = pd.Timestamp(year=prev_year, month=4, day=1)
-        end_date = pd.Timestamp(year=current_year, month=3, day=31)
-        
-        # データ範囲内に収める
-        if end_date > max_date:
-            end_date = max_date
-        if start_date < min_date:
-            start_date = min_date
-            
-        desc = f"{prev_year}年度 ({start_date.strftime('%Y/%m/%d')}～{end_date.strftime('%Y/%m/%d')})"
-        return start_date, end_date, desc
-    
-    else:
-        # デフォルトは直近4週間
-        start_date = max_date - pd.Timedelta(days=27)
-        desc = f"直近4週間 ({start_date.strftime('%m/%d')}～{max_date.strftime('%m/%d')})"
-    
-    # データ範囲内に収める
-    start_date = max(start_date, min_date)
-    return start_date, max_date, desc
+    # 不明な期間タイプはデフォルトの直近4週間
+    period = periods.get(period_type) or periods["直近4週間"]
+    return period['data_start'], period['data_end'], period['description']
 
 def get_target_values_for_ward(target_data, ward_code, ward_name=None):
     """